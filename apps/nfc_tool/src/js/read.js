@@ -65,6 +65,13 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('nfc-luck').textContent = status[5] !== undefined ? status[5] : '-';
         document.getElementById('nfc-class').textContent = status[6] !== undefined ? status[6] : '-';
         
+        // 真正性確認（NFC_VERIFY_ORIGINALITY=1 の時のみ）で署名が不正だった場合は警告する
+        if (data.originality && data.originality.status === 'invalid') {
+            messageElement.textContent = "⚠️ 正規品でないカードの可能性があります（署名の検証に失敗）";
+            messageElement.style.color = 'orange';
+            return;
+        }
+
         // 読み取り完了メッセージ
         messageElement.textContent = "読み取り中...";
         messageElement.style.color = '#00ff00'; // 緑色
@@ -123,20 +123,21 @@ app.whenReady().then(() => {
   // ============================================
   
   // NFC監視プロセスの管理用変数
+  // 監視プロセスは常駐させ、画面遷移時は stdin の制御コマンドで一時停止・再開する
+  // （毎回プロセスを起動し直すと Python の起動とリーダー初期化で待たされるため）
   let monitorProcess = null;
+  // イベントの送信先（最後に監視を開始した画面）
+  let monitorSender = null;
 
-  // NFC監視開始のハンドラ
-  ipcMain.on('start-nfc-monitor', (event) => {
-    // 既に起動している場合は一度終了する
-    if (monitorProcess) {
-      // #region agent log
-      agentLog('H6', 'apps/nfc_tool/src/main.js:start-nfc-monitor', 'monitorProcess exists -> kill', {
-        pid: monitorProcess.pid || null
-      });
-      // #endregion
-      monitorProcess.kill();
-    }
-    
+  // 監視プロセスに制御コマンド（1行1JSON）を送る
+  const sendMonitorCommand = (command) => {
+    if (!monitorProcess || !monitorProcess.stdin.writable) return false;
+    monitorProcess.stdin.write(JSON.stringify(command) + '\n');
+    return true;
+  };
+
+  // 監視プロセスを起動する
+  const spawnMonitor = () => {
     const scriptPath = path.join(__dirname, 'python/monitor_nfc.py');
     console.log('Starting NFC monitor:', scriptPath);
     
@@ -148,15 +149,17 @@ app.whenReady().then(() => {
       scriptPath
     });
     // #endregion
-    monitorProcess = spawn(pythonCmd, [scriptPath]);
+    const child = spawn(pythonCmd, [scriptPath]);
+    monitorProcess = child;
     
     // 標準出力を取得（リアルタイムでデータが送られてくる）
-    monitorProcess.stdout.on('data', (data) => {
+    child.stdout.on('data', (data) => {
       const lines = data.toString().split('\n');
       lines.forEach(line => {
         if (!line.trim()) return;
         try {
           const json = JSON.parse(line);
+          if (!monitorSender || monitorSender.isDestroyed()) return;
           if (json.type === 'data') {
             // ターミナルにも詳細ログを出力
             console.log('--- NFC Data Received ---');
@@ -164,10 +167,13 @@ app.whenReady().then(() => {
             console.log('-------------------------');
             
             // 読み取りデータをレンダラープロセスに送信
-            event.sender.send('nfc-data-read', json.payload);
+            monitorSender.send('nfc-data-read', json.payload);
           } else if (json.type === 'removed') {
             // カード離脱イベントをレンダラープロセスに送信
-            event.sender.send('nfc-tag-removed');
+            monitorSender.send('nfc-tag-removed');
+          } else if (json.type === 'control' || json.type === 'status' || json.type === 'heartbeat') {
+            // 制御コマンドの応答・状態通知・生存通知
+            monitorSender.send('nfc-monitor-status', json);
           }
         } catch (e) {
           // JSONパースエラーは無視（デバッグ用ログのみ）
@@ -177,24 +183,64 @@ app.whenReady().then(() => {
     });
     
     // 標準エラー出力を取得
-    monitorProcess.stderr.on('data', (data) => {
+    child.stderr.on('data', (data) => {
       console.error('Monitor Error:', data.toString());
     });
+
+    // 終了済みのプロセスへの書き込みエラーでアプリが落ちないようにする
+    child.stdin.on('error', (err) => {
+      console.error('Monitor stdin error:', err.message);
+    });
     
     // プロセス終了時の処理
-    monitorProcess.on('close', (code) => {
+    child.on('close', (code) => {
       console.log(`Monitor process exited with code ${code}`);
       // #region agent log
       agentLog('H6', 'apps/nfc_tool/src/main.js:monitor-close', 'monitor exited', { code });
       // #endregion
-      monitorProcess = null;
+      if (monitorProcess === child) {
+        monitorProcess = null;
+      }
     });
+  };
+
+  // NFC監視開始のハンドラ
+  ipcMain.on('start-nfc-monitor', (event) => {
+    monitorSender = event.sender;
+    // 既に起動している場合は再開コマンドを送る（置かれているカードは読み直される）
+    if (sendMonitorCommand({ cmd: 'resume' })) {
+      // #region agent log
+      agentLog('H6', 'apps/nfc_tool/src/main.js:start-nfc-monitor', 'monitorProcess exists -> resume', {
+        pid: monitorProcess.pid || null
+      });
+      // #endregion
+      return;
+    }
+    spawnMonitor();
   });
 
   // NFC監視停止のハンドラ
   ipcMain.on('stop-nfc-monitor', () => {
     if (monitorProcess) {
-      console.log('Stopping NFC monitor...');
+      console.log('Pausing NFC monitor...');
+      // プロセスは終了させず、リーダーから切断して待機させる
+      sendMonitorCommand({ cmd: 'pause' });
+    }
+  });
+
+  // 監視プロセスへの制御コマンド（set_poll_interval / reread / status など）
+  ipcMain.on('nfc-monitor-command', (event, command) => {
+    if (!command || typeof command.cmd !== 'string') return;
+    if (!sendMonitorCommand(command)) {
+      event.sender.send('nfc-monitor-status', {
+        type: 'control', cmd: command.cmd, ok: false, error: 'monitor is not running'
+      });
+    }
+  });
+
+  // アプリ終了時に監視プロセスも終了させる
+  app.on('will-quit', () => {
+    if (monitorProcess) {
       monitorProcess.kill();
       monitorProcess = null;
     }
@@ -238,6 +284,86 @@ app.whenReady().then(() => {
     });
   });
 
+  // 複数UIDのDBデータ一括取得のハンドラ（管理画面・複数リーダーのゲート用）
+  // UIDをJSON Linesで標準入力に渡し、UID → 結果 の辞書で返す
+  ipcMain.handle('get-db-data-batch', async (event, uids) => {
+    return new Promise((resolve, reject) => {
+      const scriptPath = path.join(__dirname, 'python/get_db_data.py');
+      console.log('Fetching DB data for UIDs:', Array.isArray(uids) ? uids.length : 0);
+
+      const pythonCmd = resolvePythonCommand();
+      const pythonProcess = spawn(pythonCmd, [scriptPath, '--batch']);
+
+      let outputString = '';
+      let errorString = '';
+
+      pythonProcess.stdout.on('data', (data) => {
+        outputString += data.toString();
+      });
+
+      pythonProcess.stderr.on('data', (data) => {
+        errorString += data.toString();
+        console.error('DB Batch Fetch stderr:', data.toString());
+      });
+
+      pythonProcess.on('close', (code) => {
+        // DBエラー時（code 1）も、UIDごとの error 付きの結果を返す
+        const results = {};
+        try {
+          outputString.split('\n').forEach(line => {
+            if (!line.trim()) return;
+            const entry = JSON.parse(line);
+            results[entry.uid] = entry;
+          });
+        } catch (e) {
+          reject(`JSON Parse Error: ${e.message}, Output: ${outputString}`);
+          return;
+        }
+        if (code === 0 || Object.keys(results).length > 0) {
+          resolve(results);
+        } else {
+          reject(`Process exited with code ${code}: ${errorString}`);
+        }
+      });
+
+      (uids || []).forEach(uid => pythonProcess.stdin.write(JSON.stringify({ uid }) + '\n'));
+      pythonProcess.stdin.end();
+    });
+  });
+
+  // ダッシュボード用の集計取得のハンドラ（player_aggregates を読むだけなので登録人数によらず高速）
+  ipcMain.handle('get-dashboard-stats', async () => {
+    return new Promise((resolve, reject) => {
+      const scriptPath = path.join(__dirname, 'python/player_stats.py');
+      const pythonCmd = resolvePythonCommand();
+      const pythonProcess = spawn(pythonCmd, [scriptPath, 'dashboard']);
+
+      let outputString = '';
+      let errorString = '';
+
+      pythonProcess.stdout.on('data', (data) => {
+        outputString += data.toString();
+      });
+
+      pythonProcess.stderr.on('data', (data) => {
+        errorString += data.toString();
+        console.error('Dashboard stderr:', data.toString());
+      });
+
+      pythonProcess.on('close', (code) => {
+        if (code === 0) {
+          try {
+            resolve(JSON.parse(outputString));
+          } catch (e) {
+            reject(`JSON Parse Error: ${e.message}, Output: ${outputString}`);
+          }
+        } else {
+          reject(`Process exited with code ${code}: ${outputString}${errorString}`);
+        }
+      });
+    });
+  });
+
   // ウィンドウを作成
   createWindow();
 
@@ -20,8 +20,16 @@ contextBridge.exposeInMainWorld('electronAPI', {
   onNfcDataRead: (callback) => ipcRenderer.on('nfc-data-read', (_event, value) => callback(value)),
   // タグ離脱イベントを受け取るリスナーを設定
   onNfcTagRemoved: (callback) => ipcRenderer.on('nfc-tag-removed', (_event) => callback()),
+  // 監視プロセスに制御コマンドを送る（例: { cmd: 'set_poll_interval', value: 0.5 }）
+  sendNfcMonitorCommand: (command) => ipcRenderer.send('nfc-monitor-command', command),
+  // 制御コマンドの応答・状態通知・生存通知を受け取るリスナーを設定
+  onNfcMonitorStatus: (callback) => ipcRenderer.on('nfc-monitor-status', (_event, value) => callback(value)),
   
   // --- DB連携機能 ---
   // UIDを元にDBからデータを取得する (Promiseを返す)
-  getDbData: (uid) => ipcRenderer.invoke('get-db-data', uid)
+  getDbData: (uid) => ipcRenderer.invoke('get-db-data', uid),
+  // 複数UIDのデータをまとめて取得する (UID → 結果 の辞書を返すPromise)
+  getDbDataBatch: (uids) => ipcRenderer.invoke('get-db-data-batch', uids),
+  // ダッシュボード用の集計（登録人数・所持金合計・ステータス平均）を取得する
+  getDashboardStats: () => ipcRenderer.invoke('get-dashboard-stats')
 });
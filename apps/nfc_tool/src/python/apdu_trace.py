@@ -0,0 +1,457 @@
+import os
+import sys
+import io
+import json
+import time
+import struct
+import atexit
+import argparse
+import threading
+from datetime import datetime
+
+from smartcard.Exceptions import CardConnectionException
+
+from app_paths import data_path
+
+# ============================================
+# APDUトレースの記録と再生
+# ============================================
+# 特定のリーダー/カードの組み合わせで起きる不具合を再現するため、
+# read_page / write_page / get_uid が使う接続をラップし、全APDUをバイナリで記録する。
+# 記録したトレースは ReplayConnection で read_nfc_data や書き込み処理にそのまま流し込める。
+# 監視プロセスの記録は monitor_nfc.ReplayCore で監視と同じ手順で再生するため、
+# NFC_ARRIVE_DEBOUNCE などの監視の設定は記録時と同じ値で再生すること。
+#
+# 記録の有効化: 環境変数 NFC_APDU_TRACE=<ファイルパス>（'1' なら data/apdu_YYYYmmdd_HHMMSS.trace）
+#
+# ファイル形式（リトルエンディアン）:
+#   ヘッダ : magic(8) "APDUTRC1", version(u8), 記録開始のUNIX時刻(f64)
+#   レコード: kind(u8), 開始からの経過(u64, μs), 所要時間(u32, μs), SW1(u8), SW2(u8),
+#            コマンド長(u8), 応答長(u16), コマンド, 応答
+#   ※ 例外時は応答欄に例外メッセージ（UTF-8）を入れる
+
+MAGIC = b'APDUTRC1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sBd')
+RECORD = struct.Struct('<BQIBBBH')
+
+# レコード種別
+KIND_APDU = 0         # APDU送受信（正常）
+KIND_APDU_ERROR = 1   # APDU送信中に例外（カード離脱など）
+KIND_CONNECT = 2      # カードへの接続
+KIND_DISCONNECT = 3   # カードからの切断
+
+class TraceRecord:
+    """トレース1件分"""
+
+    __slots__ = ('kind', 'offset_us', 'duration_us', 'command', 'response', 'sw1', 'sw2')
+
+    def __init__(self, kind, offset_us, duration_us, command=b'', response=b'', sw1=0, sw2=0):
+        self.kind = kind
+        self.offset_us = offset_us
+        self.duration_us = duration_us
+        self.command = bytes(command)
+        self.response = bytes(response)
+        self.sw1 = sw1
+        self.sw2 = sw2
+
+    def to_dict(self):
+        record = {'kind': self.kind, 'offset_ms': self.offset_us / 1000, 'duration_ms': self.duration_us / 1000}
+        if self.kind in (KIND_APDU, KIND_APDU_ERROR):
+            record['command'] = self.command.hex(' ').upper()
+        if self.kind == KIND_APDU:
+            record['response'] = self.response.hex(' ').upper()
+            record['sw'] = f"{self.sw1:02X}{self.sw2:02X}"
+        elif self.kind == KIND_APDU_ERROR:
+            record['error'] = self.response.decode('utf-8', errors='replace')
+        return record
+
+# ============================================
+# 記録
+# ============================================
+
+class TraceWriter:
+    """トレースファイルへの追記（複数の接続から使えるようロックする）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.start = time.time()
+        self.start_perf = time.perf_counter()
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.start))
+
+    def now_us(self):
+        """記録開始からの経過時間（μs）"""
+        return int((time.perf_counter() - self.start_perf) * 1_000_000)
+
+    def write(self, kind, started_us, duration_us, command=b'', response=b'', sw1=0, sw2=0):
+        command = bytes(command)[:255]
+        response = bytes(response)[:65535]
+        with self.lock:
+            self.file.write(RECORD.pack(kind, started_us, min(duration_us, 0xFFFFFFFF),
+                                        sw1, sw2, len(command), len(response)))
+            self.file.write(command)
+            self.file.write(response)
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+class TracingConnection:
+    """
+    pyscard の接続をラップし、transmit / connect / disconnect を記録する
+
+    それ以外の属性は元の接続にそのまま委譲する。
+    """
+
+    def __init__(self, connection, writer):
+        self._connection = connection
+        self._writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def connect(self, *args, **kwargs):
+        started = self._writer.now_us()
+        result = self._connection.connect(*args, **kwargs)
+        # 接続失敗（カード未設置）はポーリングのたびに発生するため記録しない
+        self._writer.write(KIND_CONNECT, started, self._writer.now_us() - started)
+        return result
+
+    def disconnect(self, *args, **kwargs):
+        started = self._writer.now_us()
+        try:
+            return self._connection.disconnect(*args, **kwargs)
+        finally:
+            self._writer.write(KIND_DISCONNECT, started, self._writer.now_us() - started)
+            # カード1枚分の区切りでディスクに書き出す
+            self._writer.flush()
+
+    def transmit(self, command, *args, **kwargs):
+        started = self._writer.now_us()
+        try:
+            data, sw1, sw2 = self._connection.transmit(command, *args, **kwargs)
+        except Exception as e:
+            self._writer.write(KIND_APDU_ERROR, started, self._writer.now_us() - started,
+                               command, f"{type(e).__name__}: {e}".encode('utf-8'))
+            raise
+        self._writer.write(KIND_APDU, started, self._writer.now_us() - started,
+                           command, data, sw1, sw2)
+        return data, sw1, sw2
+
+_writer = None
+
+def writer_from_env():
+    """
+    環境変数 NFC_APDU_TRACE から記録先を決め、TraceWriter を返す（無効ならNone）
+
+    プロセス内で1つのファイルにまとめて記録する。
+    """
+    global _writer
+    value = os.getenv('NFC_APDU_TRACE', '').strip()
+    if not value or value == '0':
+        return None
+    if _writer is None:
+        if value == '1':
+            path = data_path(f"apdu_{datetime.now().strftime('%Y%m%d_%H%M%S')}.trace")
+        else:
+            path = value
+        _writer = TraceWriter(path)
+        # nfc_writer.py のように切断せずに終了するプロセスでも末尾まで書き出す
+        atexit.register(_writer.close)
+        print(f"APDUトレースを記録しています: {path}", file=sys.stderr)
+    return _writer
+
+def wrap_connection(connection):
+    """記録が有効なら接続をラップして返す（無効ならそのまま返す）"""
+    writer = writer_from_env()
+    return TracingConnection(connection, writer) if writer else connection
+
+# ============================================
+# 読み込みと再生
+# ============================================
+
+def load_trace(path):
+    """
+    トレースファイルを読み込む
+
+    Returns:
+        (記録開始時刻, TraceRecord のリスト)
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    magic, version, started_at = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise ValueError(f"APDUトレースファイルではありません: {path}")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"未対応のトレース形式です (version {version})")
+
+    records = []
+    pos = HEADER.size
+    while pos + RECORD.size <= len(raw):
+        kind, offset_us, duration_us, sw1, sw2, cmd_len, resp_len = RECORD.unpack_from(raw, pos)
+        pos += RECORD.size
+        if pos + cmd_len + resp_len > len(raw):
+            # 書き込み途中で終了したファイルの末尾は捨てる
+            break
+        command = raw[pos:pos + cmd_len]
+        pos += cmd_len
+        response = raw[pos:pos + resp_len]
+        pos += resp_len
+        records.append(TraceRecord(kind, offset_us, duration_us, command, response, sw1, sw2))
+    return started_at, records
+
+def split_sessions(records):
+    """
+    connect〜disconnect の区間（カード1枚分の接続）ごとにAPDUレコードを分ける
+
+    Returns:
+        list: APDUレコードのリストのリスト
+    """
+    sessions = []
+    current = None
+    for record in records:
+        if record.kind == KIND_CONNECT:
+            current = []
+            sessions.append(current)
+        elif record.kind == KIND_DISCONNECT:
+            current = None
+        elif current is not None:
+            current.append(record)
+    return [s for s in sessions if s]
+
+class ReplayMismatchError(Exception):
+    """
+    再生中のコードが記録と異なるAPDUを送った
+
+    read_page などは例外を握りつぶすため、呼び出し側には届かないことがある。
+    不一致は ReplayConnection.mismatch にも記録されるので、再生後はそちらを確認すること。
+    """
+    pass
+
+class ReplayReadError(Exception):
+    """再生した読み取り処理がデータを返さなかった"""
+    pass
+
+class ReplayConnection:
+    """
+    記録したAPDUを順番に返す、pyscard の接続互換オブジェクト
+
+    Args:
+        records: 1セッション分のAPDUレコード
+        speed: 再生速度（1.0 = 記録どおりの時間、10 = 10倍速、0 = 待ち時間なし）
+        strict: Trueなら送られたコマンドが記録と一致するか検証する
+
+    speed > 0 の時は、各応答を記録上の完了時刻（セッション先頭からの経過 / speed）まで待って返す。
+    APDUの所要時間だけでなく、APDU間の間隔（ポーリングの待ちなど）も記録どおりに再現される。
+    """
+
+    def __init__(self, records, speed=1.0, strict=True):
+        self.records = list(records)
+        self.speed = speed
+        self.strict = strict
+        self.position = 0
+        # 最初のAPDUを再生した時刻（time.perf_counter）
+        self.started = None
+        # 最初に検出した不一致（なければNone）
+        self.mismatch = None
+
+    def remaining(self):
+        """未再生のレコード数"""
+        return len(self.records) - self.position
+
+    def next_commands(self, count):
+        """次に再生するレコードのコマンドを最大 count 件返す"""
+        return [record.command for record in self.records[self.position:self.position + count]]
+
+    def next_command(self):
+        """次に再生するレコードのコマンド（記録の終わりならNone）"""
+        commands = self.next_commands(1)
+        return commands[0] if commands else None
+
+    def clock(self):
+        """
+        記録上の現在時刻（記録開始からの秒）
+
+        次に再生するAPDUの開始時刻とする（最後まで再生したら最後のAPDUの終了時刻）。
+        監視コアはポーリングの待ちの直後にAPDUを送るため、判定を行った時刻に最も近い。
+        """
+        if self.position < len(self.records):
+            return self.records[self.position].offset_us / 1_000_000
+        if not self.records:
+            return 0.0
+        last = self.records[-1]
+        return (last.offset_us + last.duration_us) / 1_000_000
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def disconnect(self, *args, **kwargs):
+        pass
+
+    def transmit(self, command, *args, **kwargs):
+        if self.position >= len(self.records):
+            # 記録の終わり = カードが離された
+            raise CardConnectionException("Trace exhausted")
+        record = self.records[self.position]
+        self.position += 1
+
+        if self.strict and bytes(command) != record.command:
+            message = (f"APDU #{self.position}: 記録 {record.command.hex(' ').upper()} / "
+                       f"送信 {bytes(command).hex(' ').upper()}")
+            if self.mismatch is None:
+                self.mismatch = message
+            raise ReplayMismatchError(message)
+        if self.speed > 0:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now
+            elapsed_us = record.offset_us + record.duration_us - self.records[0].offset_us
+            wait = self.started + elapsed_us / 1_000_000 / self.speed - now
+            if wait > 0:
+                time.sleep(wait)
+        if record.kind == KIND_APDU_ERROR:
+            raise CardConnectionException(record.response.decode('utf-8', errors='replace'))
+        return list(record.response), record.sw1, record.sw2
+
+def _written_card_args(records):
+    """
+    書き込みセッションの UPDATE BINARY から nfc_writer.write_player_card の引数を復元する
+    """
+    pages = {}
+    for record in records:
+        if record.kind == KIND_APDU and len(record.command) >= 9 and record.command[1] == 0xD6:
+            pages[record.command[3]] = record.command[5:9]
+    name_bytes = b''.join(pages.get(page, b'\x00' * 4) for page in range(4, 9))
+    status_bytes = b''.join(pages.get(page, b'\x00' * 4) for page in range(9, 13))
+    name = name_bytes.rstrip(b'\x00').decode('utf-8', errors='replace')
+    values = [int.from_bytes(status_bytes[i:i + 2], 'little') for i in range(0, 14, 2)]
+    return [name] + values
+
+def replay(path, target, speed, strict):
+    """
+    トレースを monitor_nfc または nfc_writer の処理に流し込み、結果と所要時間を出力する
+
+    読み取りセッションは monitor_nfc.ReplayCore で監視コアと同じ手順（存在確認・安定待ち・読み取り）で再生し、
+    セッションを跨いでカードの状態を持ち越す。data を出さなかったセッションは、
+    フラップとして抑止された場合を除いて失敗とする。
+
+    Returns:
+        bool: 全セッションが記録どおりに再生できたらTrue
+    """
+    _, records = load_trace(path)
+    sessions = split_sessions(records)
+    all_ok = True
+    core = None
+
+    for index, session in enumerate(sessions, start=1):
+        conn = ReplayConnection(session, speed=speed, strict=strict)
+        recorded_ms = (session[-1].offset_us + session[-1].duration_us - session[0].offset_us) / 1000
+        result = {'session': index, 'apdus': len(session), 'recorded_ms': round(recorded_ms, 1)}
+        session_target = target
+        if target == 'auto':
+            # UPDATE BINARY を含むセッションは書き込み、それ以外は読み取りとみなす
+            is_write = any(r.kind == KIND_APDU and len(r.command) > 1 and r.command[1] == 0xD6 for r in session)
+            session_target = 'writer' if is_write else 'monitor'
+        result['target'] = session_target
+        # 再生先の読み込み（import）は所要時間に含めない
+        if session_target == 'writer':
+            import nfc_writer
+            import card_archive
+        elif core is None:
+            import monitor_nfc
+            core = monitor_nfc.ReplayCore()
+        started = time.perf_counter()
+        try:
+            if session_target == 'writer':
+                capture = card_archive.CapturingConnection(conn)
+                nfc_writer.write_player_card(capture, *_written_card_args(session))
+                if conn.remaining() > 1:
+                    # NFC_CARD_ARCHIVE 指定時の記録: 最後の get_uid の前に未読ページの読み足しがある
+                    capture.read_missing()
+                uid = nfc_writer.get_uid(conn) if conn.remaining() else None
+                result['uid'] = uid
+            else:
+                summary = core.replay_session(conn)
+                payloads = [event['payload'] for event in summary['events'] if event['type'] == 'data']
+                result['data'] = payloads[-1] if payloads else None
+                result['events'] = [event['type'] for event in summary['events']]
+                result['presence'] = summary['presence']
+                result['presence_polls'] = summary['presence_polls']
+                if not payloads:
+                    if summary['flaps_suppressed']:
+                        result['suppressed'] = 'flap'
+                    else:
+                        raise ReplayReadError("カードのデータを復元できませんでした")
+            result['outcome'] = 'ok'
+        except ReplayMismatchError as e:
+            result['outcome'] = 'mismatch'
+            result['error'] = str(e)
+            all_ok = False
+        except ReplayReadError as e:
+            result['outcome'] = 'read_failed'
+            result['error'] = str(e)
+            all_ok = False
+        except CardConnectionException as e:
+            result['outcome'] = 'card_error'
+            result['error'] = str(e)
+        except SystemExit:
+            result['outcome'] = 'write_failed'
+        result['replayed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        if conn.mismatch and result['outcome'] != 'mismatch':
+            # read_page / get_uid が例外を握りつぶした不一致
+            result['outcome'] = 'mismatch'
+            result['error'] = conn.mismatch
+            all_ok = False
+        if strict and result['outcome'] == 'ok' and conn.remaining():
+            result['outcome'] = 'unconsumed'
+            result['unconsumed_apdus'] = conn.remaining()
+            all_ok = False
+        print(json.dumps(result, ensure_ascii=False))
+        sys.stdout.flush()
+    return all_ok
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='APDUトレースの表示・再生ツール')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    dump_parser = sub.add_parser('dump', help='トレースの内容をJSON Linesで表示する')
+    dump_parser.add_argument('trace')
+
+    replay_parser = sub.add_parser('replay', help='トレースを読み取り/書き込み処理に流し込む')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--target', choices=['auto', 'monitor', 'writer'], default='auto',
+                               help='再生先の処理 (既定: %(default)s)')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='再生速度の倍率（0で待ち時間なし）')
+    replay_parser.add_argument('--loose', action='store_true',
+                               help='送信コマンドと記録の一致を検証しない')
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        started_at, records = load_trace(args.trace)
+        print(json.dumps({'started_at': datetime.fromtimestamp(started_at).isoformat(),
+                          'records': len(records)}, ensure_ascii=False))
+        for record in records:
+            print(json.dumps(record.to_dict(), ensure_ascii=False))
+        return
+
+    if not replay(args.trace, args.target, args.speed, not args.loose):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
@@ -0,0 +1,23 @@
+import os
+from pathlib import Path
+
+# ============================================
+# ローカルデータの保存先
+# ============================================
+
+# キュー・キャッシュ・アーカイブなど、端末ローカルに残すファイルの置き場所
+# 既定では apps/nfc_tool/data/ （環境変数 NFC_DATA_DIR で変更可能）
+DATA_DIR = Path(os.getenv('NFC_DATA_DIR', Path(__file__).resolve().parents[2] / 'data'))
+
+def data_path(name):
+    """
+    ローカルデータディレクトリ内のファイルパスを返す（ディレクトリが無ければ作成する）
+
+    Args:
+        name: ファイル名
+
+    Returns:
+        Path: DATA_DIR / name
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / name
@@ -0,0 +1,14 @@
+# ============================================
+# 計測ツール共通の統計処理
+# ============================================
+# load_generator.py（偽リーダーを使う）と db_benchmark.py（DBだけを使う）の両方から使うため、
+# pyscard や MySQL に依存しないモジュールにしている。
+
+import math
+
+def percentile(sorted_values, p):
+    """ソート済みリストの p パーセンタイル（最近傍法: 小さい方から ceil(p/100 * n) 番目）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
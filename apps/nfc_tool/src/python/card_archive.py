@@ -0,0 +1,612 @@
+import os
+import sys
+import io
+import json
+import mmap
+import time
+import struct
+import argparse
+import threading
+from datetime import datetime
+
+from app_paths import data_path
+
+# ============================================
+# カードイメージのアーカイブ（バックアップと一括復元）
+# ============================================
+# リストバンドを紛失・破損した時のために、読み取り・書き込みのたびに
+# カード全体のイメージ（UID + ページ4〜39の生データ）を追記専用ファイルに保存する。
+# DB（player_status）には無いインベントリ（ページ13〜39）も復元できる。
+#
+# 記録の有効化: 環境変数 NFC_CARD_ARCHIVE=<ファイルパス>（'1' なら data/card_images.bin）
+#
+# アーカイブ（リトルエンディアン, 固定長レコードなので mmap でそのまま参照できる）:
+#   ヘッダ : magic(8) "CARDARC1", version(u8), 作成時のUNIX時刻(f64)
+#   レコード: UID長(u8), UID(10, 0埋め), 記録時刻(f64), 記録元(u8),
+#            有効ページのビットマスク(u64), ページ0〜39の内容(160)
+#
+# 索引（アーカイブと同じ場所の .idx）:
+#   ヘッダ : magic(8) "CARDIDX1", version(u8), 索引済みのレコード数(u64), 件数(u64)
+#   エントリ: キー(11 = UID長 + UID), 最新レコードの番号(u32)  ※キーの昇順
+#   索引作成後に追記されたレコードは末尾から線形に探し、残りは二分探索で引く（O(log n)）。
+
+MAGIC = b'CARDARC1'
+INDEX_MAGIC = b'CARDIDX1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sBd')
+RECORD = struct.Struct('<B10sdBQ160s')
+INDEX_HEADER = struct.Struct('<8sBQQ')
+INDEX_ENTRY = struct.Struct('<11sI')
+
+UID_MAX = 10
+PAGE_COUNT = 40
+# 復元の対象とするページ（0〜3 はUID・ロック・OTP領域のため書き込まない）
+USER_PAGES = range(4, PAGE_COUNT)
+
+# 記録元
+SOURCE_MONITOR = 1   # monitor_nfc.py の読み取り
+SOURCE_WRITER = 2    # nfc_writer.py の書き込み
+SOURCE_RESTORE = 3   # このツールによる復元
+SOURCE_NAMES = {SOURCE_MONITOR: 'monitor', SOURCE_WRITER: 'writer', SOURCE_RESTORE: 'restore'}
+
+# 索引作成後の追記がこの件数を超えたら、CLIで索引を作り直す
+TAIL_REINDEX = 1024
+
+# ============================================
+# UID・カードイメージ
+# ============================================
+
+def parse_uid(text):
+    """'04:A1:B2:...' 形式のUIDをバイト列に変換する"""
+    uid = bytes.fromhex(text.replace(':', '').replace(' ', ''))
+    if not 0 < len(uid) <= UID_MAX:
+        raise ValueError(f"UIDの長さが不正です: {text}")
+    return uid
+
+def format_uid(uid):
+    """バイト列のUIDを monitor_nfc と同じ '04:A1:B2:...' 形式にする"""
+    return ':'.join(f"{b:02X}" for b in uid)
+
+def uid_key(uid):
+    """索引の並び順に使うキー（UID長 + 0埋めしたUID）"""
+    return bytes([len(uid)]) + uid.ljust(UID_MAX, b'\x00')
+
+class CardImage:
+    """カード1枚分のイメージ"""
+
+    __slots__ = ('uid', 'written_at', 'source', 'pages')
+
+    def __init__(self, uid, pages, source, written_at=None):
+        self.uid = bytes(uid)
+        self.pages = {page: bytes(data) for page, data in pages.items()}  # ページ番号 → 4バイト
+        self.source = source
+        self.written_at = written_at if written_at is not None else time.time()
+
+    def pack(self):
+        mask = 0
+        body = bytearray(PAGE_COUNT * 4)
+        for page, data in self.pages.items():
+            mask |= 1 << page
+            body[page * 4:page * 4 + 4] = data[:4].ljust(4, b'\x00')
+        return RECORD.pack(len(self.uid), self.uid.ljust(UID_MAX, b'\x00'), self.written_at,
+                           self.source, mask, bytes(body))
+
+    @classmethod
+    def unpack(cls, raw, offset=0):
+        uid_len, uid, written_at, source, mask, body = RECORD.unpack_from(raw, offset)
+        pages = {page: body[page * 4:page * 4 + 4] for page in range(PAGE_COUNT) if mask >> page & 1}
+        return cls(uid[:uid_len], pages, source, written_at)
+
+    def page_bytes(self, pages):
+        """指定ページを連結したバイト列（記録の無いページは None）"""
+        if any(page not in self.pages for page in pages):
+            return None
+        return b''.join(self.pages[page] for page in pages)
+
+    def to_dict(self):
+        """monitor_nfc.read_nfc_data と同じ形式（＋記録情報）の辞書を返す"""
+        name_bytes = self.page_bytes(range(4, 9))
+        status_bytes = self.page_bytes(range(9, 13))
+        name = None
+        if name_bytes is not None:
+            try:
+                name = name_bytes.decode('utf-8').rstrip('\x00')
+            except UnicodeDecodeError:
+                name = "Unknown"
+        return {
+            "idm": format_uid(self.uid),
+            "name": name,
+            "status": [int.from_bytes(status_bytes[i:i + 2], 'little') for i in range(0, 16, 2)]
+                      if status_bytes is not None else None,
+            "inventory": [{"page": page, "data": self.pages[page].hex(' ').upper()}
+                          for page in range(13, PAGE_COUNT) if page in self.pages],
+            "written_at": datetime.fromtimestamp(self.written_at).isoformat(timespec='seconds'),
+            "source": SOURCE_NAMES.get(self.source, str(self.source)),
+            "pages": len(self.pages)
+        }
+
+# ============================================
+# 記録
+# ============================================
+
+class CapturingConnection:
+    """
+    pyscard の接続をラップし、やり取りしたUIDとページ内容を覚えておく
+
+    読み取り・書き込みのAPDUをそのまま流用するので、アーカイブ用に追加の通信は発生しない。
+    それ以外の属性は元の接続にそのまま委譲する。
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.uid = None
+        self.pages = {}
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def transmit(self, command, *args, **kwargs):
+        data, sw1, sw2 = self._connection.transmit(command, *args, **kwargs)
+        if sw1 == 0x90 and sw2 == 0x00 and len(command) >= 4:
+            ins, page = command[1], command[3]
+            if ins == 0xCA:
+                # GET DATA (UID)
+                if self.uid is not None and self.uid != bytes(data):
+                    # 差し替えられたカードの内容を混ぜない
+                    self.pages = {}
+                self.uid = bytes(data)
+            elif ins == 0xB0 and page < PAGE_COUNT and len(data) >= 4:
+                # READ BINARY（リーダーによっては16バイト返るので先頭4バイトだけ使う）
+                self.pages[page] = bytes(data[:4])
+            elif ins == 0xD6 and page < PAGE_COUNT and len(command) >= 9:
+                # UPDATE BINARY
+                self.pages[page] = bytes(command[5:9])
+        return data, sw1, sw2
+
+    def read_missing(self, pages=USER_PAGES):
+        """まだ内容の分からないUID・ページを読み取る（読めなくなったらそこで終了）"""
+        if self.uid is None:
+            self.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00])
+        for page in pages:
+            if page in self.pages:
+                continue
+            _, sw1, sw2 = self.transmit([0xFF, 0xB0, 0x00, page, 0x04])
+            if sw1 != 0x90 or sw2 != 0x00:
+                break
+
+    def image(self, source):
+        """覚えている内容から CardImage を作る（UIDが分からなければNone）"""
+        if self.uid is None or not 0 < len(self.uid) <= UID_MAX:
+            return None
+        return CardImage(self.uid, {page: data for page, data in self.pages.items() if page in USER_PAGES}, source)
+
+class ArchiveWriter:
+    """
+    アーカイブへの追記
+
+    複数プロセス（モニターと書き込み）が同じファイルに追記するため、
+    固定長レコードを1回の write で追記モードに書き込む。
+    直前に追記したイメージと同じ内容が続く場合（同じカードの再タップ）は記録しない。
+    覚えておくのは直前の1件だけ（常駐するモニターでUIDごとに溜め込まないため）。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'xb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time()))
+        except FileExistsError:
+            pass
+        self.file = open(self.path, 'ab', buffering=0)
+        # 直前に追記したイメージの (UID, ページ内容)
+        self.last = None
+
+    def append(self, image):
+        """
+        イメージを追記する
+
+        Returns:
+            bool: 追記したらTrue（直前と同じ内容ならFalse）
+        """
+        key = (image.uid, tuple(sorted(image.pages.items())))
+        with self.lock:
+            if self.last == key:
+                return False
+            self.file.write(image.pack())
+            self.last = key
+            return True
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+_writer = None
+
+def writer_from_env():
+    """
+    環境変数 NFC_CARD_ARCHIVE から記録先を決め、ArchiveWriter を返す（無効ならNone）
+    """
+    global _writer
+    value = os.getenv('NFC_CARD_ARCHIVE', '').strip()
+    if not value or value == '0':
+        return None
+    if _writer is None:
+        _writer = ArchiveWriter(data_path('card_images.bin') if value == '1' else value)
+    return _writer
+
+def wrap_connection(connection):
+    """記録が有効なら接続をラップして返す（無効ならそのまま返す）"""
+    return CapturingConnection(connection) if writer_from_env() else connection
+
+def record(connection, source, complete=False):
+    """
+    接続で読み書きした内容をアーカイブに追記する（記録が無効なら何もしない）
+
+    アーカイブの失敗で読み取り・書き込み本体を止めないよう、エラーは標準エラー出力に出すだけにする。
+
+    Args:
+        connection: wrap_connection で作った接続
+        source: 記録元（SOURCE_*）
+        complete: Trueなら未読のページ（インベントリなど）を読み足してから記録する
+
+    Returns:
+        bool: 追記したらTrue
+    """
+    writer = writer_from_env()
+    if writer is None or not isinstance(connection, CapturingConnection):
+        return False
+    try:
+        if complete:
+            connection.read_missing()
+        image = connection.image(source)
+        return writer.append(image) if image else False
+    except Exception as e:
+        print(f"警告: カードイメージのアーカイブに失敗しました: {e}", file=sys.stderr)
+        return False
+
+# ============================================
+# 参照（mmap + 索引）
+# ============================================
+
+def index_path(path):
+    return str(path) + '.idx'
+
+class CardArchive:
+    """
+    アーカイブの読み取り
+
+    ファイル全体は読み込まず mmap で参照する。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.file = open(self.path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"カードアーカイブではありません: {self.path}")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.created_at = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"カードアーカイブではありません: {self.path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"未対応のアーカイブ形式です (version {version})")
+        # 書き込み途中のレコード（末尾の端数）は数えない
+        self.count = (size - HEADER.size) // RECORD.size
+        self.index_map = None
+        self.index_file = None
+        self.indexed = 0
+        self.entries = 0
+        self._open_index()
+
+    def close(self):
+        for handle in (self.index_map, self.index_file, self.map, self.file):
+            if handle is not None:
+                handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, number):
+        return HEADER.size + number * RECORD.size
+
+    def key_at(self, number):
+        """レコードのキー（UID長 + UID）"""
+        offset = self._offset(number)
+        return self.map[offset:offset + 1 + UID_MAX]
+
+    def record_at(self, number):
+        return CardImage.unpack(self.map, self._offset(number))
+
+    def _open_index(self):
+        path = index_path(self.path)
+        if not os.path.exists(path) or os.path.getsize(path) < INDEX_HEADER.size:
+            return
+        index_file = open(path, 'rb')
+        index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, indexed, entries = INDEX_HEADER.unpack_from(index_map, 0)
+        # 壊れた索引や、アーカイブより新しい索引（ファイルを差し替えた等）は使わない
+        if (magic != INDEX_MAGIC or version != FORMAT_VERSION or indexed > self.count
+                or len(index_map) < INDEX_HEADER.size + entries * INDEX_ENTRY.size):
+            index_map.close()
+            index_file.close()
+            return
+        self.index_file, self.index_map = index_file, index_map
+        self.indexed, self.entries = indexed, entries
+
+    def tail(self):
+        """索引に含まれていないレコード数"""
+        return self.count - self.indexed
+
+    def lookup(self, uid):
+        """
+        UIDの最新イメージを返す（無ければNone）
+
+        索引作成後の追記分を新しい順に探し、見つからなければ索引を二分探索する。
+        """
+        key = uid_key(uid)
+        for number in range(self.count - 1, self.indexed - 1, -1):
+            if self.key_at(number) == key:
+                return self.record_at(number)
+
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_key, number = INDEX_ENTRY.unpack_from(self.index_map, INDEX_HEADER.size + mid * INDEX_ENTRY.size)
+            if entry_key == key:
+                return self.record_at(number)
+            if entry_key < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def latest_numbers(self):
+        """UIDごとの最新レコード番号（キー → 番号）"""
+        latest = {}
+        if self.index_map is not None:
+            for i in range(self.entries):
+                key, number = INDEX_ENTRY.unpack_from(self.index_map, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+                latest[key] = number
+        for number in range(self.indexed, self.count):
+            latest[self.key_at(number)] = number
+        return latest
+
+def build_index(path):
+    """
+    アーカイブ全体を走査して索引を作り直す
+
+    Returns:
+        (索引済みのレコード数, UIDの件数)
+    """
+    with CardArchive(path) as archive:
+        latest = archive.latest_numbers()
+        count = archive.count
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, FORMAT_VERSION, count, len(latest)))
+        for key in sorted(latest):
+            f.write(INDEX_ENTRY.pack(key, latest[key]))
+    os.replace(tmp_path, index_path(path))
+    return count, len(latest)
+
+def open_archive(path):
+    """アーカイブを開く。索引に含まれない追記が多ければ先に索引を作り直す"""
+    archive = CardArchive(path)
+    if archive.tail() > TAIL_REINDEX:
+        archive.close()
+        build_index(path)
+        archive = CardArchive(path)
+    return archive
+
+# ============================================
+# 一括復元
+# ============================================
+
+def _wait_for_card(timeout):
+    """カードが置かれるまで待ち、接続を返す（タイムアウト時はNone）"""
+    from smartcard.System import readers
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        r = readers()
+        if r:
+            connection = r[0].createConnection()
+            try:
+                connection.connect()
+                return connection
+            except Exception:
+                pass
+        time.sleep(0.2)
+    return None
+
+def _wait_for_removal(connection):
+    """カードが離されるまで待つ"""
+    import nfc_writer
+    while True:
+        try:
+            if not nfc_writer.get_uid(connection):
+                break
+        except Exception:
+            break
+        time.sleep(0.2)
+    try:
+        connection.disconnect()
+    except Exception:
+        pass
+
+def _is_blank(connection):
+    """名前・ステータス領域（ページ4〜12）が全て0なら未使用のカードとみなす"""
+    for page in range(4, 13):
+        data, sw1, sw2 = connection.transmit([0xFF, 0xB0, 0x00, page, 0x04])
+        if sw1 != 0x90 or sw2 != 0x00 or any(data[:4]):
+            return False
+    return True
+
+def restore_image(connection, image, force=False):
+    """
+    置かれたカードにイメージを書き込み、読み戻して検証する
+
+    元と同じUIDのカード（破損したカードの修復）か、未使用のカードにだけ書き込む。
+
+    Returns:
+        (結果, 書き込み先のUID)  結果は restored / not_blank / write_failed / verify_failed
+    """
+    import nfc_writer
+    uid = parse_uid(nfc_writer.get_uid(connection) or '')
+    if uid != image.uid and not force and not _is_blank(connection):
+        return 'not_blank', uid
+
+    for page in sorted(image.pages):
+        if page not in USER_PAGES:
+            continue
+        if not nfc_writer.write_page(connection, page, list(image.pages[page])):
+            return 'write_failed', uid
+    for page in sorted(image.pages):
+        if page not in USER_PAGES:
+            continue
+        data, sw1, sw2 = connection.transmit([0xFF, 0xB0, 0x00, page, 0x04])
+        if sw1 != 0x90 or sw2 != 0x00 or bytes(data[:4]) != image.pages[page]:
+            return 'verify_failed', uid
+    return 'restored', uid
+
+def restore(path, uids, force=False, rekey_db=False, timeout=30):
+    """
+    アーカイブのイメージを、タッチされたカードに順番に書き込む
+
+    Args:
+        path: アーカイブのパス
+        uids: 復元するUIDのリスト
+        force: Trueなら未使用でないカードにも上書きする
+        rekey_db: Trueなら player_status の nfc_card_id を新しいカードのUIDに付け替える
+        timeout: 1枚あたりのカード待ち時間（秒）
+
+    Returns:
+        bool: 全て復元できたらTrue
+    """
+    with open_archive(path) as archive:
+        images = []
+        for text in uids:
+            image = archive.lookup(parse_uid(text))
+            if image is None:
+                print(json.dumps({"uid": text, "outcome": "not_found"}, ensure_ascii=False))
+            else:
+                images.append(image)
+    all_ok = len(images) == len(uids)
+    writer = ArchiveWriter(path)
+
+    for number, image in enumerate(images, start=1):
+        while True:
+            print(f"[{number}/{len(images)}] {format_uid(image.uid)} の復元先カードをタッチしてください...",
+                  file=sys.stderr)
+            connection = _wait_for_card(timeout)
+            if connection is None:
+                print(json.dumps({"uid": format_uid(image.uid), "outcome": "timeout"}, ensure_ascii=False))
+                writer.close()
+                return False
+            started = time.perf_counter()
+            try:
+                outcome, new_uid = restore_image(connection, image, force)
+            except Exception as e:
+                outcome, new_uid = 'card_error', None
+                print(f"エラー: {e}", file=sys.stderr)
+            result = {"uid": format_uid(image.uid), "outcome": outcome,
+                      "target_uid": format_uid(new_uid) if new_uid else None,
+                      "pages": len(image.pages), "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+            if outcome == 'restored':
+                writer.append(CardImage(new_uid, image.pages, SOURCE_RESTORE))
+                if rekey_db and new_uid != image.uid:
+                    result["db_rows"] = _rekey_player(format_uid(image.uid), format_uid(new_uid))
+            print(json.dumps(result, ensure_ascii=False))
+            sys.stdout.flush()
+            _wait_for_removal(connection)
+            if outcome == 'restored':
+                break
+            # 失敗したら同じイメージで別のカードを待つ
+            print(f"復元できませんでした（{outcome}）。別のカードで再試行します。", file=sys.stderr)
+    writer.close()
+    return all_ok
+
+def _rekey_player(old_uid, new_uid):
+    """DBの行を新しいカードのUIDに付け替える（失敗時はNone）"""
+    import mysql.connector
+    import db_access
+    import player_store
+    try:
+        return db_access.run(lambda conn: player_store.rekey_player(conn, old_uid, new_uid))
+    except mysql.connector.Error as err:
+        print(f"データベースエラー: {err}", file=sys.stderr)
+        return None
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='カードイメージのアーカイブ管理ツール')
+    parser.add_argument('--archive', default=None,
+                        help='アーカイブのパス（既定: NFC_CARD_ARCHIVE または data/card_images.bin）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    lookup_parser = sub.add_parser('lookup', help='UIDの最新イメージを表示する')
+    lookup_parser.add_argument('uid', nargs='+')
+
+    sub.add_parser('index', help='索引を作り直す')
+    sub.add_parser('list', help='UIDごとの最新イメージをJSON Linesで表示する')
+
+    restore_parser = sub.add_parser('restore', help='イメージをカードに一括で書き戻す')
+    restore_parser.add_argument('uid', nargs='*')
+    restore_parser.add_argument('--uid-file', help='復元するUIDを1行1件で書いたファイル')
+    restore_parser.add_argument('--force', action='store_true', help='未使用でないカードにも上書きする')
+    restore_parser.add_argument('--rekey-db', action='store_true',
+                                help='DBの nfc_card_id を復元先カードのUIDに付け替える')
+    restore_parser.add_argument('--timeout', type=float, default=30, help='1枚あたりのカード待ち時間（秒）')
+    args = parser.parse_args()
+
+    value = os.getenv('NFC_CARD_ARCHIVE', '').strip()
+    path = args.archive or (value if value not in ('', '0', '1') else str(data_path('card_images.bin')))
+    if not os.path.exists(path):
+        print(f"エラー: アーカイブが見つかりません: {path}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == 'index':
+        count, entries = build_index(path)
+        print(json.dumps({"records": count, "uids": entries}, ensure_ascii=False))
+        return
+
+    if args.command == 'list':
+        with open_archive(path) as archive:
+            for key, number in sorted(archive.latest_numbers().items()):
+                print(json.dumps(archive.record_at(number).to_dict(), ensure_ascii=False))
+        return
+
+    if args.command == 'lookup':
+        found = True
+        with open_archive(path) as archive:
+            for text in args.uid:
+                image = archive.lookup(parse_uid(text))
+                found = found and image is not None
+                print(json.dumps(image.to_dict() if image else {"idm": text, "found": False}, ensure_ascii=False))
+        if not found:
+            sys.exit(1)
+        return
+
+    uids = list(args.uid)
+    if args.uid_file:
+        with open(args.uid_file, 'r', encoding='utf-8') as f:
+            uids += [line.strip() for line in f if line.strip()]
+    if not uids:
+        print("エラー: 復元するUIDを指定してください。", file=sys.stderr)
+        sys.exit(1)
+    if not restore(path, uids, args.force, args.rekey_db, args.timeout):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
@@ -0,0 +1,486 @@
+import os
+import sys
+import io
+import json
+import time
+import sqlite3
+import argparse
+
+from app_paths import data_path
+
+# ============================================
+# カードの真正性確認（NXP オリジナリティ署名）
+# ============================================
+# NTAG21x には製造時に NXP が書き込んだ ECC 署名（32バイト, secp128r1）があり、
+# READ_SIG コマンドで読み出せる。署名はUIDに対するものなので、NXPの公開鍵で検証すれば
+# 正規品のチップかどうか（UIDだけを書き換えた互換カードでないか）が分かる。
+#
+# 署名の読み出しと検証はタップのたびに行うと遅くなるため、判定はUIDごとに1回だけ行い、
+# 結果を期限つきのローカルキャッシュ（SQLite）に保存して、2回目以降のタップでは再利用する。
+#
+# 有効化: 環境変数 NFC_VERIFY_ORIGINALITY=1
+#
+# ※ 署名はUIDとセットで複製できてしまうため、署名まで偽装するエミュレータ類は検出できない。
+#    UIDを書き換えただけの複製カードや、NXP製でないチップを弾くための確認である。
+
+# 判定結果
+GENUINE = 'genuine'          # 署名の検証に成功（NXP正規品）
+INVALID = 'invalid'          # 署名が不正（複製・偽造の疑い）
+UNAVAILABLE = 'unavailable'  # 署名を読み出せなかった（NTAG21x以外・リーダー非対応・読み取り中に離された等）
+
+# 判定を再利用する期間（秒）
+DEFAULT_TTL = float(os.getenv('NFC_VERIFY_TTL', 30 * 24 * 3600))
+# 署名を読めなかった場合の再試行までの期間（秒, 置き方が悪かっただけの場合があるため短くする）
+DEFAULT_RETRY_TTL = float(os.getenv('NFC_VERIFY_RETRY_TTL', 300))
+# キャッシュに保持するUIDの上限（超えたら最後にタップされたのが古いものから削除）
+DEFAULT_CACHE_SIZE = int(os.getenv('NFC_VERIFY_CACHE_SIZE', 10000))
+
+CACHE_PATH = data_path('originality_cache.sqlite3')
+
+# キャッシュにヒットしたUIDの最終タップ時刻をまとめて書き込む件数と間隔（秒）
+TOUCH_FLUSH_SIZE = 100
+TOUCH_FLUSH_INTERVAL = 60
+
+# ============================================
+# ECC署名の検証（secp128r1）
+# ============================================
+# 曲線パラメータは SEC 2 の secp128r1。Python標準の暗号ライブラリには無い曲線のため自前で計算する。
+# 検証のみ（秘密鍵を扱わない）なので、計算時間が入力に依存しても問題ない。
+
+CURVE_P = 0xFFFFFFFDFFFFFFFFFFFFFFFFFFFFFFFF
+CURVE_A = 0xFFFFFFFDFFFFFFFFFFFFFFFFFFFFFFFC
+CURVE_B = 0xE87579C11079F43DD824993C2CEE5ED3
+CURVE_G = (0x161FF7528B899B2D0C28607CA52C5B86, 0xCF5AC8395BAFEB13C02DA292DDED7A83)
+CURVE_N = 0xFFFFFFFE0000000075A30D1B9038A115
+
+# NTAG21x のオリジナリティ署名用の NXP 公開鍵（非圧縮形式, AN11350）
+NXP_PUBLIC_KEY = '04494E1A386D3D3CFE3DC10E5DE68A499B1C202DB5B132393E89ED19FE5BE8BC61'
+
+SIGNATURE_LENGTH = 32
+
+def _on_curve(point):
+    x, y = point
+    return (y * y - x * x * x - CURVE_A * x - CURVE_B) % CURVE_P == 0
+
+def _point_add(p1, p2):
+    """楕円曲線上の点の加算（None は無限遠点）"""
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    x1, y1 = p1
+    x2, y2 = p2
+    if x1 == x2:
+        if (y1 + y2) % CURVE_P == 0:
+            return None
+        slope = (3 * x1 * x1 + CURVE_A) * pow(2 * y1, -1, CURVE_P)
+    else:
+        slope = (y2 - y1) * pow(x2 - x1, -1, CURVE_P)
+    x3 = (slope * slope - x1 - x2) % CURVE_P
+    return x3, (slope * (x1 - x3) - y1) % CURVE_P
+
+def _point_mul(k, point):
+    result = None
+    while k:
+        if k & 1:
+            result = _point_add(result, point)
+        point = _point_add(point, point)
+        k >>= 1
+    return result
+
+def parse_public_key(text):
+    """
+    16進文字列の公開鍵（'04' + X + Y の非圧縮形式）を曲線上の点に変換する
+
+    Raises:
+        ValueError: 形式が不正、または曲線上の点でない場合
+    """
+    key = bytes.fromhex(text.replace(':', '').replace(' ', ''))
+    if len(key) != 33 or key[0] != 0x04:
+        raise ValueError("公開鍵は04で始まる非圧縮形式（33バイト）で指定してください")
+    point = (int.from_bytes(key[1:17], 'big'), int.from_bytes(key[17:], 'big'))
+    if not _on_curve(point):
+        raise ValueError("公開鍵が secp128r1 の曲線上にありません")
+    return point
+
+def verify_signature(uid, signature, public_key):
+    """
+    オリジナリティ署名を検証する
+
+    NXP の署名はUIDそのもの（ハッシュを取らない）をメッセージとした ECDSA。
+
+    Args:
+        uid: UIDのバイト列
+        signature: READ_SIG で読み出した32バイト（r || s）
+        public_key: parse_public_key() で得た点
+
+    Returns:
+        bool: 署名が正しければTrue
+    """
+    if len(signature) != SIGNATURE_LENGTH:
+        return False
+    r = int.from_bytes(signature[:16], 'big')
+    s = int.from_bytes(signature[16:], 'big')
+    if not (0 < r < CURVE_N and 0 < s < CURVE_N):
+        return False
+    e = int.from_bytes(uid, 'big')
+    w = pow(s, -1, CURVE_N)
+    point = _point_add(_point_mul(e * w % CURVE_N, CURVE_G), _point_mul(r * w % CURVE_N, public_key))
+    return point is not None and point[0] % CURVE_N == r
+
+# ============================================
+# 署名の読み出し
+# ============================================
+
+# READ_SIG は NTAG21x のネイティブコマンド（0x3C, アドレス 0x00）で、PC/SC の標準APDUには無いため、
+# リーダーごとの「カードへの素通し」の方法で送る。対応リーダー:
+#   - Sony RC-S380 などの PC/SC 2.02 Part 3 対応リーダー（ACR1252U 等を含む）
+#       Transparent Session を開始し、Transparent Exchange（FF C2 00 01）で送る
+#   - ACR122U（PC/SC 2.02 Part 3 非対応）
+#       Direct Transmit 疑似APDU で PN532 の InCommunicateThru（D4 42）に包んで送る
+# リーダー名に ACR122 を含む場合だけ後者を使い、それ以外は前者を使う。
+READ_SIG_COMMAND = [0x3C, 0x00]
+
+# PC/SC 2.02 Part 3: Manage Session（81: 開始, 82: 終了）と Transparent Exchange（95: 送信データ）
+START_TRANSPARENT_SESSION_APDU = [0xFF, 0xC2, 0x00, 0x00, 0x02, 0x81, 0x00, 0x00]
+END_TRANSPARENT_SESSION_APDU = [0xFF, 0xC2, 0x00, 0x00, 0x02, 0x82, 0x00, 0x00]
+TRANSPARENT_READ_SIG_APDU = [0xFF, 0xC2, 0x00, 0x01, 0x04, 0x95, 0x02] + READ_SIG_COMMAND + [0x00]
+# ACR122U: Direct Transmit（FF 00 00 00）+ InCommunicateThru（D4 42）
+ACR122_READ_SIG_APDU = [0xFF, 0x00, 0x00, 0x00, 0x04, 0xD4, 0x42] + READ_SIG_COMMAND
+
+# 署名の読み出しで最初に送るAPDU（APDUトレースの再生で読み出しの有無を判定する）
+READ_SIG_FIRST_APDUS = (START_TRANSPARENT_SESSION_APDU, ACR122_READ_SIG_APDU)
+
+def reader_name(connection):
+    """接続しているリーダー名（取得できなければ空文字）"""
+    try:
+        return str(connection.getReader())
+    except Exception:
+        return ''
+
+def _parse_tlv(data):
+    """BER-TLV のデータオブジェクト列を (タグ, 値) のリストにする（1バイトタグ・2バイトまでの長さ）"""
+    objects = []
+    pos = 0
+    while pos + 2 <= len(data):
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(data[pos:pos + size], 'big')
+            pos += size
+        objects.append((tag, data[pos:pos + length]))
+        pos += length
+    return objects
+
+def _transmit(connection, apdu):
+    """APDUを送り、成功（90 00）なら応答データを返す（失敗時はNone）"""
+    data, sw1, sw2 = connection.transmit(apdu)
+    if sw1 != 0x90 or sw2 != 0x00:
+        return None
+    return bytes(data)
+
+def _read_signature_transparent(connection):
+    """PC/SC 2.02 Part 3 の Transparent Exchange で READ_SIG を送る"""
+    if _transmit(connection, START_TRANSPARENT_SESSION_APDU) is None:
+        return None
+    try:
+        response = _transmit(connection, TRANSPARENT_READ_SIG_APDU)
+    finally:
+        # セッションを閉じないと、以降の READ BINARY 等がリーダーに解釈されない
+        _transmit(connection, END_TRANSPARENT_SESSION_APDU)
+    if response is None:
+        return None
+    signature = None
+    for tag, value in _parse_tlv(response):
+        # C0: 汎用エラーステータス（00 90 00 以外は失敗）, 97: カードの応答データ
+        if tag == 0xC0 and value[-2:] != b'\x90\x00':
+            return None
+        if tag == 0x97:
+            signature = value
+    return signature
+
+def _read_signature_acr122(connection):
+    """ACR122U の Direct Transmit（InCommunicateThru）で READ_SIG を送る"""
+    response = _transmit(connection, ACR122_READ_SIG_APDU)
+    # InCommunicateThru の応答: D5 43 <ステータス> <カードの応答>
+    if response is None or response[:2] != b'\xD5\x43' or len(response) < 3 or response[2] != 0x00:
+        return None
+    return response[3:]
+
+def read_signature(connection, reader=None):
+    """
+    カードからオリジナリティ署名を読み出す（読み出せなければNone）
+
+    Args:
+        connection: カードリーダーとの接続オブジェクト
+        reader: 送り方を決めるリーダー名（省略時は接続から取得する）
+
+    Returns:
+        bytes: 32バイトの署名
+    """
+    try:
+        if reader is None:
+            reader = reader_name(connection)
+        if 'ACR122' in reader.upper():
+            signature = _read_signature_acr122(connection)
+        else:
+            signature = _read_signature_transparent(connection)
+    except Exception:
+        return None
+    return signature if signature is not None and len(signature) == SIGNATURE_LENGTH else None
+
+# ============================================
+# 判定キャッシュ
+# ============================================
+
+class VerdictCache:
+    """
+    UIDごとの判定結果を保存するローカルキャッシュ（SQLite）
+
+    SQLite接続はスレッドを跨いで使えないため、使うスレッド内で生成すること
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(str(path), timeout=10)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS originality (
+                uid TEXT PRIMARY KEY,
+                verdict TEXT NOT NULL,
+                signature TEXT,
+                verified_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_seen REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_originality_last_seen ON originality (last_seen)")
+        self.conn.commit()
+        # 未書き込みの最終タップ時刻 {uid: UNIX時刻}
+        self.touched = {}
+        self.flushed_at = time.time()
+
+    def get(self, uid, now=None):
+        """
+        期限内の判定を返す（無ければNone）
+
+        参照したUIDの最終タップ時刻はメモリ上に記録するだけで、タップごとには書き込まない
+        （タップ処理中のコミット＝fsyncを避ける）。TOUCH_FLUSH_SIZE 件または TOUCH_FLUSH_INTERVAL 秒ごと、
+        および put() / close() の時にまとめて書き込む。
+
+        Returns:
+            dict: {"verdict", "verified_at"}
+        """
+        now = time.time() if now is None else now
+        row = self.conn.execute(
+            "SELECT verdict, verified_at FROM originality WHERE uid = ? AND expires_at > ?", (uid, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self.touched[uid] = now
+        if len(self.touched) >= TOUCH_FLUSH_SIZE or now - self.flushed_at >= TOUCH_FLUSH_INTERVAL:
+            self.flush(now)
+        return {'verdict': row[0], 'verified_at': row[1]}
+
+    def flush(self, now=None):
+        """メモリ上の最終タップ時刻をまとめて書き込む"""
+        self.flushed_at = time.time() if now is None else now
+        if not self.touched:
+            return
+        self.conn.executemany(
+            "UPDATE originality SET last_seen = ? WHERE uid = ?",
+            [(seen, uid) for uid, seen in self.touched.items()]
+        )
+        self.touched.clear()
+        self.conn.commit()
+
+    def put(self, uid, verdict, signature, ttl, now=None):
+        """判定を保存し、上限を超えた分を最終タップ時刻の古い順に削除する"""
+        now = time.time() if now is None else now
+        # 削除する順番を正しく決めるため、先に最終タップ時刻を反映する
+        self.touched.pop(uid, None)
+        self.flush(now)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO originality (uid, verdict, signature, verified_at, expires_at, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (uid, verdict, signature.hex().upper() if signature else None, now, now + ttl, now)
+        )
+        self.conn.execute(
+            "DELETE FROM originality WHERE uid IN "
+            "(SELECT uid FROM originality ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.commit()
+
+    def forget(self, uid=None):
+        """指定UID（省略時は全件）の判定を削除し、削除件数を返す"""
+        if uid is None:
+            self.touched.clear()
+        else:
+            self.touched.pop(uid, None)
+        if uid is None:
+            cur = self.conn.execute("DELETE FROM originality")
+        else:
+            cur = self.conn.execute("DELETE FROM originality WHERE uid = ?", (uid,))
+        self.conn.commit()
+        return cur.rowcount
+
+    def stats(self, now=None):
+        """判定ごとの件数（期限切れを含む）"""
+        now = time.time() if now is None else now
+        cur = self.conn.execute(
+            "SELECT verdict, COUNT(*), SUM(expires_at > ?) FROM originality GROUP BY verdict", (now,)
+        )
+        return {verdict: {'entries': count, 'valid': int(valid or 0)} for verdict, count, valid in cur.fetchall()}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+# ============================================
+# 検証ステージ
+# ============================================
+
+class OriginalityVerifier:
+    """
+    監視プロセスから呼び出す検証ステージ
+
+    同じUIDは期限内であればキャッシュの判定を返し、カードとの通信を行わない。
+    キャッシュはこのオブジェクトを最初に使ったスレッドで開く（monitor_nfc の pyscard 用スレッド）。
+    """
+
+    def __init__(self, cache_path=CACHE_PATH, public_key=None, ttl=DEFAULT_TTL,
+                 retry_ttl=DEFAULT_RETRY_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        self.cache_path = cache_path
+        self.public_key = parse_public_key(public_key or os.getenv('NFC_ORIGINALITY_PUBLIC_KEY') or NXP_PUBLIC_KEY)
+        self.ttl = ttl
+        self.retry_ttl = retry_ttl
+        self.max_entries = max_entries
+        self.cache = None
+
+    def verify_card(self, connection, uid, reader=None):
+        """
+        カードから署名を読み出して判定する（キャッシュを使わない）
+
+        Args:
+            reader: read_signature() に渡すリーダー名（省略時は接続から取得する）
+
+        Returns:
+            (判定, 署名)
+        """
+        signature = read_signature(connection, reader)
+        if signature is None:
+            return UNAVAILABLE, None
+        uid_bytes = bytes.fromhex(uid.replace(':', ''))
+        return (GENUINE if verify_signature(uid_bytes, signature, self.public_key) else INVALID), signature
+
+    def check(self, connection, uid):
+        """
+        UIDの判定を返す。期限内のキャッシュがあればカードと通信しない
+
+        Args:
+            connection: カードリーダーとの接続オブジェクト
+            uid: read_nfc_data() の "idm"（'04:A1:...' 形式）
+
+        Returns:
+            dict: {"status": genuine / invalid / unavailable, "cached": bool, "verified_at": UNIX時刻}
+        """
+        if self.cache is None:
+            self.cache = VerdictCache(self.cache_path, self.max_entries)
+        cached = self.cache.get(uid)
+        if cached:
+            return {'status': cached['verdict'], 'cached': True, 'verified_at': cached['verified_at']}
+
+        verdict, signature = self.verify_card(connection, uid)
+        now = time.time()
+        self.cache.put(uid, verdict, signature, self.retry_ttl if verdict == UNAVAILABLE else self.ttl, now)
+        return {'status': verdict, 'cached': False, 'verified_at': now}
+
+_verifier = None
+
+def verifier_from_env():
+    """
+    環境変数 NFC_VERIFY_ORIGINALITY=1 なら OriginalityVerifier を返す（無効ならNone）
+    """
+    global _verifier
+    if os.getenv('NFC_VERIFY_ORIGINALITY', '0') != '1':
+        return None
+    if _verifier is None:
+        _verifier = OriginalityVerifier()
+    return _verifier
+
+def check(connection, uid):
+    """
+    検証が有効ならUIDの判定を返す（無効ならNone）
+
+    検証の失敗で読み取り本体を止めないよう、エラーは標準エラー出力に出すだけにする。
+    """
+    verifier = verifier_from_env()
+    if verifier is None or not uid:
+        return None
+    try:
+        return verifier.check(connection, uid)
+    except Exception as e:
+        print(f"警告: カードの真正性確認に失敗しました: {e}", file=sys.stderr)
+        return None
+
+# ============================================
+# メイン処理
+# ============================================
+
+def _verify_on_reader():
+    """リーダーに置かれたカードをキャッシュを使わずに検証する"""
+    from smartcard.System import readers
+
+    r = readers()
+    if not r:
+        print("エラー: カードリーダーが見つかりません。", file=sys.stderr)
+        return None
+    connection = r[0].createConnection()
+    connection.connect()
+    try:
+        data, sw1, sw2 = connection.transmit([0xFF, 0xCA, 0x00, 0x00, 0x00])
+        if sw1 != 0x90 or sw2 != 0x00:
+            print("エラー: カードのUIDを取得できませんでした。", file=sys.stderr)
+            return None
+        uid = ':'.join(f"{b:02X}" for b in data)
+        verifier = OriginalityVerifier()
+        verdict, signature = verifier.verify_card(connection, uid)
+        return {'uid': uid, 'reader': reader_name(connection), 'status': verdict,
+                'signature': signature.hex().upper() if signature else None}
+    finally:
+        connection.disconnect()
+
+def main():
+    parser = argparse.ArgumentParser(description='カードの真正性確認（NXPオリジナリティ署名）と判定キャッシュの管理')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('verify', help='リーダーに置かれたカードをキャッシュを使わずに検証する')
+    sub.add_parser('stats', help='キャッシュの件数を判定ごとに表示する')
+    forget_parser = sub.add_parser('forget', help='キャッシュから判定を削除する（次のタップで再検証）')
+    forget_parser.add_argument('uid', nargs='*', help='削除するUID（省略時は全件）')
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        result = _verify_on_reader()
+        if result is None:
+            sys.exit(1)
+        print(json.dumps(result, ensure_ascii=False))
+        sys.exit(0 if result['status'] == GENUINE else 2)
+
+    cache = VerdictCache()
+    try:
+        if args.command == 'stats':
+            print(json.dumps(cache.stats(), ensure_ascii=False))
+        else:
+            uids = [uid.upper() for uid in args.uid] or [None]
+            removed = sum(cache.forget(uid) for uid in uids)
+            print(f"キャッシュから {removed} 件を削除しました。", file=sys.stderr)
+    finally:
+        cache.close()
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
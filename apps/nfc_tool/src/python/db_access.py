@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import mysql.connector
+from mysql.connector import pooling
+from dotenv import load_dotenv
+
+# .envファイルを読み込む
+load_dotenv()
+
+# ============================================
+# 設定値
+# ============================================
+
+# 接続タイムアウト（秒）: MySQLに到達できない時にTCPタイムアウトまで待たされないようにする
+CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 3))
+# クエリタイムアウト（ミリ秒）: SELECT は MAX_EXECUTION_TIME、更新系はロック待ち時間で打ち切る
+QUERY_TIMEOUT_MS = int(os.getenv('DB_QUERY_TIMEOUT_MS', 5000))
+# リトライ回数（初回を含まない追加試行の回数）
+RETRY_MAX = int(os.getenv('DB_RETRY_MAX', 2))
+# リトライ間隔の基準値（秒）: 0.2 → 0.4 → 0.8 ... と指数的に伸ばす
+RETRY_BACKOFF = float(os.getenv('DB_RETRY_BACKOFF', 0.2))
+# コネクションプールのサイズ（常駐プロセスで接続を使い回すため）
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 2))
+
+# サーキットブレーカー: 連続失敗がこの回数に達したらDBを「停止中」とみなす
+BREAKER_THRESHOLD = int(os.getenv('DB_BREAKER_THRESHOLD', 3))
+# サーキットブレーカー: 停止中とみなしてから再確認（プローブ）するまでの秒数
+BREAKER_RESET_TIMEOUT = float(os.getenv('DB_BREAKER_RESET_TIMEOUT', 15))
+# サーキットブレーカーの状態ファイル
+# get_db_data.py などはリクエスト毎に起動される短命プロセスのため、状態をファイルで共有する
+BREAKER_STATE_PATH = Path(os.getenv(
+    'DB_BREAKER_STATE',
+    os.path.join(tempfile.gettempdir(), 'digilive_db_breaker.json')
+))
+
+# 一時的な障害とみなすエラー番号（リトライ・ブレーカー計上の対象）
+TRANSIENT_ERRNOS = {
+    1040,  # ER_CON_COUNT_ERROR: 接続数超過
+    1205,  # ER_LOCK_WAIT_TIMEOUT: ロック待ちタイムアウト
+    1213,  # ER_LOCK_DEADLOCK: デッドロック
+    2003,  # CR_CONN_HOST_ERROR: ホストに接続できない
+    2005,  # CR_UNKNOWN_HOST: ホスト名解決失敗
+    2006,  # CR_SERVER_GONE_ERROR: サーバーが切断された
+    2013,  # CR_SERVER_LOST: クエリ中に接続が失われた
+    3024,  # ER_QUERY_TIMEOUT: MAX_EXECUTION_TIME 超過
+}
+
+# 処理の途中で接続が切れたエラー（COMMIT が反映されたかどうか分からない）
+LOST_CONNECTION_ERRNOS = {
+    2006,  # CR_SERVER_GONE_ERROR
+    2013,  # CR_SERVER_LOST
+    2055,  # CR_SERVER_LOST_EXTENDED
+}
+
+# ============================================
+# 例外
+# ============================================
+
+class DatabaseUnavailableError(mysql.connector.Error):
+    """
+    サーキットブレーカーが開いている（DB停止中とみなしている）ため、
+    接続を試みずに即座に失敗したことを表す例外
+
+    mysql.connector.Error のサブクラスなので、既存の except 節でそのまま捕捉できる
+    """
+    pass
+
+# ============================================
+# 接続設定
+# ============================================
+
+def get_db_config(**overrides):
+    """
+    環境変数からDB接続設定を組み立てる
+
+    Args:
+        overrides: 追加・上書きしたい接続オプション（例: allow_local_infile=True）
+
+    Returns:
+        dict: mysql.connector.connect に渡せる設定辞書
+    """
+    config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'user': os.getenv('DB_USER', 'root'),
+        'password': os.getenv('DB_PASSWORD', ''),
+        'database': os.getenv('DB_NAME', 'nfc_game_db'),
+        'port': int(os.getenv('DB_PORT', 3306)),
+        'connection_timeout': CONNECT_TIMEOUT
+    }
+    config.update(overrides)
+    return config
+
+# ============================================
+# サーキットブレーカー
+# ============================================
+
+class CircuitBreaker:
+    """
+    DB停止中に毎回タイムアウトを待たないためのサーキットブレーカー
+
+    状態遷移:
+        closed    : 通常状態。失敗が threshold 回続くと open へ
+        open      : 即座に失敗させる。reset_timeout 秒経過すると half_open へ
+        half_open : 1回だけ試行（プローブ）を許可し、成功で closed、失敗で open に戻る
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 state_path=BREAKER_STATE_PATH):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state_path = Path(state_path) if state_path else None
+        self.failures = 0
+        self.opened_at = None
+        self._load()
+
+    def _load(self):
+        """状態ファイルがあれば読み込む（壊れていれば初期状態とみなす）"""
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.failures = int(state.get('failures', 0))
+            self.opened_at = state.get('opened_at')
+        except Exception:
+            self.failures = 0
+            self.opened_at = None
+
+    def _save(self):
+        """状態ファイルを一時ファイル経由で置き換える（同時起動されたプロセスと競合しても壊れないように）"""
+        if not self.state_path:
+            return
+        try:
+            tmp_path = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'failures': self.failures, 'opened_at': self.opened_at}, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception:
+            pass
+
+    @property
+    def state(self):
+        """現在の状態 ('closed' / 'open' / 'half_open') を返す"""
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow_request(self):
+        """
+        DBへの試行を許可するか判定する
+
+        Returns:
+            bool: 試行してよければTrue
+        """
+        # 他プロセスが更新しているかもしれないので最新状態を読み直す
+        self._load()
+        state = self.state
+        if state == 'half_open':
+            # プローブ中に他プロセスが一斉に押し寄せないよう、開始時刻をずらして open に戻しておく
+            self.opened_at = time.time()
+            self._save()
+            return True
+        return state == 'closed'
+
+    def record_success(self):
+        """試行成功を記録し、closed 状態に戻す"""
+        if self.failures or self.opened_at is not None:
+            self.failures = 0
+            self.opened_at = None
+            self._save()
+
+    def record_failure(self):
+        """試行失敗を記録し、閾値を超えたら open 状態にする"""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.time()
+        self._save()
+
+# プロセス内で共有するブレーカーとプール
+_breaker = CircuitBreaker()
+_pool = None
+
+def get_breaker():
+    """プロセス共通のサーキットブレーカーを返す"""
+    return _breaker
+
+# ============================================
+# コネクションプール
+# ============================================
+
+def _get_pool():
+    """
+    コネクションプールを遅延生成して返す
+    プール生成時に接続を張るため、生成自体もブレーカー・リトライの対象にする
+    """
+    global _pool
+    if _pool is None:
+        _pool = pooling.MySQLConnectionPool(
+            pool_name='digilive',
+            pool_size=POOL_SIZE,
+            **get_db_config()
+        )
+    return _pool
+
+def _apply_session_timeouts(conn):
+    """接続ごとのクエリタイムアウトを設定する"""
+    if QUERY_TIMEOUT_MS <= 0:
+        return
+    cursor = conn.cursor()
+    try:
+        # SELECT の実行時間上限（ミリ秒）と、更新系のロック待ち上限（秒）
+        lock_wait = max(1, QUERY_TIMEOUT_MS // 1000)
+        cursor.execute(
+            f"SET SESSION MAX_EXECUTION_TIME = {QUERY_TIMEOUT_MS}, "
+            f"SESSION innodb_lock_wait_timeout = {lock_wait}"
+        )
+    finally:
+        cursor.close()
+
+@contextmanager
+def connection():
+    """
+    プールから接続を1本借りて、使い終わったら返却するコンテキストマネージャ
+
+    ブレーカーやリトライは行わないため、通常は run() を使うこと
+
+    Yields:
+        プールされたMySQL接続オブジェクト
+    """
+    conn = _get_pool().get_connection()
+    try:
+        _apply_session_timeouts(conn)
+        yield conn
+    except Exception:
+        # 途中で失敗したトランザクションを次の利用者に持ち越さない
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        try:
+            # プール接続の close() は切断ではなくプールへの返却
+            conn.close()
+        except Exception:
+            pass
+
+def is_transient(err):
+    """
+    一時的な障害（再試行で回復しうるエラー）かどうかを判定する
+
+    Args:
+        err: mysql.connector.Error
+
+    Returns:
+        bool: 一時的な障害ならTrue
+    """
+    if isinstance(err, (mysql.connector.errors.InterfaceError,
+                        mysql.connector.errors.PoolError)):
+        return True
+    return err.errno in TRANSIENT_ERRNOS
+
+def _is_pool_exhausted(err):
+    """
+    プールの接続を使い切ったエラーかどうか
+
+    このプロセス内の同時利用が多いだけで、DBは正常なことがあるため、
+    再試行はするがブレーカー（全ステーションで共有）の失敗には数えない
+    """
+    return isinstance(err, mysql.connector.errors.PoolError)
+
+def _is_lost_connection(err):
+    """処理の途中で接続が切れたエラーかどうか"""
+    return err.errno in LOST_CONNECTION_ERRNOS or (
+        err.errno is None and isinstance(err, mysql.connector.errors.InterfaceError))
+
+def run(operation, retries=None, use_breaker=True, retry_on_lost=True):
+    """
+    プール接続上で operation(conn) を実行する（タイムアウト・リトライ・ブレーカー付き）
+
+    一時的な障害の場合のみ指数バックオフで再試行する。
+    SQL文法エラーや一意制約違反などは即座に呼び出し元へ送出する。
+    プールの接続を使い切った場合（PoolError）も再試行するが、失敗してもブレーカーには計上しない。
+
+    Args:
+        operation: 接続を受け取り結果を返す関数。コミットは operation 側で行う
+        retries: 追加試行回数（省略時は DB_RETRY_MAX）
+        use_breaker: Falseの場合はブレーカーを無視して必ず試行する（接続テスト用）
+        retry_on_lost: Falseの場合、operation の実行中に接続が切れたら再試行せずに送出する。
+            COMMIT 後に切れた場合は反映済みのことがあるため、集計の加算など
+            2回実行すると結果が変わる（冪等でない）処理では False にすること
+
+    Returns:
+        operation の戻り値
+
+    Raises:
+        DatabaseUnavailableError: ブレーカーが開いていて試行しなかった場合
+        mysql.connector.Error: リトライしても失敗した場合、または一時的でないエラーの場合
+    """
+    if retries is None:
+        retries = RETRY_MAX
+
+    if use_breaker and not _breaker.allow_request():
+        raise DatabaseUnavailableError(
+            msg=f"データベースが停止中と判断されているため接続を省略しました（{int(BREAKER_RESET_TIMEOUT)}秒ごとに再確認します）"
+        )
+
+    attempt = 0
+    while True:
+        started = False
+        try:
+            with connection() as conn:
+                started = True
+                result = operation(conn)
+            _breaker.record_success()
+            return result
+        except mysql.connector.Error as err:
+            if not is_transient(err):
+                # DB自体は応答しているので、ブレーカー的には成功扱い
+                _breaker.record_success()
+                raise
+            if attempt >= retries or (started and not retry_on_lost and _is_lost_connection(err)):
+                if not _is_pool_exhausted(err):
+                    _breaker.record_failure()
+                raise
+            # 少しずつ間隔を伸ばし、ジッターで同時リトライの集中を避ける
+            delay = RETRY_BACKOFF * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+            print(f"DB接続をリトライします ({attempt}/{retries}): {err}", file=sys.stderr)
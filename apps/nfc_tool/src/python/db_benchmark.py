@@ -0,0 +1,424 @@
+import os
+import sys
+import io
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import functools
+import statistics
+import mysql.connector
+
+import db_access
+import player_store
+import player_stats
+from bench_stats import percentile
+
+# ============================================
+# 概要
+# ============================================
+# player_status が本番規模（数十万〜数百万行）になった時の
+# 照会（get_db_data 相当）・保存（save_to_db 相当）のレイテンシを測るためのツール。
+#
+#   generate : 合成プレイヤーデータを TSV / JSON Lines で出力する（DB不要）
+#   load     : 合成データを指定行数になるまで一括投入する
+#   bench    : 行数を段階的に増やしながら、照会・一括照会・保存を計測する
+#
+# 使用例:
+#   python db_benchmark.py bench --sizes 10000,100000,1000000 --lookups 2000 --upserts 500
+#
+# 合成データのUIDは既定で "04:FE:" から始まる（実カードと区別し、後で一括削除できるように）。
+# データはシードと行番号だけで決まるので、何度生成しても（分割の仕方が変わっても）同じ行になる。
+#
+# ※ 本番DBには実行しないこと。投入後は player_aggregates を再集計する。
+
+# 合成UIDの既定の先頭バイト（NXPの製造者コード 04 + 合成データの目印 FE）
+DEFAULT_UID_PREFIX = '04:FE'
+# UIDの長さ（バイト, NTAG21x と同じ7バイト）
+UID_LENGTH = 7
+
+# 乱数を作り直す単位（この行数ごとに シード:ブロック番号 で初期化する）
+GENERATION_BLOCK = 10000
+
+# 一括投入時の1文あたりの行数
+DEFAULT_INSERT_BATCH = 2000
+
+# 名前の材料（UTF-8で20バイトまでに切り詰める）
+FAMILY_NAMES = ['佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤',
+                '吉田', '山田', '佐々木', '山口', '松本', '井上', '木村', '林', '斎藤', '清水',
+                '長谷川', '五十嵐', '勅使河原']
+GIVEN_NAMES = ['太郎', '花子', 'ゆい', 'はると', 'そうた', 'さくら', 'ひなた', 'れん', 'あおい', 'みお',
+               '陽翔', '結菜', '蒼', '凛', '湊', 'いろは', 'ユウキ', 'カナ', 'ミナト', 'リコ']
+NICKNAMES = ['アレクサンドリア', 'クリスティーナ', 'ドラゴンスレイヤー', 'ぴかぴか', 'ねこまる', 'Player', 'ゲスト']
+
+# クラスの出現比率（クラス番号, 重み）
+CLASS_WEIGHTS = [(1, 40), (2, 25), (3, 15), (4, 12), (5, 8)]
+
+NAME_MAX_BYTES = 20
+
+# ============================================
+# 合成データの生成
+# ============================================
+
+@functools.lru_cache(maxsize=None)
+def _uid_multiplier(seed, bits):
+    """行番号をUIDに並べ替える係数（奇数なので 2^bits を法として1対1）"""
+    return (random.Random(f"uid:{seed}").getrandbits(bits) | 1)
+
+def make_uid(index, seed, prefix=DEFAULT_UID_PREFIX):
+    """
+    行番号から合成UIDを作る
+
+    先頭は prefix に固定し、残りのバイトは行番号の1対1の並べ替えにする
+    （連番に見えず、かつ重複しない）。
+    """
+    prefix_bytes = bytes.fromhex(prefix.replace(':', ''))
+    bits = (UID_LENGTH - len(prefix_bytes)) * 8
+    value = (index * _uid_multiplier(seed, bits) + seed) % (1 << bits)
+    uid = prefix_bytes + value.to_bytes(bits // 8, 'big')
+    return ':'.join(f"{b:02X}" for b in uid)
+
+def truncate_utf8(text, max_bytes=NAME_MAX_BYTES):
+    """UTF-8で max_bytes バイトに収まるよう、文字の途中で切らずに切り詰める"""
+    return text.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+
+def _clip(value, low, high):
+    return max(low, min(high, int(round(value))))
+
+def _generate_row(rng, uid):
+    """乱数から1人分の行を作る"""
+    if rng.random() < 0.1:
+        name = rng.choice(NICKNAMES) + str(rng.randint(1, 999))
+    else:
+        name = rng.choice(FAMILY_NAMES) + rng.choice(GIVEN_NAMES)
+
+    player_class = rng.choices([c for c, _ in CLASS_WEIGHTS], weights=[w for _, w in CLASS_WEIGHTS])[0]
+    # 上位クラスほどステータスが高い
+    mean = 35 + player_class * 6
+    stats = [_clip(rng.gauss(mean, 12), 1, 100) for _ in range(5)]
+    return {
+        'nfc_card_id': uid,
+        'user_name': truncate_utf8(name),
+        'age': None if rng.random() < 0.2 else _clip(rng.triangular(6, 70, 20), 6, 99),
+        # 所持金は少数が大金を持つ分布（対数正規, 中央値3000）
+        'money': _clip(rng.lognormvariate(math.log(3000), 0.8), 0, 65535),
+        'power': stats[0],
+        'stamina': stats[1],
+        'speed': stats[2],
+        'technique': stats[3],
+        'luck': stats[4],
+        'class': player_class
+    }
+
+def generate_rows(start, count, seed=1, prefix=DEFAULT_UID_PREFIX):
+    """
+    行番号 start から count 件の合成プレイヤーを順に返す
+
+    Yields:
+        dict: player_status の1行（player_store.PLAYER_COLUMNS のキー）
+    """
+    index = start
+    end = start + count
+    while index < end:
+        block = index // GENERATION_BLOCK
+        rng = random.Random(f"{seed}:{block}")
+        # ブロックの先頭から乱数を進めて、途中から始めても同じ値になるようにする
+        for offset in range(block * GENERATION_BLOCK, min(end, (block + 1) * GENERATION_BLOCK)):
+            row = _generate_row(rng, make_uid(offset, seed, prefix))
+            if offset >= index:
+                yield row
+        index = (block + 1) * GENERATION_BLOCK
+
+# ============================================
+# 一括投入
+# ============================================
+
+def _connect(**overrides):
+    """計測用の専用接続（プールのクエリタイムアウトを掛けないため直接接続する）"""
+    return mysql.connector.connect(**db_access.get_db_config(**overrides))
+
+def count_synthetic(conn, prefix=DEFAULT_UID_PREFIX):
+    """投入済みの合成データの件数（UIDの前方一致で数える）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM player_status WHERE nfc_card_id LIKE %s", (prefix + ':%',))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def _rows_as_tuples(rows):
+    for row in rows:
+        yield tuple(row[column] for column in player_store.PLAYER_COLUMNS)
+
+def insert_rows(conn, rows, batch_size=DEFAULT_INSERT_BATCH):
+    """
+    複数行の INSERT でまとめて投入する（既にあるUIDは無視する）
+
+    Returns:
+        int: 投入を試みた行数
+    """
+    columns = ', '.join(f'`{c}`' for c in player_store.PLAYER_COLUMNS)
+    placeholders = ', '.join(['%s'] * len(player_store.PLAYER_COLUMNS))
+    # executemany は INSERT の値リストを1文にまとめて送る
+    sql = f"INSERT IGNORE INTO player_status ({columns}) VALUES ({placeholders})"
+    cursor = conn.cursor()
+    total = 0
+    try:
+        batch = []
+        for values in _rows_as_tuples(rows):
+            batch.append(values)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                conn.commit()
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            conn.commit()
+            total += len(batch)
+    finally:
+        cursor.close()
+    return total
+
+def _tsv_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def write_tsv(rows, f):
+    """LOAD DATA 形式（タブ区切り, NULLは \\N）で書き出す"""
+    for values in _rows_as_tuples(rows):
+        f.write('\t'.join(_tsv_value(v) for v in values) + '\n')
+
+def load_data_infile(conn, rows):
+    """
+    一時ファイルに書き出して LOAD DATA LOCAL INFILE で投入する（サーバー側で local_infile の許可が必要）
+
+    Returns:
+        int: 投入した行数
+    """
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            write_tsv(rows, f)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE player_status CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({', '.join(f'`{c}`' for c in player_store.PLAYER_COLUMNS)})",
+                (path,)
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            cursor.close()
+    finally:
+        os.remove(path)
+
+def load_until(conn, target_rows, args):
+    """
+    合成データが target_rows 件になるまで追加投入する
+
+    Returns:
+        dict: 投入件数・所要時間
+    """
+    existing = count_synthetic(conn, args.uid_prefix)
+    needed = max(0, target_rows - existing)
+    started = time.perf_counter()
+    if needed:
+        rows = generate_rows(existing, needed, args.seed, args.uid_prefix)
+        if args.load_data:
+            load_data_infile(conn, rows)
+        else:
+            insert_rows(conn, rows, args.insert_batch)
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': target_rows,
+        'inserted': needed,
+        'load_sec': round(elapsed, 2),
+        'rows_per_sec': round(needed / elapsed) if needed and elapsed else None
+    }
+
+# ============================================
+# 計測
+# ============================================
+
+def _summary(samples):
+    values = sorted(samples)
+    if not values:
+        return {}
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values) * 1000, 2),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'ops_per_sec': round(len(values) / sum(values), 1) if sum(values) else None
+    }
+
+def bench_lookups(conn, size, args, rng):
+    """get_db_data と同じ1件照会（存在しないUIDも miss_ratio の割合で混ぜる）"""
+    samples = []
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for _ in range(args.lookups):
+            if rng.random() < args.miss_ratio:
+                uid = make_uid(size + rng.randrange(1 << 20), args.seed, args.uid_prefix)
+            else:
+                uid = make_uid(rng.randrange(size), args.seed, args.uid_prefix)
+            started = time.perf_counter()
+            cursor.execute("SELECT * FROM player_status WHERE nfc_card_id = %s", (uid,))
+            cursor.fetchone()
+            samples.append(time.perf_counter() - started)
+    finally:
+        cursor.close()
+    return _summary(samples)
+
+def bench_batch_lookups(conn, size, args, rng):
+    """get_db_data --batch と同じ一括照会（1回あたり batch_uids 件）"""
+    samples = []
+    for _ in range(max(1, args.lookups // args.batch_uids)):
+        uids = [make_uid(rng.randrange(size), args.seed, args.uid_prefix) for _ in range(args.batch_uids)]
+        started = time.perf_counter()
+        for _ in player_store.iter_players_by_uids(conn, uids):
+            pass
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+def bench_upserts(conn, size, args, rng):
+    """
+    save_to_db と同じ保存（player_store.save_player）
+
+    既存行の更新と、新規UIDの登録を insert_ratio の割合で混ぜる。
+    新規登録した行も合成データの範囲（行番号 size 以降）なので、次の段階の投入では無視される。
+    新規登録は user_name（NOT NULL）を含む1人分を生成して保存する。
+    """
+    samples = []
+    outcomes = {}
+    next_new = size
+    for _ in range(args.upserts):
+        if rng.random() < args.insert_ratio:
+            uid = make_uid(next_new, args.seed, args.uid_prefix)
+            next_new += 1
+            # 新規登録（nfc_writer と同じく、名前・年齢・全ステータスを保存する）
+            row = _generate_row(rng, uid)
+            player_data = {key: row[column] for key, column in player_store.SAVE_COLUMNS.items()}
+            player_data['nfc_card_id'] = uid
+        else:
+            uid = make_uid(rng.randrange(size), args.seed, args.uid_prefix)
+            player_data = {
+                'nfc_card_id': uid,
+                'money': rng.randint(0, 65535),
+                'power': rng.randint(1, 100),
+                'class': rng.choice([c for c, _ in CLASS_WEIGHTS])
+            }
+        started = time.perf_counter()
+        result = player_store.save_player(conn, player_data)
+        samples.append(time.perf_counter() - started)
+        outcomes[result.status] = outcomes.get(result.status, 0) + 1
+    summary = _summary(samples)
+    summary['outcomes'] = outcomes
+    return summary
+
+def run_bench(args):
+    """行数を段階的に増やしながら計測し、段階ごとに結果を出力する"""
+    sizes = sorted(int(s) for s in args.sizes.split(',') if s.strip())
+    rng = random.Random(args.seed)
+    conn = _connect(allow_local_infile=args.load_data)
+    try:
+        for size in sizes:
+            result = load_until(conn, size, args)
+            result['lookup'] = bench_lookups(conn, size, args, rng)
+            result['batch_lookup'] = bench_batch_lookups(conn, size, args, rng)
+            result['upsert'] = bench_upserts(conn, size, args, rng)
+            print_result(result, args.json)
+
+        # 一括投入は player_store を通らないため、最後に集計を作り直す
+        if not args.skip_recompute:
+            player_stats.recompute(conn)
+    finally:
+        conn.close()
+
+def print_result(result, as_json):
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print(f"--- {result['rows']:,} 行（追加 {result['inserted']:,} 行 / {result['load_sec']} 秒） ---")
+        for name, label in (('lookup', '1件照会'), ('batch_lookup', '一括照会'), ('upsert', '保存')):
+            s = result.get(name) or {}
+            if not s:
+                continue
+            print(f"  {label:<6} 平均 {s['mean_ms']:>7}ms  p50 {s['p50_ms']:>7}ms  p95 {s['p95_ms']:>7}ms  "
+                  f"p99 {s['p99_ms']:>7}ms  {s['ops_per_sec']:>8}/秒"
+                  + (f"  {s['outcomes']}" if 'outcomes' in s else ''))
+    sys.stdout.flush()
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='合成データによるDBスケーリングベンチマーク')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード（同じシードなら同じデータになる）')
+    parser.add_argument('--uid-prefix', default=DEFAULT_UID_PREFIX,
+                        help='合成UIDの先頭バイト (既定: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen_parser = sub.add_parser('generate', help='合成データを出力する（DB不要）')
+    gen_parser.add_argument('--count', type=int, default=1000)
+    gen_parser.add_argument('--start', type=int, default=0, help='開始する行番号')
+    gen_parser.add_argument('--format', choices=['jsonl', 'tsv'], default='jsonl')
+
+    for name, help_text in (('load', '合成データを指定行数まで投入する'),
+                            ('bench', '行数を段階的に増やしながら照会・保存を計測する')):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--load-data', action='store_true',
+                       help='LOAD DATA LOCAL INFILE で投入する（既定は複数行INSERT）')
+        p.add_argument('--insert-batch', type=int, default=DEFAULT_INSERT_BATCH,
+                       help='複数行INSERTの1文あたりの行数')
+        p.add_argument('--skip-recompute', action='store_true', help='投入後に集計を作り直さない')
+        if name == 'load':
+            p.add_argument('--rows', type=int, required=True, help='合成データの目標行数')
+        else:
+            p.add_argument('--sizes', default='10000,100000,1000000', help='計測する行数のカンマ区切りリスト')
+            p.add_argument('--lookups', type=int, default=2000, help='段階ごとの1件照会の回数')
+            p.add_argument('--batch-uids', type=int, default=100, help='一括照会1回あたりのUID数')
+            p.add_argument('--upserts', type=int, default=500, help='段階ごとの保存の回数')
+            p.add_argument('--miss-ratio', type=float, default=0.1, help='1件照会で存在しないUIDを引く割合')
+            p.add_argument('--insert-ratio', type=float, default=0.1, help='保存のうち新規登録の割合')
+            p.add_argument('--json', action='store_true', help='結果をJSON Linesで出力する')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        rows = generate_rows(args.start, args.count, args.seed, args.uid_prefix)
+        if args.format == 'tsv':
+            write_tsv(rows, sys.stdout)
+        else:
+            for row in rows:
+                print(json.dumps(row, ensure_ascii=False))
+        return
+
+    try:
+        if args.command == 'load':
+            conn = _connect(allow_local_infile=args.load_data)
+            try:
+                result = load_until(conn, args.rows, args)
+                if not args.skip_recompute:
+                    player_stats.recompute(conn)
+            finally:
+                conn.close()
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            run_bench(args)
+    except mysql.connector.Error as err:
+        print(f"データベースエラー: {err}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
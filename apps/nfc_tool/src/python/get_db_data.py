@@ -1,58 +1,44 @@
 import sys
 import json
-import os
+import argparse
 import mysql.connector
-from dotenv import load_dotenv
 import io
+import db_access
+import player_store
 
 # 文字化け対策
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-# .env読み込み
-load_dotenv()
+def _player_data(row):
+    """
+    行データから画面に返すフィールドだけを取り出す
+
+    datetime型などはJSONシリアライズできないため、必要なデータだけ抽出して返す
+    """
+    return {column: row[column] for column in player_store.PLAYER_COLUMNS}
 
 def get_db_data(nfc_uid):
     """
     指定されたUIDに対応するデータをデータベースから取得する
     """
-    conn = None
     try:
-        # DB接続設定
-        db_config = {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'user': os.getenv('DB_USER', 'root'),
-            'password': os.getenv('DB_PASSWORD', ''),
-            'database': os.getenv('DB_NAME', 'nfc_game_db'),
-            'port': int(os.getenv('DB_PORT', 3306))
-        }
-
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor(dictionary=True) # 結果を辞書形式で取得
-
-        sql = "SELECT * FROM player_status WHERE nfc_card_id = %s"
-        cursor.execute(sql, (nfc_uid,))
-        
-        result = cursor.fetchone()
-        
+        def fetch(conn):
+            cursor = conn.cursor(dictionary=True) # 結果を辞書形式で取得
+            try:
+                sql = "SELECT * FROM player_status WHERE nfc_card_id = %s"
+                cursor.execute(sql, (nfc_uid,))
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+
+        # プール接続・タイムアウト・リトライ・ブレーカーは db_access に任せる
+        result = db_access.run(fetch)
+
         if result:
-            # datetime型などはJSONシリアライズできないため、文字列に変換するか除外する
-            # ここではシンプルに必要なフィールドだけ返す形にするか、default=strで逃げる
-            # 今回は必要なデータだけ抽出して返す
             response_data = {
                 'found': True,
-                'data': {
-                    'nfc_card_id': result['nfc_card_id'],
-                    'user_name': result['user_name'],
-                    'age': result['age'],
-                    'money': result['money'],
-                    'power': result['power'],
-                    'stamina': result['stamina'],
-                    'speed': result['speed'],
-                    'technique': result['technique'],
-                    'luck': result['luck'],
-                    'class': result['class']
-                }
+                'data': _player_data(result)
             }
         else:
             response_data = {
@@ -72,18 +58,103 @@ def get_db_data(nfc_uid):
             'found': False,
             'error': f"Unexpected error: {e}"
         }, ensure_ascii=False))
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
+
+def read_uids_from_stdin():
+    """
+    標準入力からUIDを読み込む（1行1件のJSON Lines）
+
+    各行は "04:A1:..." のようなJSON文字列、または {"uid": "04:A1:..."} 形式のオブジェクト。
+    """
+    uids = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            # JSONでない行はUIDそのものとみなす
+            value = line
+        if isinstance(value, dict):
+            value = value.get('uid') or value.get('nfc_card_id')
+        # 結果の uid は呼び出し元の文字列をそのまま返すため、ここでは整形しない
+        if isinstance(value, str) and value.strip():
+            uids.append(value)
+    return uids
+
+def get_db_data_batch(uids, chunk_size=player_store.DEFAULT_CHUNK_SIZE):
+    """
+    複数UIDのデータを1つの接続でまとめて取得し、UIDごとに1行ずつ出力する
+
+    WHERE nfc_card_id IN (...) を chunk_size 件ずつ発行し、チャンクごとに結果を出力する。
+    見つからなかったUIDも {"uid": ..., "found": false} として必ず1行出力する。
+    出力の uid は渡された文字列のまま返す（main.js が元のUIDで結果を引くため）。
+    大文字・小文字違いの同じUIDは1回だけ問い合わせ、それぞれの表記で出力する。
+
+    Returns:
+        bool: DBエラー無く全件を処理できたらTrue
+    """
+    # 同じUIDは1回だけ問い合わせる（問い合わせは大文字に揃え、出力用に元の表記を覚えておく）
+    originals = {}
+    for uid in uids:
+        originals.setdefault(uid.strip().upper(), {})[uid] = None
+    pending = list(originals)
+    emitted = set()
+
+    def emit(uid, entry):
+        for original in originals[uid]:
+            print(json.dumps({'uid': original, **entry}, ensure_ascii=False))
+        emitted.add(uid)
+
+    def fetch_all(conn):
+        # 一時的な障害で再試行された場合は、出力済みのUIDを問い合わせ直さない
+        remaining = [uid for uid in pending if uid not in emitted]
+        for chunk, rows in player_store.iter_players_by_uids(conn, remaining, chunk_size):
+            rows = {uid.upper(): row for uid, row in rows.items()}
+            for uid in chunk:
+                if uid in rows:
+                    emit(uid, {'found': True, 'data': _player_data(rows[uid])})
+                else:
+                    emit(uid, {'found': False, 'message': 'Data not found in database'})
+            # チャンクごとに main.js へ渡す
+            sys.stdout.flush()
+
+    try:
+        db_access.run(fetch_all)
+        return True
+    except mysql.connector.Error as err:
+        error = f"Database error: {err}"
+    except Exception as e:
+        error = f"Unexpected error: {e}"
+
+    # 取得できなかったUIDにもエラーとして1行ずつ返す
+    for uid in pending:
+        if uid not in emitted:
+            emit(uid, {'found': False, 'error': error})
+    sys.stdout.flush()
+    return False
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description='UIDに対応するプレイヤーデータをDBから取得する')
+    parser.add_argument('uid', nargs='*', help='取得するUID（--batch 無しの場合は1件のみ）')
+    parser.add_argument('--batch', action='store_true',
+                        help='複数UIDをまとめて取得する（UID省略時は標準入力のJSON Linesから読む）')
+    parser.add_argument('--chunk-size', type=int, default=player_store.DEFAULT_CHUNK_SIZE,
+                        help='1クエリあたりのUID数 (既定: %(default)s)')
+    args = parser.parse_args()
+
+    if args.batch:
+        uids = args.uid or read_uids_from_stdin()
+        if not get_db_data_batch(uids, max(1, args.chunk_size)):
+            sys.exit(1)
+        sys.exit(0)
+
+    if len(args.uid) != 1:
         print(json.dumps({
             'found': False,
             'error': 'UID argument is required'
         }, ensure_ascii=False))
         sys.exit(1)
-    
-    uid = sys.argv[1]
-    get_db_data(uid)
 
+    uid = args.uid[0]
+    get_db_data(uid)
@@ -1,10 +1,7 @@
-import os
 import sys
 import mysql.connector
-from dotenv import load_dotenv
-
-# .envファイルを読み込む
-load_dotenv()
+import db_access
+import player_store
 
 def insert_test_data():
     print("=== テストデータ挿入ツール ===")
@@ -26,57 +23,24 @@ def insert_test_data():
 
     print(f"書き込むデータ: {test_data['user_name']} (UID: {test_data['nfc_card_id']})")
 
-    # DB接続設定
-    db_config = {
-        'host': os.getenv('DB_HOST', 'localhost'),
-        'user': os.getenv('DB_USER', 'root'),
-        'password': os.getenv('DB_PASSWORD', ''),
-        'database': os.getenv('DB_NAME', 'nfc_game_db'),
-        'port': int(os.getenv('DB_PORT', 3306))
-    }
-
-    conn = None
     try:
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
+        # 既にあれば変更カラムだけを更新する（集計 player_aggregates も同時に更新される）
+        def save_and_fetch(conn):
+            player_data = {('name' if key == 'user_name' else key): value for key, value in test_data.items()}
+            player_store.save_player(conn, player_data)
 
-        # UPSERT文 (重複時は更新)
-        sql = """
-        INSERT INTO player_status (
-            nfc_card_id, user_name, age, money, power, stamina, speed, technique, luck, class
-        ) VALUES (
-            %(nfc_card_id)s, %(user_name)s, %(age)s, %(money)s, %(power)s, 
-            %(stamina)s, %(speed)s, %(technique)s, %(luck)s, %(class)s
-        ) ON DUPLICATE KEY UPDATE
-            user_name = VALUES(user_name),
-            age = VALUES(age),
-            money = VALUES(money),
-            power = VALUES(power),
-            stamina = VALUES(stamina),
-            speed = VALUES(speed),
-            technique = VALUES(technique),
-            luck = VALUES(luck),
-            class = VALUES(class),
-            updated_at = CURRENT_TIMESTAMP
-        """
+            # 確認のためにデータを取得
+            return player_store.fetch_player(conn, test_data['nfc_card_id'])
 
-        cursor.execute(sql, test_data)
-        conn.commit()
+        # プール接続・タイムアウト・リトライは db_access に任せる（集計の加算を伴うため接続断では再試行しない）
+        row = db_access.run(save_and_fetch, retry_on_lost=False)
 
         print("✅ テストデータの書き込みに成功しました！")
-        
-        # 確認のためにデータを取得して表示
-        cursor.execute("SELECT * FROM player_status WHERE nfc_card_id = %s", (test_data['nfc_card_id'],))
-        row = cursor.fetchone()
         print(f"DB上のデータ: {row}")
+        print(f"削除する場合: python purge_players.py --uid {test_data['nfc_card_id']}")
 
     except mysql.connector.Error as err:
         print(f"❌ データベースエラー: {err}")
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
-            print("接続を閉じました。")
 
 if __name__ == "__main__":
     insert_test_data()
-
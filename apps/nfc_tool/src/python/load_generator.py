@@ -0,0 +1,596 @@
+import re
+import sys
+import io
+import json
+import time
+import queue
+import random
+import sqlite3
+import asyncio
+import argparse
+import threading
+import statistics
+
+import mysql.connector
+from smartcard.Exceptions import CardConnectionException
+
+import monitor_nfc
+import nfc_writer
+import player_stats
+import player_store
+from bench_stats import percentile
+
+# ============================================
+# 概要
+# ============================================
+# 1ステーション（リーダー1台）/ 1DBが1分間に何タップ捌けるかを見積もるための負荷生成ツール。
+# 実機の代わりにAPDU応答遅延を模擬した偽リーダーと、SQLiteで模擬したDBを使い、
+# monitor_nfc（読み取り）・nfc_writer（書き込み）・player_store（DB保存）の処理をそのまま呼び出す。
+#
+# 使用例:
+#   python load_generator.py --rates 30,60,120,240 --taps 200 --stations 1 --db
+#
+# 読み取りはステーションごとの LoadCore（monitor_nfc.MonitorCore を継承）で処理するので、
+# 安定待ち・存在確認の間隔・離脱の猶予・読み取り失敗時の再試行の待ちも実際の監視と同じようにかかる。
+# タップしたカードは、読み取り後 --presence-polls 回の存在確認の間置かれてから離される。
+
+# ============================================
+# 偽カード・偽リーダー
+# ============================================
+
+# NTAG213相当のページ数（ページ0-44）
+CARD_PAGES = 45
+
+def build_card_image(uid, name, stats):
+    """
+    nfc_writer と同じレイアウトでカードのページ内容を作る
+
+    Args:
+        uid: UIDのバイト列（list[int]）
+        name: 名前
+        stats: [money, power, stamina, speed, technique, luck, class]
+
+    Returns:
+        dict: ページ番号 → 4バイトのlist
+    """
+    pages = {page: [0x00] * 4 for page in range(CARD_PAGES)}
+    pages[0] = (uid + [0x00] * 4)[:4]
+    pages[1] = (uid[3:] + [0x00] * 4)[:4]
+    name_bytes = name.encode('utf-8').ljust(20, b'\x00')[:20]
+    for i in range(5):
+        pages[4 + i] = list(name_bytes[i * 4:(i + 1) * 4])
+    status_bytes = b''.join(int(v).to_bytes(2, 'little') for v in stats).ljust(16, b'\x00')
+    for i in range(4):
+        pages[9 + i] = list(status_bytes[i * 4:(i + 1) * 4])
+    return pages
+
+class FakeCard:
+    """リーダーに置かれる偽カード"""
+
+    def __init__(self, uid, name, stats):
+        self.uid = uid
+        self.pages = build_card_image(uid, name, stats)
+
+class FakeConnection:
+    """
+    pyscard の CardConnection 互換の偽接続（1台のリーダー）
+
+    APDUごとに latency 秒（ガウス分布のジッター付き）待ってから応答する。
+    remove_after を指定すると、その回数のAPDU後にカードが外れたものとして例外を送出する。
+    """
+
+    def __init__(self, card, rng, latency, jitter):
+        self.card = card
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.apdu_count = 0
+        self.remove_after = None
+
+    def place(self, card, remove_after=None):
+        """カードを置く（remove_after 回のAPDUの後に外れる）"""
+        self.card = card
+        self.apdu_count = 0
+        self.remove_after = remove_after
+
+    def lift(self):
+        """カードを離す"""
+        self.card = None
+
+    def swap(self, card):
+        """カードを別のカードに差し替える（差し替え検知の模擬）"""
+        self.card = card
+
+    def _present(self):
+        return self.card is not None and (self.remove_after is None or self.apdu_count < self.remove_after)
+
+    def connect(self, *args, **kwargs):
+        if not self._present():
+            raise CardConnectionException("No card")
+
+    def disconnect(self, *args, **kwargs):
+        pass
+
+    def transmit(self, cmd):
+        delay = self.rng.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        if not self._present():
+            raise CardConnectionException("Card removed")
+        self.apdu_count += 1
+
+        ins = cmd[1]
+        if ins == 0xCA:
+            # GET DATA (UID)
+            return list(self.card.uid), 0x90, 0x00
+        if ins == 0xB0:
+            # READ BINARY
+            page = cmd[3]
+            if page < CARD_PAGES:
+                return list(self.card.pages[page]), 0x90, 0x00
+            return [], 0x6A, 0x82
+        if ins == 0xD6:
+            # UPDATE BINARY
+            page = cmd[3]
+            if page < CARD_PAGES:
+                self.card.pages[page] = list(cmd[5:9])
+                return [], 0x90, 0x00
+            return [], 0x6A, 0x82
+        return [], 0x6D, 0x00
+
+# ============================================
+# DBの代替（ローカルSQLite）
+# ============================================
+
+class FakeDatabase:
+    """
+    1台のMySQLを模擬するSQLite（インメモリ）
+
+    player_store / player_stats の関数をそのまま動かすため、connect() で mysql.connector 互換の接続を返す。
+    全ステーションで1つのSQLiteを共有し、クエリ毎に latency 秒のネットワーク往復を模擬する。
+    文ごとに自動コミットする（トランザクションの分離は模擬しない）。
+    楽観的排他制御の version 比較は player_store の UPDATE ... WHERE version = ? がそのまま行う。
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE player_status (
+                player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nfc_card_id TEXT NOT NULL UNIQUE,
+                user_name TEXT NOT NULL, age INTEGER,
+                money INTEGER NOT NULL DEFAULT 0, power INTEGER NOT NULL DEFAULT 0,
+                stamina INTEGER NOT NULL DEFAULT 0, speed INTEGER NOT NULL DEFAULT 0,
+                technique INTEGER NOT NULL DEFAULT 0, luck INTEGER NOT NULL DEFAULT 0,
+                class INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        self.conn.execute(f"""
+            CREATE TABLE {player_stats.AGGREGATES_TABLE} (
+                class INTEGER NOT NULL PRIMARY KEY,
+                players INTEGER NOT NULL DEFAULT 0,
+                {', '.join(f'sum_{column} INTEGER NOT NULL DEFAULT 0' for column in player_stats.SUM_COLUMNS)}
+            )
+        """)
+        # 他のステーションとの version 衝突で保存をやり直した回数
+        self.conflicts = 0
+
+    def connect(self):
+        """mysql.connector 互換の接続を返す（ステーションごとに1つ）"""
+        return FakeMySQLConnection(self)
+
+    def add_conflicts(self, count):
+        with self.lock:
+            self.conflicts += count
+
+# MySQL固有の構文をSQLiteの構文に置き換える（player_store / player_stats が使うものだけ）
+_VALUES_FUNCTION = re.compile(r'VALUES\((\w+)\)')
+
+def _to_sqlite(sql):
+    sql = sql.replace('%s', '?')
+    if 'ON DUPLICATE KEY UPDATE' in sql:
+        head, tail = sql.split('ON DUPLICATE KEY UPDATE', 1)
+        sql = head + 'ON CONFLICT DO UPDATE SET' + _VALUES_FUNCTION.sub(r'excluded.\1', tail)
+    return sql
+
+class FakeMySQLCursor:
+    """mysql.connector のカーソル互換（execute / fetchone / fetchall / rowcount / close）"""
+
+    def __init__(self, db, dictionary):
+        self.db = db
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        time.sleep(self.db.latency)
+        with self.db.lock:
+            try:
+                cur = self.db.conn.execute(_to_sqlite(sql), tuple(params))
+            except sqlite3.IntegrityError as e:
+                # MySQL と同じく重複キーは errno 1062 で返す（player_store が見て再試行する）
+                raise mysql.connector.IntegrityError(msg=str(e), errno=1062)
+            rows = cur.fetchall()
+            self.rowcount = cur.rowcount
+        if self.dictionary and cur.description:
+            columns = [d[0] for d in cur.description]
+            rows = [dict(zip(columns, row)) for row in rows]
+        self.rows = rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+class FakeMySQLConnection:
+    """mysql.connector の接続互換（自動コミットなので commit / rollback は何もしない）"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, dictionary=False):
+        return FakeMySQLCursor(self.db, dictionary)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+# ============================================
+# タップの生成
+# ============================================
+
+class TapFactory:
+    """
+    到着するタップ（カード・シナリオ）を決定的に生成する
+
+    シナリオ:
+        new     : 初めて見るUID
+        repeat  : 既に見たUIDの再タップ
+        swap    : 読み取り後、置いたまま別カードに差し替え
+        removed : 読み取り途中でカードが外される
+    """
+
+    def __init__(self, rng, repeat_ratio, swap_ratio, removal_ratio):
+        self.rng = rng
+        self.repeat_ratio = repeat_ratio
+        self.swap_ratio = swap_ratio
+        self.removal_ratio = removal_ratio
+        self.seen = []
+
+    def _new_card(self):
+        uid = [0x04] + [self.rng.randrange(256) for _ in range(6)]
+        stats = [self.rng.randrange(0, 10000)] + [self.rng.randrange(1, 100) for _ in range(5)] + [self.rng.randrange(1, 4)]
+        card = (uid, f"プレイヤー{len(self.seen):04d}", stats)
+        self.seen.append(card)
+        return card
+
+    def next_tap(self):
+        """次のタップを (シナリオ名, カード定義, 差し替え先カード定義) で返す"""
+        roll = self.rng.random()
+        if roll < self.removal_ratio:
+            kind = 'removed'
+        elif roll < self.removal_ratio + self.swap_ratio:
+            kind = 'swap'
+        elif self.seen and roll < self.removal_ratio + self.swap_ratio + self.repeat_ratio:
+            kind = 'repeat'
+        else:
+            kind = 'new'
+
+        card = self.rng.choice(self.seen) if kind == 'repeat' else self._new_card()
+        swap_to = self._new_card() if kind == 'swap' else None
+        return kind, card, swap_to
+
+# ============================================
+# 1タップ分の処理（計測対象）
+# ============================================
+
+class LoadCore(monitor_nfc.MonitorCore):
+    """
+    1ステーション分の監視コア
+
+    MonitorCore の存在確認・安定待ち・離脱の猶予・読み取り失敗時の再試行の待ちをそのまま使い、
+    カードの状態はタップを跨いで持ち越す（同じカードがすぐに置き直されればフラップとして読み直さない）。
+
+    - pyscard の呼び出しはステーションのスレッドでその場で実行し、sleep は実際に待つ
+    - タップしたプレイヤーの操作（読み取り後しばらく置いてから離す・差し替える）は sleep の後に行う
+    - data イベントでは画面側と同じくDBを照会する
+    """
+
+    def __init__(self, args, reader, db_conn=None):
+        super().__init__()
+        self.poll_interval = args.poll_interval
+        self.arrive_debounce = args.arrive_debounce
+        self.remove_hold = args.remove_hold
+        self.hold_polls = args.presence_polls
+        self.patience = args.patience
+        self.reader = reader
+        self.db_conn = db_conn
+        self.events = []
+        self.swap_to = None
+        self.swapped = False
+        self.polls_present = 0
+        self.tapped_at = 0.0
+
+    def emit(self, event):
+        self.events.append(event)
+        if event['type'] == 'data' and self.db_conn:
+            # 画面側（get_db_data）のDB照会
+            player_store.fetch_player(self.db_conn, event['payload']['idm'])
+
+    async def blocking(self, func, *args):
+        return func(*args)
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+        if self.presence == monitor_nfc.PRESENT:
+            self.polls_present += 1
+            if self.swap_to:
+                self.reader.swap(self.swap_to)
+                self.swap_to = None
+                self.swapped = True
+            elif self.polls_present >= self.hold_polls:
+                self.reader.lift()
+        elif self.clock() - self.tapped_at >= self.patience:
+            # 読み取れないまま待ちきれずに離す
+            self.reader.lift()
+
+    async def tap(self, card, swap_to=None, remove_after=None):
+        """
+        カードを置き、離されるまで監視する
+
+        Returns:
+            str: 結果 ('ok' / 'flap_suppressed' / 'read_failed' / 'removed' / 'swap_detected')
+        """
+        self.events = []
+        self.swap_to = swap_to
+        self.swapped = False
+        self.polls_present = 0
+        self.tapped_at = self.clock()
+        flaps = self.flaps_suppressed
+        # 前のカードの離脱の猶予が過ぎていれば removed にする（card_task と同じ）
+        self._expire_departure()
+        self.reader.place(card, remove_after)
+        await self._watch_card(self.reader)
+        # 差し替えたカードなど、置かれたままのカードは持ち帰る
+        self.reader.lift()
+
+        if self.swapped:
+            return 'swap_detected'
+        if any(event['type'] == 'data' for event in self.events):
+            return 'ok'
+        if self.flaps_suppressed > flaps:
+            return 'flap_suppressed'
+        return 'removed' if remove_after is not None else 'read_failed'
+
+def run_tap(tap, mode, rng, args, db, station):
+    """
+    1タップ分の処理を偽リーダー上で実行する
+
+    Args:
+        tap: TapFactory.next_tap() の戻り値
+        mode: 'monitor' / 'writer'
+        rng: このステーション用の乱数
+        args: コマンドライン引数
+        db: FakeDatabase または None
+        station: (LoadCore, イベントループ, DB接続)
+
+    Returns:
+        str: 結果 ('ok' / 'flap_suppressed' / 'read_failed' / 'removed' / 'swap_detected'
+             / 'write_failed' / 'save_conflict')
+    """
+    kind, (uid, name, stats), swap_to = tap
+    core, loop, db_conn = station
+    card = FakeCard(uid, name, stats)
+    # 読み取り（約37APDU）の途中のどこかで外れる
+    remove_after = rng.randrange(1, 37) if kind == 'removed' else None
+
+    if mode == 'monitor':
+        # 読み取り: monitor_nfc の監視コア + 画面側のDB照会
+        return loop.run_until_complete(core.tap(card, FakeCard(*swap_to) if swap_to else None, remove_after))
+
+    conn = core.reader
+    conn.place(card, remove_after)
+    try:
+        # nfc_writer.main() と同じ書き込み処理を実行し、UIDを取得してDBへ保存
+        # 再タップでは所持金だけが変わる想定（同じUIDを複数ステーションで同時に更新すると衝突する）
+        stats = [rng.randrange(0, 10000)] + list(stats[1:])
+        try:
+            nfc_writer.write_player_card(conn, name, *stats)
+        except SystemExit:
+            return 'write_failed'
+        card_uid = nfc_writer.get_uid(conn)
+        if db_conn and card_uid:
+            result = player_store.save_player(db_conn, {
+                'nfc_card_id': card_uid, 'name': name, 'age': None,
+                'money': stats[0], 'power': stats[1], 'stamina': stats[2], 'speed': stats[3],
+                'technique': stats[4], 'luck': stats[5], 'class': stats[6]
+            })
+            # attempts は INSERT / UPDATE を試した回数（成功した1回以外は衝突によるやり直し）
+            succeeded = result.status in (player_store.SAVE_INSERTED, player_store.SAVE_UPDATED)
+            db.add_conflicts(result.attempts - (1 if succeeded else 0))
+            if not result.ok:
+                return 'save_conflict'
+        return 'ok'
+    except CardConnectionException:
+        return 'removed'
+    finally:
+        conn.lift()
+
+# ============================================
+# 負荷の実行と集計
+# ============================================
+
+def run_rate(rate_per_min, args, mode):
+    """
+    指定の到着率（タップ/分）でタップを発生させ、全ステーションで処理した結果を集計する
+
+    到着はポアソン過程（指数分布の間隔）とし、各ステーションは1タップずつ順に処理する。
+    レイテンシは「到着してから処理が終わるまで」（待ち時間を含む）。
+    """
+    rng = random.Random(args.seed)
+    factory = TapFactory(rng, args.repeat_ratio, args.swap_ratio, args.removal_ratio)
+    db = FakeDatabase(args.db_latency) if args.db else None
+
+    # 到着時刻を事前に決定（同じシードなら同じ負荷になる）
+    arrivals = []
+    t = 0.0
+    for _ in range(args.taps):
+        t += rng.expovariate(rate_per_min / 60.0)
+        arrivals.append((t, factory.next_tap()))
+
+    inbox = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+
+    def station(station_id):
+        station_rng = random.Random(args.seed * 1000 + station_id)
+        reader = FakeConnection(None, station_rng, args.apdu_latency, args.apdu_jitter)
+        db_conn = db.connect() if db else None
+        loop = asyncio.new_event_loop()
+        core = LoadCore(args, reader, db_conn)
+        try:
+            while True:
+                item = inbox.get()
+                if item is None:
+                    return
+                arrived_at, tap = item
+                started_at = time.perf_counter()
+                outcome = run_tap(tap, mode, station_rng, args, db, (core, loop, db_conn))
+                finished_at = time.perf_counter()
+                with results_lock:
+                    results.append({
+                        'kind': tap[0],
+                        'outcome': outcome,
+                        'service': finished_at - started_at,
+                        'latency': finished_at - arrived_at
+                    })
+        finally:
+            loop.close()
+
+    workers = [threading.Thread(target=station, args=(i,), daemon=True) for i in range(args.stations)]
+    for w in workers:
+        w.start()
+
+    # 到着時刻どおりにタップを投入する
+    start = time.perf_counter()
+    for offset, tap in arrivals:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        inbox.put((start + offset, tap))
+    for _ in workers:
+        inbox.put(None)
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r['latency'] for r in results)
+    services = [r['service'] for r in results]
+    outcomes = {}
+    for r in results:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+    offered = len(arrivals) / arrivals[-1][0] * 60 if arrivals else 0
+    return {
+        'mode': mode,
+        'rate_per_min': rate_per_min,
+        'offered_per_min': round(offered, 1),
+        'throughput_per_min': round(len(results) / elapsed * 60, 1) if elapsed else 0,
+        'service_mean_ms': round(statistics.mean(services) * 1000, 1) if services else None,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'latency_p95_ms': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'outcomes': outcomes,
+        'save_conflicts': db.conflicts if db else None
+    }
+
+def is_saturated(result, args):
+    """
+    飽和判定: 処理が到着に追いつかない（スループットが到着率の90%未満）か、
+    p95レイテンシが許容値を超えたら飽和とみなす
+    """
+    if result['throughput_per_min'] < result['offered_per_min'] * 0.9:
+        return True
+    return result['latency_p95_ms'] is not None and result['latency_p95_ms'] > args.slo_ms
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='NFCタップの合成負荷生成ツール（キャパシティ計画用）')
+    parser.add_argument('--mode', choices=['monitor', 'writer', 'both'], default='monitor',
+                        help='計測する処理 (既定: %(default)s)')
+    parser.add_argument('--rates', default='30,60,120,240,480',
+                        help='到着率（タップ/分）のカンマ区切りリスト')
+    parser.add_argument('--taps', type=int, default=200, help='到着率ごとのタップ数')
+    parser.add_argument('--stations', type=int, default=1, help='同時に動くステーション（リーダー）数')
+    parser.add_argument('--apdu-latency', type=float, default=0.004, help='APDU1回の平均応答時間（秒）')
+    parser.add_argument('--apdu-jitter', type=float, default=0.001, help='APDU応答時間のばらつき（標準偏差, 秒）')
+    parser.add_argument('--presence-polls', type=int, default=3,
+                        help='読み取り後、カードを離すまでの存在確認(get_uid)の回数')
+    parser.add_argument('--poll-interval', type=float, default=monitor_nfc.DEFAULT_POLL_INTERVAL,
+                        help='存在確認の間隔（秒, 既定: NFC_POLL_INTERVAL）')
+    parser.add_argument('--arrive-debounce', type=float, default=monitor_nfc.DEFAULT_ARRIVE_DEBOUNCE,
+                        help='タッチ検知後の安定待ち（秒, 既定: NFC_ARRIVE_DEBOUNCE）')
+    parser.add_argument('--remove-hold', type=float, default=monitor_nfc.DEFAULT_REMOVE_HOLD,
+                        help='離脱の猶予（秒, 既定: NFC_REMOVE_HOLD）')
+    parser.add_argument('--patience', type=float, default=5.0,
+                        help='読み取れないカードを置き続ける時間（秒）')
+    parser.add_argument('--repeat-ratio', type=float, default=0.4, help='既知UIDの再タップの割合')
+    parser.add_argument('--swap-ratio', type=float, default=0.05, help='置いたままの差し替えの割合')
+    parser.add_argument('--removal-ratio', type=float, default=0.05, help='読み取り途中の取り外しの割合')
+    parser.add_argument('--db', action='store_true', help='DBの代替（SQLite）への照会・保存も行う')
+    parser.add_argument('--db-latency', type=float, default=0.002, help='DBクエリ1回の往復時間（秒）')
+    parser.add_argument('--slo-ms', type=float, default=1000, help='飽和判定に使うp95レイテンシの許容値（ミリ秒）')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード')
+    parser.add_argument('--json', action='store_true', help='結果をJSON Linesで出力する')
+    args = parser.parse_args()
+
+    rates = [float(r) for r in args.rates.split(',') if r.strip()]
+    modes = ['monitor', 'writer'] if args.mode == 'both' else [args.mode]
+
+    for mode in modes:
+        saturation = None
+        if not args.json:
+            print(f"=== {mode} / ステーション数 {args.stations} / DB {'あり' if args.db else 'なし'} ===")
+            print(f"{'到着率':>8} {'実到着':>8} {'処理量':>8} {'処理平均':>9} {'p50':>8} {'p95':>8} {'p99':>8}  結果")
+        for rate in rates:
+            result = run_rate(rate, args, mode)
+            saturated = is_saturated(result, args)
+            result['saturated'] = saturated
+            if saturated and saturation is None:
+                saturation = rate
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False))
+            else:
+                conflicts = f" version衝突 {result['save_conflicts']}回" if result['save_conflicts'] else ''
+                print(f"{rate:>8.0f} {result['offered_per_min']:>8} {result['throughput_per_min']:>8} "
+                      f"{result['service_mean_ms']:>8}ms {result['latency_p50_ms']:>6}ms "
+                      f"{result['latency_p95_ms']:>6}ms {result['latency_p99_ms']:>6}ms  "
+                      f"{result['outcomes']}{conflicts}{' ← 飽和' if saturated else ''}")
+            sys.stdout.flush()
+
+        summary = {'type': 'summary', 'mode': mode, 'stations': args.stations,
+                   'db': args.db, 'saturation_rate_per_min': saturation}
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False))
+        elif saturation is None:
+            print("飽和点: 指定した到着率の範囲では飽和しませんでした。")
+        else:
+            print(f"飽和点: 約 {saturation:.0f} タップ/分 で処理が追いつかなくなりました。")
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
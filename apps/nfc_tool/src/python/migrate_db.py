@@ -0,0 +1,76 @@
+import sys
+import io
+import mysql.connector
+import db_access
+import player_stats
+
+# ============================================
+# スキーマ変更（マイグレーション）
+# ============================================
+# 既存の player_status テーブルに後から追加したカラム・テーブルを適用するツール。
+# 何度実行しても安全なように、適用済みかどうかを確認してから実行する。
+
+def _column_exists(cursor, table, column):
+    """指定テーブルにカラムが存在するか"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+def _add_version_column(cursor):
+    """player_status に楽観的排他制御用の version カラムを追加する"""
+    if _column_exists(cursor, 'player_status', 'version'):
+        return False
+    cursor.execute("ALTER TABLE player_status ADD COLUMN version INT NOT NULL DEFAULT 0")
+    return True
+
+def _table_exists(cursor, table):
+    """指定テーブルが存在するか"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    return cursor.fetchone()[0] > 0
+
+def _create_aggregates_table(cursor):
+    """ダッシュボード用の集計テーブルを作成し、既存の player_status から初期値を集計する"""
+    if _table_exists(cursor, player_stats.AGGREGATES_TABLE):
+        return False
+    cursor.execute(player_stats.CREATE_TABLE_SQL)
+    player_stats.rebuild(cursor)
+    return True
+
+# (説明, 適用関数) のリスト。上から順に適用する
+MIGRATIONS = [
+    ('player_status.version カラムの追加', _add_version_column),
+    ('player_aggregates テーブルの作成', _create_aggregates_table),
+]
+
+def migrate():
+    print("=== データベースマイグレーション ===")
+
+    def apply_all(conn):
+        cursor = conn.cursor()
+        try:
+            for description, apply in MIGRATIONS:
+                applied = apply(cursor)
+                conn.commit()
+                print(f"{'✅ 適用しました' if applied else '- 適用済み'}: {description}")
+        finally:
+            cursor.close()
+
+    try:
+        db_access.run(apply_all)
+        print("マイグレーションが完了しました。")
+    except mysql.connector.Error as err:
+        print(f"❌ データベースエラー: {err}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    migrate()
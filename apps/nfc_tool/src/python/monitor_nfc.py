@@ -1,10 +1,18 @@
 import sys
+import os
 import json
 import time
 import io
+import argparse
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from smartcard.System import readers
 from smartcard.util import toHexString
 from smartcard.Exceptions import CardConnectionException
+import apdu_trace
+import card_archive
+import card_verify
 
 # #region agent log
 def _agent_log(hypothesis_id, location, message, data):
@@ -44,8 +52,11 @@ def get_uid(connection):
 # Pythonが標準出力やエラー出力に文字を表示する際、
 # 強制的に「UTF-8」エンコーディングを使用するように設定します。
 # これにより、日本語が含まれていても文字化けしにくくなります。
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+# ※ 負荷試験ツールなどから import された場合は呼び出し側の設定を尊重し、
+#    スクリプトとして直接起動された時だけ差し替えます。
+if __name__ == "__main__":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 # ============================================
 # ヘルパー関数
@@ -147,170 +158,672 @@ def read_nfc_data(connection):
     }
 
 # ============================================
-# メイン処理
+# 監視コア（asyncio）
 # ============================================
 
-def main():
+# 存在確認ポーリングの既定間隔（秒）
+DEFAULT_POLL_INTERVAL = float(os.getenv('NFC_POLL_INTERVAL', 0.2))
+# リーダーが見つからない・予期せぬエラー時の再試行間隔（秒）
+READER_RETRY_INTERVAL = 1.0
+# ハートビートの出力間隔（秒, 0で無効）
+HEARTBEAT_INTERVAL = float(os.getenv('NFC_HEARTBEAT_INTERVAL', 30))
+# タッチ検知後、UIDが安定しているか確かめてから読み取るまでの待ち時間（秒, 0で無効）
+DEFAULT_ARRIVE_DEBOUNCE = float(os.getenv('NFC_ARRIVE_DEBOUNCE', 0.05))
+# カードを見失ってから removed を出すまでの猶予（秒）。この間に同じカードが戻れば何も出さない
+DEFAULT_REMOVE_HOLD = float(os.getenv('NFC_REMOVE_HOLD', 0.3))
+# 読み取り失敗時の再試行間隔（秒）。連続失敗のたびに倍にし、上限で頭打ちにする
+READ_BACKOFF_BASE = float(os.getenv('NFC_READ_BACKOFF', 0.2))
+READ_BACKOFF_MAX = float(os.getenv('NFC_READ_BACKOFF_MAX', 5.0))
+
+# カードの在否の状態
+#   absent    : カードなし
+#   arriving  : カードを検知したが、まだ data を出していない（安定待ち・読み取り失敗の再試行中）
+#   present   : data を出した
+#   departing : present のカードを見失った（REMOVE_HOLD の間は removed を保留する）
+ABSENT = "absent"
+ARRIVING = "arriving"
+PRESENT = "present"
+DEPARTING = "departing"
+
+class ControlInterrupt(Exception):
+    """制御コマンド（一時停止など）によって、カード監視中のループを抜けるための例外"""
+    pass
+
+class CardSwapped(Exception):
+    """置かれたままのカードのUIDが変わった（別のカードに差し替えられた）"""
+    pass
+
+class MonitorCore:
     """
-    メインループ：カードの監視を行う
-    
-    このスクリプトは常駐し、以下の動作を繰り返します：
-    1. カードリーダーを検出
-    2. カードがタッチされたかチェック
-    3. タッチされたらデータを読み取ってJSON形式で出力
-    4. カードが離されるまで待機
-    5. 離されたら「removed」イベントを出力
+    カード監視の本体
+
+    イベントループ上で以下のタスクを並行して動かす：
+    - カード監視（存在確認・読み取り）: pyscard のブロッキング呼び出しは専用スレッドで実行
+    - 制御チャネル: 標準入力から1行1コマンドのJSONを受け取り、再起動せずに動作を変更する
+    - ハートビート: 一定間隔で生存通知を出力する
+    - メトリクス: プロファイラのダンプ要求・ゲージ出力を処理する
+
+    カードの在否は absent → arriving → present → departing の状態で管理し、
+    置き方が悪くて検知・離脱を繰り返す（フラップする）カードで読み取りやイベントが連発しないようにする：
+    - タッチ検知後 arrive_debounce 秒UIDが変わらなければ読み取る
+    - 見失っても remove_hold 秒以内に同じカードが戻れば、読み直さず removed も出さない
+    - 読み取りに失敗したら、同じカードの再読み取りを指数的に間隔を空けて行う
+
+    制御コマンド（標準入力, 1行1JSON）:
+        {"cmd": "pause"}                             監視を一時停止（リーダーから切断）
+        {"cmd": "resume"}                            監視を再開し、置かれているカードを読み直す
+        {"cmd": "set_poll_interval", "value": 0.5}   存在確認の間隔（秒）を変更
+        {"cmd": "set_debounce", "arrive": 0.05, "remove": 0.3}
+                                                     安定待ち・離脱の猶予（秒）を変更
+        {"cmd": "reread"}                            置かれているカードを強制的に読み直す
+        {"cmd": "status"}                            現在の状態を出力
+        {"cmd": "dump_profile"}                      プロファイルを出力（プロファイラ有効時）
     """
-    last_status = "removed" # 現在の状態 (removed: なし, present: あり)
-    current_uid = None      # 現在カードのUID（差し替え検知用）
-    loop_count = 0
-    consecutive_failures = 0
-    
-    # 起動確認用メッセージ (デバッグ用)
-    # print(json.dumps({"type": "status", "message": "monitoring_started"}), file=sys.stdout)
-    # sys.stdout.flush()
 
-    while True:
-        loop_count += 1
+    def __init__(self, profiler=None, reconcile_worker=None):
+        self.profiler = profiler
+        self.reconcile_worker = reconcile_worker
+        # pyscard の接続はスレッドセーフではないため、1スレッドで順番に実行する
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pyscard')
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+        self.arrive_debounce = DEFAULT_ARRIVE_DEBOUNCE
+        self.remove_hold = DEFAULT_REMOVE_HOLD
+        self.paused = False
+        self.reread_requested = False
+        # 制御コマンドを受けたら待機中の sleep を即座に起こすためのイベント
+        self.wakeup = None
+        self.resumed = None
+
+        self.presence = ABSENT       # カードの在否の状態（ABSENT / ARRIVING / PRESENT / DEPARTING）
+        self.current_uid = None      # 現在カードのUID（差し替え検知用）
+        self.departed_at = None      # DEPARTING になった時刻（self.clock）
+        self.failed_uid = None       # 読み取りに失敗しているカードのUID
+        self.next_read_at = 0.0      # 失敗後、次に読み取りを試してよい時刻（self.clock）
+        self.loop_count = 0
+        self.consecutive_failures = 0
+        self.presence_polls = 0
+        self.flaps_suppressed = 0
+        self.started_at = time.time()
+        # 猶予・再試行の判定に使う時計（APDUトレースの再生では記録上の時刻に差し替える）
+        self.clock = time.monotonic
+
+    # --------------------------------------------
+    # 出力
+    # --------------------------------------------
+
+    def emit(self, event):
+        """イベントを1行のJSONとして標準出力に送信する（main.js が受け取る）"""
+        print(json.dumps(event, ensure_ascii=False), file=sys.stdout)
+        sys.stdout.flush()
+
+    def state(self):
+        """現在の状態を辞書で返す"""
+        return {
+            "paused": self.paused,
+            "poll_interval": self.poll_interval,
+            "arrive_debounce": self.arrive_debounce,
+            "remove_hold": self.remove_hold,
+            "presence": self.presence,
+            "uid_suffix": str(self.current_uid)[-8:] if self.current_uid else None,
+            "loops": self.loop_count,
+            "presence_polls": self.presence_polls,
+            "consecutive_failures": self.consecutive_failures,
+            "flaps_suppressed": self.flaps_suppressed,
+            "uptime_sec": int(time.time() - self.started_at)
+        }
+
+    # --------------------------------------------
+    # 補助
+    # --------------------------------------------
+
+    async def blocking(self, func, *args):
+        """ブロッキングする pyscard の呼び出しを専用スレッドで実行する"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def sleep(self, seconds):
+        """
+        指定秒数待つ。ただし制御コマンドが来たら途中で起きる
+
+        一時停止や再読み取りの要求があれば ControlInterrupt を送出する。
+        """
         try:
-            # リーダーを探す
-            r = readers()
+            await asyncio.wait_for(self.wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        if self.paused or self.reread_requested:
+            raise ControlInterrupt()
+
+    def _reset_presence(self):
+        """カード状態を初期化する（removed は出さない）"""
+        self.presence = ABSENT
+        self.current_uid = None
+        self.departed_at = None
+
+    def _mark_removed(self, stage):
+        """カード離脱を通知し、状態を初期化する（data を出していなければ何も出さない）"""
+        if self.presence in (PRESENT, DEPARTING):
+            self.emit({"type": "removed"})
             # #region agent log
-            _agent_log("H1", "apps/nfc_tool/src/python/monitor_nfc.py:loop", "readers polled", {
-                "loop": loop_count,
-                "readers": len(r) if r else 0,
-                "last_status": last_status,
-                "consecutive_failures": consecutive_failures
+            _agent_log("H3", "apps/nfc_tool/src/python/monitor_nfc.py:removed", "card removed emitted", {
+                "loop": self.loop_count,
+                "stage": stage
             })
             # #endregion
-            if not r:
-                # リーダーが見つからない場合は少し待って再試行
-                time.sleep(1)
-                continue
-            
-            # 最初のリーダーを使用
-            connection = r[0].createConnection()
-            stage = "connect"
+        self._reset_presence()
+
+    def _expire_departure(self):
+        """離脱の猶予が過ぎたカードを removed にする"""
+        if self.presence == DEPARTING and self.clock() - self.departed_at >= self.remove_hold:
+            self._mark_removed("remove_hold")
+
+    def _read_failed(self, stage):
+        """読み取り失敗を記録し、同じカードの次の読み取りを遅らせる"""
+        self.consecutive_failures += 1
+        self.failed_uid = self.current_uid
+        delay = min(READ_BACKOFF_BASE * 2 ** (self.consecutive_failures - 1), READ_BACKOFF_MAX)
+        self.next_read_at = self.clock() + delay
+        # #region agent log
+        _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:detected", "card detected read FAILED", {
+            "loop": self.loop_count,
+            "stage": stage,
+            "consecutive_failures": self.consecutive_failures,
+            "backoff_sec": delay
+        })
+        # #endregion
+
+    def verify_originality(self, connection, uid):
+        """カードの真正性を確認する（NFC_VERIFY_ORIGINALITY 指定時のみ。無効ならNone）"""
+        return card_verify.check(connection, uid)
+
+    def archive(self, connection):
+        """カードイメージをアーカイブする（NFC_CARD_ARCHIVE 指定時のみ）"""
+        card_archive.record(connection, card_archive.SOURCE_MONITOR)
+
+    # --------------------------------------------
+    # カード監視タスク
+    # --------------------------------------------
+
+    async def _read_card(self, connection, stage):
+        """カードを読み取り、成功したら data イベントを送信する"""
+        try:
+            data = await self.blocking(read_nfc_data, connection)
+        except Exception:
+            # 読み取り途中で離された等（離脱の扱いは呼び出し側で行う）
+            self._read_failed(stage)
+            raise
+        if not data:
+            self._read_failed(stage)
+            return
+
+        self.current_uid = data.get("idm")
+        self.presence = PRESENT
+        self.consecutive_failures = 0
+        self.failed_uid = None
+        self.next_read_at = 0.0
+
+        # #region agent log
+        _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:detected", "card detected read OK", {
+            "loop": self.loop_count,
+            "idm_suffix": str(data.get("idm", ""))[-8:],  # PII対策: IDは末尾だけ残す
+            "name_len": len(data.get("name", "")) if isinstance(data.get("name", ""), str) else None
+        })
+        # #endregion
+        # NFC_VERIFY_ORIGINALITY 指定時は真正性を確認する（UIDごとに1回だけ。2回目以降はキャッシュ）
+        originality = await self.blocking(self.verify_originality, connection, data.get("idm"))
+        if originality is not None:
+            data["originality"] = originality
+        # 読み取り成功：データをJSON形式で標準出力に送信
+        # main.js がこれを受け取って画面に表示する
+        self.emit({"type": "data", "payload": data})
+        # NFC_CARD_ARCHIVE 指定時はカード全体のイメージをバックアップする
+        await self.blocking(self.archive, connection)
+        if self.reconcile_worker:
+            self.reconcile_worker.submit(data)
+
+    async def _arrive(self, connection, uid):
+        """
+        新しく検知したカードのUIDが arrive_debounce 秒後も同じか確かめ、ARRIVING にする
+
+        Returns:
+            bool: 安定していればTrue
+        """
+        if self.arrive_debounce > 0:
             try:
-                connection.connect()
-                stage = "connected"
-                
-                # --- カードを検知 ---
-                
-                # 前回の状態が「なし」だった場合（＝新しくタッチされた）
-                if last_status == "removed":
-                    # データを読み取る
-                    stage = "read_nfc_data"
-                    data = read_nfc_data(connection)
-                    if data:
-                        current_uid = data.get("idm")
-                        # PII対策: IDは末尾だけ残す
-                        masked_id = None
-                        try:
-                            masked_id = str(data.get("idm", ""))[-8:]
-                        except Exception:
-                            masked_id = None
-                        # #region agent log
-                        _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:detected", "card detected read OK", {
-                            "loop": loop_count,
-                            "idm_suffix": masked_id,
-                            "name_len": len(data.get("name", "")) if isinstance(data.get("name", ""), str) else None
-                        })
-                        # #endregion
-                        # 読み取り成功：データをJSON形式で標準出力に送信
-                        # main.js がこれを受け取って画面に表示する
-                        print(json.dumps({"type": "data", "payload": data}, ensure_ascii=False), file=sys.stdout)
-                        sys.stdout.flush()
-                        last_status = "present"
-                        consecutive_failures = 0
-                    else:
-                        consecutive_failures += 1
-                        # #region agent log
-                        _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:detected", "card detected read FAILED", {
-                            "loop": loop_count,
-                            "stage": stage,
-                            "consecutive_failures": consecutive_failures
-                        })
-                        # #endregion
-                
-                # --- カードが置かれている間のループ ---
-                # カードが存在し続ける限り、ここでループする
-                while True:
-                    try:
-                        # カードが存在するか確認するためにUIDを取得（差し替え検知も兼ねる）
-                        polled_uid = get_uid(connection)
-                        if not polled_uid:
-                            raise Exception("Card removed")
-
-                        # 差し替え検知：UIDが変わっているのに例外が出ないリーダーがあるため
-                        if last_status == "present" and current_uid and polled_uid != current_uid:
-                            # #region agent log
-                            _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:poll", "uid changed detected", {
-                                "loop": loop_count,
-                                "from_suffix": str(current_uid)[-8:],
-                                "to_suffix": str(polled_uid)[-8:]
-                            })
-                            # #endregion
-                            raise Exception("Card swapped")
-
-                        time.sleep(0.2) # 0.2秒ごとにチェック
-                    except Exception:
-                        # エラーが出たらカードが離されたと判断
-                        raise
-                        
-            except Exception as e:
-                # 接続エラーやカード離脱時の処理
-                if last_status == "present":
-                     # 前回までカードがあったなら、「離された」イベントを送信
-                     print(json.dumps({"type": "removed"}), file=sys.stdout)
-                     sys.stdout.flush()
-                     last_status = "removed"
-                     current_uid = None
-                     # #region agent log
-                     _agent_log("H3", "apps/nfc_tool/src/python/monitor_nfc.py:removed", "card removed emitted", {
-                         "loop": loop_count,
-                         "stage": stage
-                     })
-                     # #endregion
+                await self.sleep(self.arrive_debounce)
+            except ControlInterrupt:
+                if self.paused:
+                    raise
+            if await self.blocking(get_uid, connection) != uid:
+                return False
+        if uid != self.failed_uid:
+            # 別のカードなら、前のカードの失敗による待ちを持ち越さない
+            self.consecutive_failures = 0
+            self.failed_uid = None
+            self.next_read_at = 0.0
+        self.presence = ARRIVING
+        self.current_uid = uid
+        return True
+
+    async def _watch_card(self, connection):
+        """
+        カードに接続し、読み取り後は離されるまで存在確認を続ける
+
+        カード離脱・差し替え・接続失敗時は状態を更新して戻る。
+        """
+        stage = "connect"
+        try:
+            await self.blocking(connection.connect)
+            stage = "connected"
+            polled_uid = await self.blocking(get_uid, connection)
+            if not polled_uid:
+                raise Exception("Card removed")
+
+            if self.presence == DEPARTING:
+                if polled_uid == self.current_uid:
+                    # 猶予内に同じカードが戻った（フラップ）: 読み直さず、removed も出さない
+                    self.presence = PRESENT
+                    self.departed_at = None
+                    self.flaps_suppressed += 1
                 else:
-                     consecutive_failures += 1
-                     # #region agent log
-                     _agent_log("H4", "apps/nfc_tool/src/python/monitor_nfc.py:exception", "exception while removed", {
-                         "loop": loop_count,
-                         "stage": stage,
-                         "err_type": type(e).__name__,
-                         "err": str(e)[:120],
-                         "consecutive_failures": consecutive_failures
-                     })
-                     # #endregion
-
-                # 後始末：接続を明示的に切る（次回読めなくなる原因切り分けにも有効）
-                try:
-                    connection.disconnect()
+                    self._mark_removed("swapped_while_departing")
+
+            if self.presence == ABSENT:
+                stage = "debounce"
+                if not await self._arrive(connection, polled_uid):
+                    raise Exception("Card unstable")
+
+            # --- カードが置かれている間のループ ---
+            while True:
+                if self.reread_requested:
+                    # 制御コマンドによる強制再読み取り
+                    self.reread_requested = False
+                    stage = "reread"
+                    await self._read_card(connection, stage)
+                elif self.presence == ARRIVING and self.clock() >= self.next_read_at:
+                    # 新しくタッチされた（または前回の読み取りに失敗して待ち時間が過ぎた）
+                    stage = "read_nfc_data"
+                    await self._read_card(connection, stage)
+
+                # カードが存在するか確認するためにUIDを取得（差し替え検知も兼ねる）
+                stage = "poll"
+                polled_uid = await self.blocking(get_uid, connection)
+                if not polled_uid:
+                    raise Exception("Card removed")
+
+                # 差し替え検知：UIDが変わっているのに例外が出ないリーダーがあるため
+                if self.current_uid and polled_uid != self.current_uid:
                     # #region agent log
-                    _agent_log("H1", "apps/nfc_tool/src/python/monitor_nfc.py:cleanup", "connection disconnected", {
-                        "loop": loop_count
+                    _agent_log("H2", "apps/nfc_tool/src/python/monitor_nfc.py:poll", "uid changed detected", {
+                        "loop": self.loop_count,
+                        "from_suffix": str(self.current_uid)[-8:],
+                        "to_suffix": str(polled_uid)[-8:]
                     })
                     # #endregion
-                except Exception:
-                    pass
-                
-                # 次の検出まで少し待つ
-                time.sleep(0.2)
-                
+                    raise CardSwapped()
+
+                self.presence_polls += 1
+                try:
+                    await self.sleep(self.poll_interval)
+                except ControlInterrupt:
+                    if self.paused:
+                        raise
+                    # 再読み取り要求はループ先頭で処理する（接続は維持したまま）
+
+        except ControlInterrupt:
+            raise
+        except CardSwapped:
+            # 差し替えは猶予を待たずに離脱とし、次の周回で新しいカードを読む
+            self._mark_removed(stage)
         except Exception as e:
-            # その他の予期せぬエラー（リーダー切断など）
-            # print(f"Error: {e}", file=sys.stderr)
-            consecutive_failures += 1
+            # 接続エラーやカード離脱時の処理
+            if self.presence == PRESENT:
+                # すぐには removed を出さず、猶予の間に戻ってくるかを見る
+                self.presence = DEPARTING
+                self.departed_at = self.clock()
+            elif self.presence == ARRIVING:
+                # data を出す前に離された（失敗による待ち時間は同じカードが戻った時のために残す）
+                self._reset_presence()
             # #region agent log
-            _agent_log("H5", "apps/nfc_tool/src/python/monitor_nfc.py:outer", "outer exception", {
-                "loop": loop_count,
-                "err_type": type(e).__name__,
-                "err": str(e)[:120],
-                "consecutive_failures": consecutive_failures
-            })
+            if stage != "connect":
+                _agent_log("H4", "apps/nfc_tool/src/python/monitor_nfc.py:exception", "card lost", {
+                    "loop": self.loop_count,
+                    "stage": stage,
+                    "presence": self.presence,
+                    "err_type": type(e).__name__,
+                    "err": str(e)[:120],
+                    "consecutive_failures": self.consecutive_failures
+                })
             # #endregion
-            time.sleep(1)
+        finally:
+            # 後始末：接続を明示的に切る（次回読めなくなる原因切り分けにも有効）
+            try:
+                await self.blocking(connection.disconnect)
+                # #region agent log
+                _agent_log("H1", "apps/nfc_tool/src/python/monitor_nfc.py:cleanup", "connection disconnected", {
+                    "loop": self.loop_count
+                })
+                # #endregion
+            except Exception:
+                pass
+
+    async def card_task(self):
+        """
+        カード監視ループ
+
+        1. カードリーダーを検出
+        2. カードがタッチされたかチェック
+        3. UIDが安定したらデータを読み取ってJSON形式で出力
+        4. カードが離されるまで待機
+        5. 離されて猶予が過ぎたら「removed」イベントを出力
+        """
+        while True:
+            if self.paused:
+                await self.resumed.wait()
+
+            self.loop_count += 1
+            try:
+                # リーダーを探す
+                r = await self.blocking(readers)
+                # #region agent log
+                _agent_log("H1", "apps/nfc_tool/src/python/monitor_nfc.py:loop", "readers polled", {
+                    "loop": self.loop_count,
+                    "readers": len(r) if r else 0,
+                    "presence": self.presence,
+                    "consecutive_failures": self.consecutive_failures
+                })
+                # #endregion
+                if not r:
+                    # リーダーが見つからない場合は少し待って再試行
+                    self._expire_departure()
+                    await self.sleep(READER_RETRY_INTERVAL)
+                    continue
+
+                # 最初のリーダーを使用（NFC_APDU_TRACE 指定時は全APDUを記録する）
+                connection = card_archive.wrap_connection(apdu_trace.wrap_connection(r[0].createConnection()))
+                await self._watch_card(connection)
+                self._expire_departure()
+
+                # 次の検出まで少し待つ（離脱の猶予中は猶予の終わりまでに確認できる間隔にする）
+                interval = self.poll_interval
+                if self.presence == DEPARTING:
+                    remaining = self.remove_hold - (self.clock() - self.departed_at)
+                    interval = max(0.0, min(interval, remaining))
+                await self.sleep(interval)
+
+            except ControlInterrupt:
+                # 一時停止・再読み取りの要求（次の周回で処理する）
+                continue
+            except Exception as e:
+                # その他の予期せぬエラー（リーダー切断など）
+                # #region agent log
+                _agent_log("H5", "apps/nfc_tool/src/python/monitor_nfc.py:outer", "outer exception", {
+                    "loop": self.loop_count,
+                    "err_type": type(e).__name__,
+                    "err": str(e)[:120],
+                    "presence": self.presence
+                })
+                # #endregion
+                self._expire_departure()
+                try:
+                    await self.sleep(READER_RETRY_INTERVAL)
+                except ControlInterrupt:
+                    pass
+
+    # --------------------------------------------
+    # 制御チャネル
+    # --------------------------------------------
+
+    def handle_command(self, command):
+        """
+        制御コマンドを1件処理する
+
+        Args:
+            command: {"cmd": ..., ...} の辞書
+
+        Returns:
+            dict: 応答イベント
+        """
+        cmd = command.get("cmd")
+        response = {"type": "control", "cmd": cmd, "ok": True}
+
+        if cmd == "pause":
+            if not self.paused:
+                self.paused = True
+                self.resumed.clear()
+                # 一時停止中はカード状態を持ち越さない（再開時に読み直す）
+                self._reset_presence()
+        elif cmd == "resume":
+            self.paused = False
+            self.reread_requested = False
+            self._reset_presence()
+            self.resumed.set()
+        elif cmd == "set_poll_interval":
+            try:
+                value = float(command.get("value"))
+                if not (0.01 <= value <= 10):
+                    raise ValueError
+                self.poll_interval = value
+            except (TypeError, ValueError):
+                response.update(ok=False, error="value は0.01〜10秒の数値で指定してください")
+        elif cmd == "set_debounce":
+            try:
+                arrive = float(command.get("arrive", self.arrive_debounce))
+                remove = float(command.get("remove", self.remove_hold))
+                if not (0 <= arrive <= 5 and 0 <= remove <= 10):
+                    raise ValueError
+                self.arrive_debounce = arrive
+                self.remove_hold = remove
+            except (TypeError, ValueError):
+                response.update(ok=False, error="arrive は0〜5秒、remove は0〜10秒の数値で指定してください")
+        elif cmd == "reread":
+            self.reread_requested = True
+        elif cmd == "status":
+            response["payload"] = self.state()
+        elif cmd == "dump_profile":
+            if self.profiler:
+                self.profiler.request_dump()
+            else:
+                response.update(ok=False, error="プロファイラが無効です（--profile で起動してください）")
+        else:
+            response.update(ok=False, error=f"不明なコマンドです: {cmd}")
+
+        # 待機中の監視ループを起こして、変更をすぐに反映させる
+        self.wakeup.set()
+        return response
+
+    async def control_task(self):
+        """標準入力から制御コマンドを受け取って処理する"""
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read_stdin():
+            # Windowsではパイプの非同期読み込みが使えないため、専用スレッドで1行ずつ読む
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            # EOF（親プロセスがパイプを閉じた）
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+
+        threading.Thread(target=read_stdin, name='stdin-reader', daemon=True).start()
+
+        while True:
+            line = await lines.get()
+            if line is None:
+                # 制御チャネルが閉じられても監視自体は続ける
+                return
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                command = json.loads(line)
+                if not isinstance(command, dict):
+                    raise ValueError("JSON object expected")
+            except ValueError:
+                self.emit({"type": "control", "ok": False, "error": "JSONとして解釈できません"})
+                continue
+            self.emit(self.handle_command(command))
+
+    # --------------------------------------------
+    # ハートビート・メトリクス
+    # --------------------------------------------
+
+    async def heartbeat_task(self):
+        """一定間隔で生存通知を出力する（main.js 側でプロセスの固まりを検知できるように）"""
+        if HEARTBEAT_INTERVAL <= 0:
+            return
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.emit({"type": "heartbeat", "payload": self.state()})
+
+    async def metrics_task(self):
+        """プロファイラのダンプ要求・ゲージ出力を処理する"""
+        if not self.profiler:
+            return
+        while True:
+            await asyncio.sleep(1)
+            for event in self.profiler.tick({
+                "loops": self.loop_count,
+                "presence_polls": self.presence_polls,
+                "consecutive_failures": self.consecutive_failures,
+                "flaps_suppressed": self.flaps_suppressed
+            }):
+                self.emit(event)
+
+    async def run(self):
+        """全タスクを起動し、いずれかが異常終了するまで動かす"""
+        self.wakeup = asyncio.Event()
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        tasks = [
+            asyncio.create_task(self.card_task(), name='card'),
+            asyncio.create_task(self.control_task(), name='control'),
+            asyncio.create_task(self.heartbeat_task(), name='heartbeat'),
+            asyncio.create_task(self.metrics_task(), name='metrics'),
+        ]
+        # 正常に終わるタスク（制御チャネルのEOFや無効化されたタスク）は無視し、
+        # カード監視タスクが終わる（＝例外）までは動かし続ける
+        await tasks[0]
+
+# ============================================
+# APDUトレースの再生
+# ============================================
+
+class ReplayCore(MonitorCore):
+    """
+    APDUトレースを MonitorCore と同じ手順（存在確認・安定待ち・読み取り）で再生する監視コア
+
+    apdu_trace.replay から、記録の connect〜disconnect ごとに replay_session() を呼ぶ。
+    セッションを跨いでカードの状態を持ち越すので、フラップや離脱の猶予も記録どおりに判定される。
+
+    - pyscard の呼び出しはその場で実行し、sleep では待たない
+    - 時計は記録上の時刻（apdu_trace.ReplayConnection.clock）を使う
+    - 制御コマンドは記録されないため、表示中のカードの存在確認の後に読み取りが記録されていれば reread とみなす
+    - 真正性確認は、記録に署名の読み出しがある時だけキャッシュを使わずに行う
+    - カードイメージのアーカイブ・DB照合は行わない
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.connection = None
+        self.events = []
+        self.verifier = None
+        self.clock = self._trace_clock
+
+    def _trace_clock(self):
+        return self.connection.clock() if self.connection else 0.0
+
+    def emit(self, event):
+        self.events.append(event)
+
+    async def blocking(self, func, *args):
+        return func(*args)
+
+    async def sleep(self, seconds):
+        # read_nfc_data は UID の取得（FF CA）の直後に READ BINARY（FF B0）を送る。存在確認では続かない
+        commands = self.connection.next_commands(2)
+        if (self.presence == PRESENT and len(commands) == 2
+                and commands[0][1:2] == b'\xCA' and commands[1][1:2] == b'\xB0'):
+            self.reread_requested = True
+            raise ControlInterrupt()
+
+    def verify_originality(self, connection, uid):
+        command = connection.next_command()
+        if command not in [bytes(apdu) for apdu in card_verify.READ_SIG_FIRST_APDUS]:
+            return None
+        if self.verifier is None:
+            self.verifier = card_verify.OriginalityVerifier()
+        # 記録にはリーダー名が残らないため、最初のAPDUから送り方を決める
+        reader = 'ACR122' if command == bytes(card_verify.ACR122_READ_SIG_APDU) else ''
+        verdict, _ = self.verifier.verify_card(connection, uid, reader)
+        return {'status': verdict, 'cached': False, 'verified_at': time.time()}
+
+    def archive(self, connection):
+        pass
+
+    def replay_session(self, connection):
+        """
+        1セッション分の記録を再生する
+
+        Args:
+            connection: apdu_trace.ReplayConnection
+
+        Returns:
+            dict: 出力したイベントと、このセッションでのポーリング・抑止の回数
+        """
+        self.connection = connection
+        self.events = []
+        polls, flaps = self.presence_polls, self.flaps_suppressed
+        # 前のセッションから離脱の猶予が過ぎていれば removed にする（card_task と同じ）
+        self._expire_departure()
+        asyncio.run(self._watch_card(connection))
+        return {
+            'events': self.events,
+            'presence': self.presence,
+            'presence_polls': self.presence_polls - polls,
+            'flaps_suppressed': self.flaps_suppressed - flaps,
+        }
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    """
+    メイン処理：監視コアを起動する
+
+    このスクリプトは常駐し、カードのタッチ・離脱を JSON で標準出力に送り続けます。
+    標準入力からは制御コマンドを受け付けます（MonitorCore を参照）。
+    """
+    # コマンドライン引数（main.js からは引数なしで起動される）
+    parser = argparse.ArgumentParser(description='NFCカード監視')
+    parser.add_argument('--profile', nargs='?', const='sample', default=None,
+                        choices=['sample', 'cprofile'],
+                        help='プロファイリングを有効にする（環境変数 NFC_PROFILE でも可）')
+    args, _ = parser.parse_known_args()
+
+    # プロファイラ（--profile または NFC_PROFILE の時のみ）
+    # SIGUSR1 または制御コマンド dump_profile でレポートをファイルに出力し、
+    # 定期的にRSS等のゲージを status として出力する
+    profiler = None
+    from profiling import MonitorProfiler, profile_mode_from_env
+    profile_mode = args.profile or profile_mode_from_env()
+    if profile_mode:
+        profiler = MonitorProfiler(profile_mode)
+        profiler.start()
+
+    # カード↔DB照合ワーカー（NFC_RECONCILE=1 の時のみ）
+    # 照合はDBアクセスを伴うため、タップ処理とは別スレッドで行う
+    reconcile_worker = None
+    if os.getenv('NFC_RECONCILE', '0') == '1':
+        from reconcile import ReconcileWorker
+        reconcile_worker = ReconcileWorker()
+        reconcile_worker.start()
+
+    try:
+        asyncio.run(MonitorCore(profiler, reconcile_worker).run())
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,14 @@
 import sys
 import json
 import io
-import os
 from smartcard.System import readers
 from smartcard.util import toHexString
 import time
 import mysql.connector
-from dotenv import load_dotenv
-
-# .envファイルを読み込む
-load_dotenv()
+import apdu_trace
+import card_archive
+import db_access
+import player_store
 
 # ============================================
 # 設定と初期化
@@ -17,8 +16,11 @@ load_dotenv()
 
 # --- 標準入出力のエンコーディングをUTF-8に設定 ---
 # 日本語を含むデータを正しく扱うために必要です
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+# ※ 負荷試験ツールなどから import された場合は呼び出し側の設定を尊重し、
+#    スクリプトとして直接起動された時だけ差し替えます。
+if __name__ == "__main__":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
 # ============================================
 # データマッピング定義
@@ -88,73 +90,107 @@ def get_uid(connection):
 def save_to_db(player_data):
     """
     プレイヤーデータをMySQLデータベースに保存する関数
+
+    変更のあったカラムだけを、行のバージョンが読み取り時から変わっていない場合に限り書き込む。
+    他のステーションと同時に更新した場合は最新の行を読み直して再試行する。
+
+    Returns:
+        SaveResult: 保存結果（DBエラー時はNone）
     """
     try:
-        # DB接続設定
-        # 親ディレクトリの.envを読むためパスを調整するか、あるいはカレントディレクトリ依存
-        # ここでは環境変数がロード済みであることを期待するが、実行時のパスに依存する
+        # DB接続設定は db_access が環境変数（.env）から読み込む
         # main.jsからの起動時はプロジェクトルートがcwdになるため、そのまま読めるはず
-        
-        db_config = {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'user': os.getenv('DB_USER', 'root'),
-            'password': os.getenv('DB_PASSWORD', ''),
-            'database': os.getenv('DB_NAME', 'nfc_game_db'),
-            'port': int(os.getenv('DB_PORT', 3306))
-        }
-
-        # データベースに接続
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
-
-        # UPSERT文 (INSERT ... ON DUPLICATE KEY UPDATE)
-        # nfc_card_id が重複する場合は既存レコードを更新
-        sql = """
-        INSERT INTO player_status (
-            nfc_card_id, user_name, age, money, power, stamina, speed, technique, luck, class
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        ) ON DUPLICATE KEY UPDATE
-            user_name = VALUES(user_name),
-            age = VALUES(age),
-            money = VALUES(money),
-            power = VALUES(power),
-            stamina = VALUES(stamina),
-            speed = VALUES(speed),
-            technique = VALUES(technique),
-            luck = VALUES(luck),
-            class = VALUES(class),
-            updated_at = CURRENT_TIMESTAMP
-        """
-
-        val = (
-            player_data['nfc_card_id'],
-            player_data['name'],
-            player_data['age'],
-            player_data['money'],
-            player_data['power'],
-            player_data['stamina'],
-            player_data['speed'],
-            player_data['technique'],
-            player_data['luck'],
-            player_data['class']
-        )
-
-        cursor.execute(sql, val)
-        conn.commit()
-        
-        print(f"データベースへの保存が完了しました。ID: {cursor.lastrowid}", file=sys.stderr)
-        
-        cursor.close()
-        conn.close()
-        return True
+
+        # タイムアウト・リトライ付きで実行（DB停止中はブレーカーにより即座に失敗する）
+        # 保存は集計の加算を伴うため、実行中に接続が切れた場合は再試行しない
+        result = db_access.run(lambda conn: player_store.save_player(conn, player_data), retry_on_lost=False)
+
+        if result.status == player_store.SAVE_CONFLICT:
+            print(f"警告: 他のステーションによる更新と衝突したため、データベースへの保存を中止しました。"
+                  f"（試行回数: {result.attempts}）", file=sys.stderr)
+        elif result.status == player_store.SAVE_UNCHANGED:
+            print("データベースの内容は最新のため、更新は不要でした。", file=sys.stderr)
+        else:
+            print(f"データベースへの保存が完了しました。({result.status}, 変更: {', '.join(result.changed)}, "
+                  f"version: {result.version})", file=sys.stderr)
+        return result
 
     except mysql.connector.Error as err:
         print(f"データベースエラー: {err}", file=sys.stderr)
-        return False
+        return None
     except Exception as e:
         print(f"DB保存中に予期せぬエラーが発生しました: {e}", file=sys.stderr)
-        return False
+        return None
+
+def write_player_card(connection, name, money, power, stamina, speed, technique, luck, player_class):
+    """
+    名前とステータスを PAGE_MAPPING に従ってカードに書き込む関数
+
+    書き込みや値の検証に失敗した場合はエラーを出力して終了する（main.js に終了コードで伝えるため）。
+
+    Args:
+        connection: カードリーダーとの接続オブジェクト
+        name: 名前（UTF-8で20バイトまで）
+        money, power, stamina, speed, technique, luck, player_class: 各ステータス（0〜65535）
+    """
+    # --- 名前の書き込み ---
+    # 名前をUTF-8形式のバイト列に変換
+    name_bytes = name.encode('utf-8')
+    # 20バイトに満たない場合は0x00で埋め、20バイトを超える場合は切り捨て
+    name_bytes = name_bytes.ljust(20, b'\x00')[:20]
+
+    # 20バイトのデータを4バイトずつ5ページに分けて書き込む
+    for i in range(5):
+        chunk = list(name_bytes[i*4:(i+1)*4])
+        page_to_write = PAGE_MAPPING['name'] + i
+        if not write_page(connection, page_to_write, chunk):
+            print(f"エラー: 名前の書き込みに失敗しました (ページ {page_to_write})", file=sys.stderr)
+            sys.exit(1)
+
+    # --- ステータスのペア書き込み ---
+
+    # 値を検証し、2バイトのバイト列に変換するヘルパー関数
+    def validate_and_convert(key, value):
+        try:
+            numeric_value = int(value)
+            if not (0 <= numeric_value <= 65535):
+                print(f"エラー: {key} の値 '{value}' は0から65535の範囲外です。", file=sys.stderr)
+                sys.exit(1)
+            # 整数を2バイトのリトルエンディアン形式のバイト列に変換
+            return numeric_value.to_bytes(2, 'little')
+        except ValueError:
+            print(f"エラー: {key} の値 '{value}' は有効な数値ではありません。", file=sys.stderr)
+            sys.exit(1)
+
+    # 1. 所持金 (money) と パワー (power) をページ9に書き込む
+    money_bytes = validate_and_convert('money', money)
+    power_bytes = validate_and_convert('power', power)
+    combined_data = list(money_bytes + power_bytes) # 2バイト + 2バイト = 4バイト
+    if not write_page(connection, PAGE_MAPPING['money_power'], combined_data):
+        print(f"エラー: money/power の書き込みに失敗しました (ページ {PAGE_MAPPING['money_power']})", file=sys.stderr)
+        sys.exit(1)
+
+    # 2. スタミナ (stamina) と スピード (speed) をページ10に書き込む
+    stamina_bytes = validate_and_convert('stamina', stamina)
+    speed_bytes = validate_and_convert('speed', speed)
+    combined_data = list(stamina_bytes + speed_bytes)
+    if not write_page(connection, PAGE_MAPPING['stamina_speed'], combined_data):
+        print(f"エラー: stamina/speed の書き込みに失敗しました (ページ {PAGE_MAPPING['stamina_speed']})", file=sys.stderr)
+        sys.exit(1)
+
+    # 3. テクニック (technique) と ラック (luck) をページ11に書き込む
+    technique_bytes = validate_and_convert('technique', technique)
+    luck_bytes = validate_and_convert('luck', luck)
+    combined_data = list(technique_bytes + luck_bytes)
+    if not write_page(connection, PAGE_MAPPING['technique_luck'], combined_data):
+        print(f"エラー: technique/luck の書き込みに失敗しました (ページ {PAGE_MAPPING['technique_luck']})", file=sys.stderr)
+        sys.exit(1)
+
+    # 4. クラス (class) をページ12に書き込む (残りの2バイトはパディングされる)
+    class_bytes = validate_and_convert('class', player_class)
+    if not write_page(connection, PAGE_MAPPING['class'], list(class_bytes)):
+        print(f"エラー: class の書き込みに失敗しました (ページ {PAGE_MAPPING['class']})", file=sys.stderr)
+        sys.exit(1)
 
 # ============================================
 # メイン処理
@@ -183,7 +219,8 @@ def main():
             print("エラー: リーダーが見つかりません。USB接続を確認してください。", file=sys.stderr)
             sys.exit(1)
         
-        connection = r[0].createConnection()
+        # NFC_APDU_TRACE 指定時は全APDUを記録し、NFC_CARD_ARCHIVE 指定時は書き込んだイメージを保存する
+        connection = card_archive.wrap_connection(apdu_trace.wrap_connection(r[0].createConnection()))
         
         # --- カード待機処理 ---
         print("NFCカードをタッチしてください...", file=sys.stderr) # このメッセージはmain.jsのログに出力される
@@ -214,64 +251,10 @@ def main():
         # 3. 各データのNFCカードへの書き込み
         # ============================================
 
-        # --- 名前の書き込み ---
-        # 名前をUTF-8形式のバイト列に変換
-        name_bytes = name.encode('utf-8')
-        # 20バイトに満たない場合は0x00で埋め、20バイトを超える場合は切り捨て
-        name_bytes = name_bytes.ljust(20, b'\x00')[:20]
-        
-        # 20バイトのデータを4バイトずつ5ページに分けて書き込む
-        for i in range(5):
-            chunk = list(name_bytes[i*4:(i+1)*4])
-            page_to_write = PAGE_MAPPING['name'] + i
-            if not write_page(connection, page_to_write, chunk):
-                print(f"エラー: 名前の書き込みに失敗しました (ページ {page_to_write})", file=sys.stderr)
-                sys.exit(1)
-
-        # --- ステータスのペア書き込み ---
-        
-        # 値を検証し、2バイトのバイト列に変換するヘルパー関数
-        def validate_and_convert(key, value):
-            try:
-                numeric_value = int(value)
-                if not (0 <= numeric_value <= 65535):
-                    print(f"エラー: {key} の値 '{value}' は0から65535の範囲外です。", file=sys.stderr)
-                    sys.exit(1)
-                # 整数を2バイトのリトルエンディアン形式のバイト列に変換
-                return numeric_value.to_bytes(2, 'little')
-            except ValueError:
-                print(f"エラー: {key} の値 '{value}' は有効な数値ではありません。", file=sys.stderr)
-                sys.exit(1)
+        write_player_card(connection, name, money, power, stamina, speed, technique, luck, player_class)
 
-        # 1. 所持金 (money) と パワー (power) をページ9に書き込む
-        money_bytes = validate_and_convert('money', money)
-        power_bytes = validate_and_convert('power', power)
-        combined_data = list(money_bytes + power_bytes) # 2バイト + 2バイト = 4バイト
-        if not write_page(connection, PAGE_MAPPING['money_power'], combined_data):
-            print(f"エラー: money/power の書き込みに失敗しました (ページ {PAGE_MAPPING['money_power']})", file=sys.stderr)
-            sys.exit(1)
-            
-        # 2. スタミナ (stamina) と スピード (speed) をページ10に書き込む
-        stamina_bytes = validate_and_convert('stamina', stamina)
-        speed_bytes = validate_and_convert('speed', speed)
-        combined_data = list(stamina_bytes + speed_bytes)
-        if not write_page(connection, PAGE_MAPPING['stamina_speed'], combined_data):
-            print(f"エラー: stamina/speed の書き込みに失敗しました (ページ {PAGE_MAPPING['stamina_speed']})", file=sys.stderr)
-            sys.exit(1)
-            
-        # 3. テクニック (technique) と ラック (luck) をページ11に書き込む
-        technique_bytes = validate_and_convert('technique', technique)
-        luck_bytes = validate_and_convert('luck', luck)
-        combined_data = list(technique_bytes + luck_bytes)
-        if not write_page(connection, PAGE_MAPPING['technique_luck'], combined_data):
-            print(f"エラー: technique/luck の書き込みに失敗しました (ページ {PAGE_MAPPING['technique_luck']})", file=sys.stderr)
-            sys.exit(1)
-            
-        # 4. クラス (class) をページ12に書き込む (残りの2バイトはパディングされる)
-        class_bytes = validate_and_convert('class', player_class)
-        if not write_page(connection, PAGE_MAPPING['class'], list(class_bytes)):
-            print(f"エラー: class の書き込みに失敗しました (ページ {PAGE_MAPPING['class']})", file=sys.stderr)
-            sys.exit(1)
+        # カードイメージのバックアップ（有効時のみ。インベントリのページも読み足して保存する）
+        card_archive.record(connection, card_archive.SOURCE_WRITER, complete=True)
 
         # ============================================
         # 4. 残りのページをゼロでクリア (無効化)
@@ -298,7 +281,7 @@ def main():
             db_data = {
                 'nfc_card_id': uid,
                 'name': name,
-                'age': age if age and age.isdigit() else None,
+                'age': int(age) if age and age.isdigit() else None,
                 'money': int(money),
                 'power': int(power),
                 'stamina': int(stamina),
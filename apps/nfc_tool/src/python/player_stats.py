@@ -0,0 +1,285 @@
+import sys
+import io
+import json
+import time
+import argparse
+import mysql.connector
+import db_access
+
+# ============================================
+# ダッシュボード用の集計（player_aggregates テーブル）
+# ============================================
+# クラス別の登録人数・ステータス合計・所持金合計を player_aggregates に持ち、
+# player_store の保存処理と同じトランザクション内で差分だけ加減算する。
+# ダッシュボードはこのテーブル（クラス数分の行）だけを読むので、
+# プレイヤー数に関係なく一定の時間で応答できる。
+#
+# 差分更新から漏れた変更（手作業のSQLなど）によるずれは、
+# recompute で player_status から全件集計し直して補正する（--watch で定期実行）。
+# 全件集計はロックを取らない読み取りで行い、補正はずれの分だけを加算するので、
+# 集計中も各ステーションの保存（apply_delta）は待たされない。
+
+AGGREGATES_TABLE = 'player_aggregates'
+
+# 合計を持つカラム
+SUM_COLUMNS = ['money', 'power', 'stamina', 'speed', 'technique', 'luck']
+# 平均を出すステータス（所持金は合計のみ）
+STAT_COLUMNS = ['power', 'stamina', 'speed', 'technique', 'luck']
+
+# class が NULL の行を集計するキー（主キーにNULLは使えないため）
+NO_CLASS = -1
+
+# 1146: テーブルが存在しない（マイグレーション未適用）
+ER_NO_SUCH_TABLE = 1146
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {AGGREGATES_TABLE} (
+    class INT NOT NULL PRIMARY KEY,
+    players INT NOT NULL DEFAULT 0,
+    {', '.join(f'sum_{column} BIGINT NOT NULL DEFAULT 0' for column in SUM_COLUMNS)},
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+
+def _number(value):
+    """集計用に数値化する（NULLや数値でない値は0とみなす。SUM() と同じ扱い）"""
+    try:
+        return int(value) if value is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+def _class_key(row):
+    value = row.get('class')
+    return NO_CLASS if value is None else _number(value)
+
+# ============================================
+# 差分更新
+# ============================================
+
+def row_deltas(old_row, new_row):
+    """
+    行の変更による集計の増減を返す
+
+    Args:
+        old_row: 変更前の行（新規登録ならNone）
+        new_row: 変更後の行（削除ならNone）
+
+    Returns:
+        dict: class → [players, sum_money, sum_power, ...] の増減（変化の無いクラスは含まない）
+    """
+    deltas = {}
+    for row, sign in ((old_row, -1), (new_row, 1)):
+        if row is None:
+            continue
+        values = deltas.setdefault(_class_key(row), [0] * (1 + len(SUM_COLUMNS)))
+        values[0] += sign
+        for i, column in enumerate(SUM_COLUMNS, start=1):
+            values[i] += sign * _number(row.get(column))
+    return {key: values for key, values in deltas.items() if any(values)}
+
+def apply_delta(cursor, old_row, new_row):
+    """
+    行の変更に合わせて player_aggregates を加減算する（コミットは呼び出し側で行う）
+
+    player_status の更新と同じトランザクションで呼び出すこと。
+    集計テーブルが未作成の場合は何もしない（保存処理自体は止めない）。
+
+    Returns:
+        bool: 集計を更新したらTrue
+    """
+    return _apply_deltas(cursor, row_deltas(old_row, new_row))
+
+def apply_removed(cursor, rows):
+    """
+    まとめて削除した行を集計から差し引く（クラスごとに1回の更新で済ませる）
+
+    Returns:
+        bool: 集計を更新したらTrue
+    """
+    deltas = {}
+    for row in rows:
+        for key, values in row_deltas(row, None).items():
+            total = deltas.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return _apply_deltas(cursor, deltas)
+
+def _apply_deltas(cursor, deltas):
+    """class → 増減 の辞書を player_aggregates に加算する"""
+    if not deltas:
+        return False
+    columns = ['players'] + [f'sum_{column}' for column in SUM_COLUMNS]
+    sql = (f"INSERT INTO {AGGREGATES_TABLE} (class, {', '.join(columns)}) "
+           f"VALUES (%s, {', '.join(['%s'] * len(columns))}) ON DUPLICATE KEY UPDATE "
+           + ', '.join(f"{column} = {column} + VALUES({column})" for column in columns))
+    try:
+        for key, values in sorted(deltas.items()):
+            # クラスの昇順で更新し、同時に保存するステーション間でデッドロックしにくくする
+            cursor.execute(sql, (key, *values))
+    except mysql.connector.Error as err:
+        if err.errno == ER_NO_SUCH_TABLE:
+            return False
+        raise
+    return True
+
+# ============================================
+# 全件再集計
+# ============================================
+
+def _read_aggregates(cursor):
+    cursor.execute(f"SELECT * FROM {AGGREGATES_TABLE} ORDER BY class")
+    rows = cursor.fetchall()
+    return {row['class']: row for row in rows}
+
+_TOTALS_SELECT = (
+    f"SELECT COALESCE(`class`, {NO_CLASS}) AS class, COUNT(*) AS players, "
+    + ', '.join(f"COALESCE(SUM(`{column}`), 0) AS sum_{column}" for column in SUM_COLUMNS)
+    + f" FROM player_status GROUP BY COALESCE(`class`, {NO_CLASS})"
+)
+
+def rebuild(cursor):
+    """player_status を全件集計して player_aggregates を作り直す（コミットは呼び出し側で行う）"""
+    cursor.execute(f"DELETE FROM {AGGREGATES_TABLE}")
+    cursor.execute(
+        f"INSERT INTO {AGGREGATES_TABLE} (class, players, {', '.join(f'sum_{c}' for c in SUM_COLUMNS)}) "
+        + _TOTALS_SELECT
+    )
+
+def recompute(conn):
+    """
+    集計を作り直し、差分更新とのずれを返す
+
+    1. 同じスナップショット（ロックを取らない一貫性読み取り）で player_status の全件集計と
+       player_aggregates を読み、その時点でのずれを求める
+    2. ずれの分だけを短いトランザクションで加算する
+    スナップショット後に保存された差分はそのまま残るので、集計中の保存を打ち消さない。
+
+    Returns:
+        list: ずれていたクラスごとの {"class", "column", "before", "after"} のリスト
+    """
+    columns = ['players'] + [f'sum_{column}' for column in SUM_COLUMNS]
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # 全件集計の SELECT は db_access の MAX_EXECUTION_TIME を超えうるため、この接続では外す
+        # （プールから借りる時に毎回設定し直されるので、他の処理には影響しない）
+        cursor.execute("SET SESSION MAX_EXECUTION_TIME = 0")
+        conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+        before = _read_aggregates(cursor)
+        cursor.execute(_TOTALS_SELECT)
+        after = {row['class']: row for row in cursor.fetchall()}
+        conn.commit()
+
+        drift = []
+        deltas = {}
+        for key in sorted(set(before) | set(after)):
+            values = []
+            for column in columns:
+                old = _number(before.get(key, {}).get(column))
+                new = _number(after.get(key, {}).get(column))
+                values.append(new - old)
+                if old != new:
+                    drift.append({'class': key, 'column': column, 'before': old, 'after': new})
+            if any(values):
+                deltas[key] = values
+
+        _apply_deltas(cursor, deltas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return drift
+
+# ============================================
+# ダッシュボード
+# ============================================
+
+def _average(total, count):
+    return round(total / count, 2) if count else None
+
+def dashboard(conn):
+    """
+    ダッシュボード用の数値を返す（player_aggregates のみを読む）
+
+    Returns:
+        dict: 登録人数・所持金合計・ステータス平均（全体とクラス別）
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        rows = _read_aggregates(cursor)
+    finally:
+        cursor.close()
+
+    total_players = 0
+    totals = {column: 0 for column in SUM_COLUMNS}
+    by_class = []
+    updated_at = None
+    for key, row in rows.items():
+        players = _number(row['players'])
+        if players <= 0:
+            continue
+        total_players += players
+        for column in SUM_COLUMNS:
+            totals[column] += _number(row[f'sum_{column}'])
+        by_class.append({
+            'class': None if key == NO_CLASS else key,
+            'players': players,
+            'total_money': _number(row['sum_money']),
+            'average': {column: _average(_number(row[f'sum_{column}']), players) for column in STAT_COLUMNS}
+        })
+        if row.get('updated_at') and (updated_at is None or row['updated_at'] > updated_at):
+            updated_at = row['updated_at']
+
+    return {
+        'players': total_players,
+        'total_money': totals['money'],
+        'average': {column: _average(totals[column], total_players) for column in STAT_COLUMNS},
+        'by_class': by_class,
+        'updated_at': updated_at.isoformat() if hasattr(updated_at, 'isoformat') else updated_at
+    }
+
+# ============================================
+# メイン処理
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='ダッシュボード用の集計ツール')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('dashboard', help='ダッシュボードの数値をJSONで出力する（既定）')
+    recompute_parser = sub.add_parser('recompute', help='player_status から集計を作り直す')
+    recompute_parser.add_argument('--watch', type=float, default=0,
+                                  help='指定秒ごとに繰り返し実行する（0なら1回だけ）')
+    args = parser.parse_args()
+
+    if args.command != 'recompute':
+        try:
+            print(json.dumps(db_access.run(dashboard), ensure_ascii=False))
+        except mysql.connector.Error as err:
+            print(json.dumps({'error': f"Database error: {err}"}, ensure_ascii=False))
+            sys.exit(1)
+        return
+
+    while True:
+        try:
+            started = time.perf_counter()
+            # 補正は加算なので、実行中に接続が切れた場合は再試行しない
+            drift = db_access.run(recompute, retry_on_lost=False)
+            print(json.dumps({'recomputed': True, 'drift': drift,
+                              'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)},
+                             ensure_ascii=False))
+            sys.stdout.flush()
+        except mysql.connector.Error as err:
+            print(f"データベースエラー: {err}", file=sys.stderr)
+            if not args.watch:
+                sys.exit(1)
+
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
@@ -0,0 +1,334 @@
+import mysql.connector
+import player_stats
+
+# ============================================
+# player_status テーブルへのアクセス
+# ============================================
+# SQLを各スクリプトに散らばらせないため、player_status を読み書きする処理をここに集約する。
+# 接続は呼び出し側が db_access.run() で用意したものを受け取る。
+# 行の追加・更新・削除時は、同じトランザクション内で player_stats の集計も加減算する。
+
+# カードにも保存される（カードとDBで比較できる）カラム
+CARD_COLUMNS = ['user_name', 'money', 'power', 'stamina', 'speed', 'technique', 'luck', 'class']
+
+# 画面・APIに返すカラム
+PLAYER_COLUMNS = ['nfc_card_id', 'user_name', 'age', 'money', 'power',
+                  'stamina', 'speed', 'technique', 'luck', 'class']
+
+# IN (...) 1回あたりのUID数（大きすぎるとパケットサイズやプランに悪影響があるため分割する）
+DEFAULT_CHUNK_SIZE = 500
+
+def _chunks(items, size):
+    """リストを size 件ずつに分割して返す"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def iter_players_by_uids(conn, uids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    複数UIDのプレイヤーを WHERE nfc_card_id IN (...) で chunk_size 件ずつ取得する
+
+    1チャンクごとに結果を返すので、呼び出し側は全件の取得を待たずに処理を始められる。
+
+    Args:
+        conn: MySQL接続オブジェクト
+        uids: 取得するUIDのリスト（重複可）
+        chunk_size: 1クエリあたりのUID数
+
+    Yields:
+        (UIDのリスト, UID → 行データ(dict)): 見つからなかったUIDは辞書に含まれない
+    """
+    unique_uids = list(dict.fromkeys(uids))
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for chunk in _chunks(unique_uids, chunk_size):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            sql = f"SELECT * FROM player_status WHERE nfc_card_id IN ({placeholders})"
+            cursor.execute(sql, tuple(chunk))
+            yield chunk, {row['nfc_card_id']: row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def fetch_players_by_uids(conn, uids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    複数UIDのプレイヤーを WHERE nfc_card_id IN (...) でまとめて取得する
+
+    Args:
+        conn: MySQL接続オブジェクト
+        uids: 取得するUIDのリスト（重複可）
+        chunk_size: 1クエリあたりのUID数
+
+    Returns:
+        dict: UID → 行データ(dict)。見つからなかったUIDはキーに含まれない
+    """
+    found = {}
+    for _, rows in iter_players_by_uids(conn, uids, chunk_size):
+        found.update(rows)
+    return found
+
+# ============================================
+# 楽観的排他制御つきの保存
+# ============================================
+# 複数の登録ステーションが同じ行を更新しても上書きし合わないよう、
+# 行ごとの version カラムを使い、変更のあったカラムだけを
+# UPDATE ... WHERE version = ? で書き込む。
+
+# 保存結果のステータス
+SAVE_INSERTED = 'inserted'     # 新規に登録した
+SAVE_UPDATED = 'updated'       # 変更カラムを更新した
+SAVE_UNCHANGED = 'unchanged'   # DBと同じ内容だったので何もしなかった
+SAVE_CONFLICT = 'conflict'     # 他のステーションが先に更新していた
+
+# 保存対象のカラム（player_data のキー → DBのカラム名）
+SAVE_COLUMNS = {
+    'name': 'user_name',
+    'age': 'age',
+    'money': 'money',
+    'power': 'power',
+    'stamina': 'stamina',
+    'speed': 'speed',
+    'technique': 'technique',
+    'luck': 'luck',
+    'class': 'class'
+}
+
+class SaveResult:
+    """
+    save_player() の結果
+
+    Attributes:
+        status: SAVE_INSERTED / SAVE_UPDATED / SAVE_UNCHANGED / SAVE_CONFLICT
+        version: 保存後（衝突時は現在の）行のバージョン
+        changed: 実際に書き込んだカラム名のリスト
+        current: 衝突時の最新の行データ（呼び出し側でのマージ・再試行判断用）
+        attempts: UPDATE を試行した回数
+    """
+
+    def __init__(self, status, version=None, changed=None, current=None, attempts=0):
+        self.status = status
+        self.version = version
+        self.changed = changed or []
+        self.current = current
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        """保存できた（または保存不要だった）ならTrue"""
+        return self.status != SAVE_CONFLICT
+
+    def to_dict(self):
+        return {'status': self.status, 'version': self.version,
+                'changed': self.changed, 'attempts': self.attempts}
+
+def fetch_player(conn, nfc_card_id):
+    """
+    1件のプレイヤーを取得する
+
+    Returns:
+        dict: 行データ（見つからなければNone）
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM player_status WHERE nfc_card_id = %s", (nfc_card_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def changed_columns(player_data, db_row):
+    """
+    player_data のうちDBの行と値が異なるカラムを返す
+
+    Returns:
+        dict: DBのカラム名 → 新しい値
+    """
+    changes = {}
+    for key, column in SAVE_COLUMNS.items():
+        if key in player_data and player_data[key] != db_row.get(column):
+            changes[column] = player_data[key]
+    return changes
+
+def _insert_player(conn, player_data):
+    """新規行を version = 1 で挿入する（既に存在すれば None を返す）"""
+    columns = ['nfc_card_id'] + [SAVE_COLUMNS[k] for k in SAVE_COLUMNS if k in player_data]
+    values = [player_data['nfc_card_id']] + [player_data[k] for k in SAVE_COLUMNS if k in player_data]
+    sql = (f"INSERT INTO player_status ({', '.join(f'`{c}`' for c in columns)}, version) "
+           f"VALUES ({', '.join(['%s'] * len(values))}, 1)")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, tuple(values))
+        # 省略したカラムはDBの既定値になるため、挿入した行を読み直して集計する
+        player_stats.apply_delta(cursor, None, fetch_player(conn, player_data['nfc_card_id']))
+        conn.commit()
+        return columns[1:]
+    except mysql.connector.IntegrityError as err:
+        conn.rollback()
+        # 1062: 重複キー（読み取り後に他のステーションが同じUIDを登録した）
+        if err.errno == 1062:
+            return None
+        raise
+    finally:
+        cursor.close()
+
+def _update_player(conn, current, changes):
+    """
+    変更カラムだけを UPDATE ... WHERE version = ? で書き込む
+
+    Args:
+        current: 読み取った時点の行（この行の version のままである時だけ書き込む）
+        changes: DBのカラム名 → 新しい値
+
+    Returns:
+        bool: 更新できたらTrue（バージョン不一致ならFalse）
+    """
+    assignments = ', '.join(f"`{column}` = %s" for column in changes)
+    sql = (f"UPDATE player_status SET {assignments}, version = version + 1 "
+           f"WHERE nfc_card_id = %s AND version = %s")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, tuple(changes.values()) + (current['nfc_card_id'], current.get('version', 0)))
+        # version を必ず増やすので、条件に一致すれば affected rows は 1 になる
+        if cursor.rowcount != 1:
+            conn.rollback()
+            return False
+        # バージョンが一致した＝変更前の行は current のままなので、その差分を集計に反映する
+        player_stats.apply_delta(cursor, current, {**current, **changes})
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+
+def save_player(conn, player_data, expected_version=None, max_retries=3):
+    """
+    プレイヤーデータを楽観的排他制御つきで保存する
+
+    expected_version を指定しない場合は、最新の行と比較して変更カラムだけを書き込み、
+    書き込みの間に他のステーションが更新していたら最新の行を読み直して再試行する。
+    （他のステーションが変更したカラムのうち、こちらが触らないものは上書きしない）
+
+    expected_version を指定した場合は、行がそのバージョンのままである時だけ書き込み、
+    そうでなければ SAVE_CONFLICT を返す（呼び出し側でマージ・再試行を判断する）。
+
+    Args:
+        conn: MySQL接続オブジェクト
+        player_data: nfc_card_id と SAVE_COLUMNS のキーを持つ辞書（キーが無いカラムは更新しない）
+        expected_version: 編集の元にした行のバージョン（省略可）
+        max_retries: 自動再試行の最大回数
+
+    Returns:
+        SaveResult
+    """
+    nfc_card_id = player_data['nfc_card_id']
+    attempts = 0
+    while True:
+        current = fetch_player(conn, nfc_card_id)
+
+        if current is None:
+            if expected_version is not None:
+                # 編集中に行が削除された
+                return SaveResult(SAVE_CONFLICT, current=None, attempts=attempts)
+            attempts += 1
+            inserted = _insert_player(conn, player_data)
+            if inserted is not None:
+                return SaveResult(SAVE_INSERTED, version=1, changed=inserted, attempts=attempts)
+        else:
+            version = current.get('version', 0)
+            if expected_version is not None and version != expected_version:
+                return SaveResult(SAVE_CONFLICT, version=version, current=current, attempts=attempts)
+
+            changes = changed_columns(player_data, current)
+            if not changes:
+                return SaveResult(SAVE_UNCHANGED, version=version, attempts=attempts)
+
+            attempts += 1
+            if _update_player(conn, current, changes):
+                return SaveResult(SAVE_UPDATED, version=version + 1,
+                                  changed=list(changes.keys()), attempts=attempts)
+            if expected_version is not None:
+                return SaveResult(SAVE_CONFLICT, current=fetch_player(conn, nfc_card_id), attempts=attempts)
+
+        # 読み取りから書き込みの間に他のステーションが更新した → 読み直して再試行
+        if attempts > max_retries:
+            latest = fetch_player(conn, nfc_card_id)
+            return SaveResult(SAVE_CONFLICT, version=latest.get('version') if latest else None,
+                              current=latest, attempts=attempts)
+
+def rekey_player(conn, old_card_id, new_card_id):
+    """
+    プレイヤーの行を別のカードのUIDに付け替える（紛失したカードを新しいカードに復元した時）
+
+    Returns:
+        int: 更新した行数（元の行が無い、または新しいUIDの行が既にある場合は0）
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE player_status SET nfc_card_id = %s, version = version + 1 "
+            "WHERE nfc_card_id = %s AND NOT EXISTS ("
+            "SELECT 1 FROM (SELECT nfc_card_id FROM player_status WHERE nfc_card_id = %s) AS existing)",
+            (new_card_id, old_card_id, new_card_id)
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+# ============================================
+# 一括削除（purge_players.py 用）
+# ============================================
+# where には "nfc_card_id LIKE %s" のような条件式、params にはその値を渡す。
+
+def count_players(conn, where, params):
+    """
+    条件に一致する行数と player_id の範囲を返す（ロックしない読み取り）
+
+    Returns:
+        (件数, 最小player_id, 最大player_id)
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*), MIN(player_id), MAX(player_id) FROM player_status WHERE {where}",
+                       tuple(params))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def select_player_ids(conn, where, params, after_id, limit):
+    """
+    条件に一致する行の player_id を、after_id より後から主キー順に limit 件返す（ロックしない読み取り）
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT player_id FROM player_status WHERE player_id > %s AND ({where}) "
+                       f"ORDER BY player_id LIMIT %s", (after_id, *params, limit))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def delete_players_by_ids(conn, ids, where, params):
+    """
+    指定 player_id の行を削除し、集計からも差し引く（1トランザクション）
+
+    選択してから削除するまでに更新された行が条件から外れていれば削除しない。
+
+    Returns:
+        int: 削除した行数
+    """
+    if not ids:
+        return 0
+    id_list = ', '.join(['%s'] * len(ids))
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT * FROM player_status WHERE player_id IN ({id_list}) AND ({where}) "
+                       f"ORDER BY player_id FOR UPDATE", (*ids, *params))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+        locked_ids = [row['player_id'] for row in rows]
+        cursor.execute(f"DELETE FROM player_status WHERE player_id IN ({', '.join(['%s'] * len(locked_ids))})",
+                       tuple(locked_ids))
+        deleted = cursor.rowcount
+        player_stats.apply_removed(cursor, rows)
+        conn.commit()
+        return deleted
+    finally:
+        cursor.close()
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import signal
+import threading
+import tracemalloc
+import cProfile
+import pstats
+import io
+import traceback
+from collections import Counter
+from datetime import datetime
+
+from app_paths import data_path
+
+# ============================================
+# 常駐モニター向けのプロファイリング
+# ============================================
+# monitor_nfc.py を再起動せずに中身を覗くための仕組み（既定は無効）。
+#   有効化: 環境変数 NFC_PROFILE=sample|cprofile または --profile [sample|cprofile]
+#   ダンプ: SIGUSR1（Windowsでは Ctrl+Break = SIGBREAK）を送る
+#   出力先: apps/nfc_tool/data/profile_YYYYmmdd_HHMMSS_mmm.txt
+#
+# sample   : 別スレッドが各スレッドのスタックを定期的に採取する統計的プロファイラ（低負荷）
+# cprofile : cProfile で全関数呼び出しを計測する（正確だが負荷が高い）
+#            cProfile はスレッド単位でしか有効にならないため、開始後に起動したスレッド
+#            （pyscard 呼び出し用のエグゼキュータなど）にもそれぞれ Profile を仕掛けて合算する
+# どちらのモードでも tracemalloc による確保量の上位と、前回ダンプからの増分を出力する。
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+# 状態ゲージ（RSS・ループ回数）を出力する間隔（秒）
+STATUS_INTERVAL = float(os.getenv('NFC_STATUS_INTERVAL', 60))
+# サンプリング間隔（秒）
+SAMPLE_INTERVAL = float(os.getenv('NFC_PROFILE_SAMPLE_INTERVAL', 0.01))
+# tracemalloc が記録するスタックの深さ
+TRACEMALLOC_FRAMES = int(os.getenv('NFC_TRACEMALLOC_FRAMES', 10))
+# レポートに載せる上位件数
+TOP_N = 30
+
+def profile_mode_from_env():
+    """環境変数 NFC_PROFILE からモードを決める（'1' は sample とみなす。無効ならNone）"""
+    value = os.getenv('NFC_PROFILE', '').strip().lower()
+    if value in ('', '0', 'off', 'false'):
+        return None
+    return value if value in PROFILE_MODES else 'sample'
+
+def current_rss_bytes():
+    """
+    現在の常駐メモリ量（RSS, バイト）を返す
+
+    psutil があればそれを使い、無ければ /proc（Linux）を読む。
+    どちらも使えない場合は getrusage のピーク値で代用する（取得できなければNone）。
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS はバイト、Linux はキロバイト単位
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except Exception:
+        return None
+
+class StackSampler(threading.Thread):
+    """
+    スレッドのスタックを一定間隔で採取する統計的プロファイラ
+
+    関数ごとに「スタックの先頭にいた回数（self）」と「スタック上にいた回数（total）」を数える。
+    target_thread_id が None の場合は、自身を除く全スレッドを採取する
+    （asyncio 版モニターでは pyscard 呼び出しが別スレッドで動くため）。
+    """
+
+    def __init__(self, target_thread_id=None, interval=SAMPLE_INTERVAL):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            if self.target_thread_id is not None:
+                frames = {self.target_thread_id: frames.get(self.target_thread_id)}
+            else:
+                frames.pop(threading.get_ident(), None)
+            frames = [frame for frame in frames.values() if frame is not None]
+            if not frames:
+                continue
+            with self.lock:
+                self.samples += 1
+                for frame in frames:
+                    self._count(frame)
+
+    def _count(self, frame):
+        """1スレッド分のスタックを集計する（lock を取得した状態で呼び出す）"""
+        seen = set()
+        top = True
+        while frame is not None:
+            code = frame.f_code
+            key = f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+            if top:
+                # self は実行中の行まで区別する（どこで時間を使っているかを特定しやすくするため）
+                self.self_counts[f"{key} (line {frame.f_lineno})"] += 1
+                top = False
+            # 再帰で同じ関数が複数回現れても1回と数える
+            if key not in seen:
+                self.total_counts[key] += 1
+                seen.add(key)
+            frame = frame.f_back
+
+    def stop(self):
+        self._stopped.set()
+
+    def report(self):
+        """採取結果をテキストで返す"""
+        with self.lock:
+            samples = max(1, self.samples)
+            lines = [f"サンプル数: {samples}（間隔 {self.interval * 1000:.0f}ms）", "",
+                     f"{'self%':>7} {'total%':>7}  関数"]
+            for key, count in self.self_counts.most_common(TOP_N):
+                function_key = key.rsplit(' (line ', 1)[0]
+                lines.append(f"{count / samples * 100:>6.1f}% {self.total_counts[function_key] / samples * 100:>6.1f}%  {key}")
+            lines += ["", "--- total 上位 ---"]
+            for key, count in self.total_counts.most_common(TOP_N):
+                lines.append(f"{count / samples * 100:>6.1f}%  {key}")
+        return "\n".join(lines)
+
+class _ProfileSnapshot:
+    """
+    計測中の cProfile.Profile の途中経過
+
+    pstats.Stats に Profile をそのまま渡すと計測が止まるため、集計結果だけを渡す
+    """
+
+    def __init__(self, profile):
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        pass
+
+class MonitorProfiler:
+    """
+    モニターのメインループに組み込むプロファイラ
+
+    シグナルハンドラではフラグを立てるだけにし、実際のダンプはメインループから
+    tick() が呼ばれたタイミングで行う（ループの途中状態を壊さないため）。
+    複数スレッドを採取するため、割合（%）はスレッド数に応じて100%を超えることがある。
+    """
+
+    def __init__(self, mode='sample', status_interval=STATUS_INTERVAL):
+        self.mode = mode
+        self.status_interval = status_interval
+        self.started_at = time.time()
+        self.sampler = None
+        self.profiles = []
+        self.profiles_lock = threading.Lock()
+        self.last_snapshot = None
+        self.dump_requested = False
+        self.last_status_at = time.time()
+        self.last_counters = {}
+
+    def start(self):
+        """計測を開始し、ダンプ用のシグナルハンドラを登録する"""
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self.mode == 'cprofile':
+            self._enable_for_current_thread()
+            # 以降に起動されるスレッドでは、最初の呼び出し時にそのスレッド用の Profile に差し替える
+            threading.setprofile(self._bootstrap_thread_profile)
+        else:
+            self.sampler = StackSampler()
+            self.sampler.start()
+
+        dump_signal = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+        if dump_signal is not None:
+            signal.signal(dump_signal, lambda signum, frame: self.request_dump())
+
+    def _enable_for_current_thread(self):
+        """呼び出し元スレッドで cProfile を有効にし、集計対象に加える"""
+        profile = cProfile.Profile()
+        with self.profiles_lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _bootstrap_thread_profile(self, frame, event, arg):
+        """threading.setprofile 用のフック（新しいスレッドで1度だけ呼ばれ、cProfile に置き換わる）"""
+        self._enable_for_current_thread()
+
+    def request_dump(self):
+        """次の tick() でレポートを出力するよう要求する"""
+        self.dump_requested = True
+
+    def gauges(self, counters):
+        """
+        状態ゲージ（RSS・CPU時間・ループ回数とその増加率）を返す
+
+        Args:
+            counters: ループ回数などのカウンタ（名前 → 累積値）
+        """
+        now = time.time()
+        elapsed = max(1e-6, now - self.last_status_at)
+        rates = {f"{name}_per_sec": round((value - self.last_counters.get(name, 0)) / elapsed, 2)
+                 for name, value in counters.items()}
+        traced_current, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        return {
+            'uptime_sec': int(now - self.started_at),
+            'rss_bytes': current_rss_bytes(),
+            'cpu_sec': round(time.process_time(), 2),
+            'traced_bytes': traced_current,
+            'traced_peak_bytes': traced_peak,
+            'threads': threading.active_count(),
+            **counters,
+            **rates
+        }
+
+    def tick(self, counters):
+        """
+        メインループから呼び出す。必要に応じてダンプ・状態ゲージ出力を行う
+
+        Args:
+            counters: ループ回数などのカウンタ
+
+        Returns:
+            list: 標準出力に送るべきイベント（{"type": "status", ...}）のリスト
+        """
+        events = []
+        if self.dump_requested:
+            self.dump_requested = False
+            path = self.dump(counters)
+            events.append({'type': 'status', 'message': 'profile_dumped', 'path': str(path)})
+
+        if time.time() - self.last_status_at >= self.status_interval:
+            events.append({'type': 'status', 'message': 'gauges', 'payload': self.gauges(counters)})
+            self.last_status_at = time.time()
+            self.last_counters = dict(counters)
+        return events
+
+    def _profile_report(self):
+        """CPUプロファイルのテキストを返す"""
+        if self.sampler:
+            return self.sampler.report()
+        # 他スレッドの Profile は計測を止められない（disable/enable は呼び出し元スレッドに効く）ため、
+        # 有効なまま途中経過を取り出して合算する
+        with self.profiles_lock:
+            snapshots = [_ProfileSnapshot(profile) for profile in self.profiles]
+        out = io.StringIO()
+        stats = pstats.Stats(*snapshots, stream=out)
+        out.write(f"計測スレッド数: {len(snapshots)}\n")
+        stats.sort_stats('cumulative').print_stats(TOP_N)
+        return out.getvalue()
+
+    def _memory_report(self):
+        """tracemalloc の上位確保箇所と、前回ダンプからの増分を返す"""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        lines = ["--- 確保量 上位 ---"]
+        for stat in snapshot.statistics('lineno')[:TOP_N]:
+            lines.append(str(stat))
+        if self.last_snapshot is not None:
+            lines += ["", "--- 前回ダンプからの増分 上位 ---"]
+            for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:TOP_N]:
+                lines.append(str(stat))
+        self.last_snapshot = snapshot
+        return "\n".join(lines)
+
+    def dump(self, counters):
+        """
+        CPUプロファイルとメモリ確保状況をファイルに書き出す
+
+        Returns:
+            Path: 出力したファイルのパス
+        """
+        # 同じ秒に続けてダンプしても上書きしないよう、ミリ秒まで含める
+        path = data_path(f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]}.txt")
+        sections = [f"=== monitor_nfc プロファイル ({self.mode}) {datetime.now().isoformat()} ===",
+                    f"ゲージ: {self.gauges(counters)}", ""]
+        try:
+            sections += ["=== CPU ===", self._profile_report(), ""]
+        except Exception:
+            sections += ["=== CPU ===", traceback.format_exc(), ""]
+        try:
+            sections += ["=== メモリ (tracemalloc) ===", self._memory_report()]
+        except Exception:
+            sections += ["=== メモリ (tracemalloc) ===", traceback.format_exc()]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(sections) + "\n")
+        return path
@@ -0,0 +1,174 @@
+import sys
+import io
+import json
+import time
+import argparse
+from datetime import datetime
+import mysql.connector
+import db_access
+import player_store
+
+# ============================================
+# プレイヤーデータの一括削除
+# ============================================
+# 負荷試験・イベント後の後片付け用。ステーションが稼働中でも書き込みを止めないよう、
+# 条件に一致する行を主キー（player_id）順に少しずつ削除し、チャンクの間で休む。
+# 1チャンクごとに短いトランザクションで削除するため、行ロックはそのチャンク分だけで済む。
+#
+# 使用例:
+#   python purge_players.py --uid TEST:DUMMY:UID:001               # insert_test_data.py のテストデータ
+#   python purge_players.py --prefix 04:FE: --dry-run               # db_benchmark.py の合成データの件数確認
+#   python purge_players.py --prefix 04:FE: --chunk-size 500 --sleep 0.2 --yes
+#   python purge_players.py --updated-before "2026-01-01" --like "TEST:%" --yes
+#
+# 条件を複数指定した場合はすべてを満たす行が対象（条件なしでは実行しない）。
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_SLEEP = 0.1
+
+def _escape_like(text):
+    """LIKE の特殊文字をエスケープする（前方一致用）"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _parse_datetime(text):
+    """'2026-01-01' や '2026-01-01 12:00:00' 形式の日時を datetime にする"""
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日時の形式が不正です: {text}")
+
+def build_filter(args):
+    """
+    コマンドライン引数から WHERE 条件を組み立てる
+
+    Returns:
+        (条件式, パラメータのリスト)  条件が1つも無ければ (None, [])
+    """
+    clauses = []
+    params = []
+    if args.uid:
+        clauses.append(f"nfc_card_id IN ({', '.join(['%s'] * len(args.uid))})")
+        params += args.uid
+    if args.prefix:
+        clauses.append("nfc_card_id LIKE %s")
+        params.append(_escape_like(args.prefix) + '%')
+    if args.like:
+        clauses.append("nfc_card_id LIKE %s")
+        params.append(args.like)
+    if args.updated_after:
+        clauses.append("updated_at >= %s")
+        params.append(args.updated_after)
+    if args.updated_before:
+        clauses.append("updated_at < %s")
+        params.append(args.updated_before)
+    if not clauses:
+        return None, []
+    return ' AND '.join(clauses), params
+
+def _report(event, as_json):
+    if as_json:
+        print(json.dumps(event, ensure_ascii=False, default=str))
+    elif event['type'] == 'plan':
+        print(f"対象: {event['matched']:,} 件 (player_id {event['min_id']} 〜 {event['max_id']})")
+    elif event['type'] == 'progress':
+        percent = f"{event['deleted'] / event['matched'] * 100:5.1f}%" if event['matched'] else '  -  '
+        print(f"[{event['deleted']:>9,}/{event['matched']:,}] {percent}  "
+              f"チャンク {event['chunk']:,} 件  {event['rows_per_sec']:,.0f} 件/秒  (player_id ≦ {event['last_id']})")
+    elif event['type'] == 'done':
+        print(f"✅ 削除が完了しました。 (削除件数: {event['deleted']:,}, 所要時間: {event['elapsed_sec']} 秒)")
+    sys.stdout.flush()
+
+def purge(where, params, chunk_size=DEFAULT_CHUNK_SIZE, sleep=DEFAULT_SLEEP,
+          max_rows_per_sec=None, matched=None, as_json=False):
+    """
+    条件に一致する行を主キー順にチャンク単位で削除する
+
+    Args:
+        where, params: 削除条件
+        chunk_size: 1トランザクションで削除する行数
+        sleep: チャンク間の最低待ち時間（秒）
+        max_rows_per_sec: 削除速度の上限（件/秒, Noneなら無制限）
+        matched: 事前に数えた対象件数（進捗表示用）
+
+    Returns:
+        int: 削除した行数
+    """
+    deleted = 0
+    last_id = 0
+    started = time.perf_counter()
+    while True:
+        chunk_started = time.perf_counter()
+        # 選択はロックしない読み取り、削除は選んだ行だけをロックする短いトランザクション
+        ids = db_access.run(lambda conn: player_store.select_player_ids(conn, where, params, last_id, chunk_size))
+        if not ids:
+            break
+        count = db_access.run(lambda conn: player_store.delete_players_by_ids(conn, ids, where, params))
+        deleted += count
+        last_id = ids[-1]
+
+        elapsed = time.perf_counter() - started
+        _report({'type': 'progress', 'deleted': deleted, 'matched': matched or deleted, 'chunk': count,
+                 'last_id': last_id, 'rows_per_sec': deleted / elapsed if elapsed else 0}, as_json)
+
+        # 他のステーションの書き込みを優先させるため、チャンクの間で休む
+        wait = sleep
+        if max_rows_per_sec:
+            wait = max(wait, count / max_rows_per_sec - (time.perf_counter() - chunk_started))
+        if wait > 0:
+            time.sleep(wait)
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description='player_status の一括削除ツール（チャンク分割・速度制限つき）')
+    parser.add_argument('--uid', action='append', help='削除するUID（複数指定可）')
+    parser.add_argument('--prefix', help='UIDの前方一致（例: 04:FE:）')
+    parser.add_argument('--like', help='UIDのLIKEパターン（例: TEST:%%）')
+    parser.add_argument('--updated-after', type=_parse_datetime, help='この日時以降に更新された行')
+    parser.add_argument('--updated-before', type=_parse_datetime, help='この日時より前に更新された行')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='1トランザクションで削除する行数 (既定: %(default)s)')
+    parser.add_argument('--sleep', type=float, default=DEFAULT_SLEEP,
+                        help='チャンク間の待ち時間（秒, 既定: %(default)s）')
+    parser.add_argument('--max-rows-per-sec', type=float, default=None, help='削除速度の上限（件/秒）')
+    parser.add_argument('--dry-run', action='store_true', help='削除せずに対象件数だけ表示する')
+    parser.add_argument('--yes', action='store_true', help='確認せずに削除する')
+    parser.add_argument('--json', action='store_true', help='進捗をJSON Linesで出力する')
+    args = parser.parse_args()
+
+    print("=== プレイヤーデータ一括削除ツール ===", file=sys.stderr)
+    where, params = build_filter(args)
+    if where is None:
+        print("エラー: 削除条件（--uid / --prefix / --like / --updated-after / --updated-before）を指定してください。",
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        matched, min_id, max_id = db_access.run(lambda conn: player_store.count_players(conn, where, params))
+        _report({'type': 'plan', 'matched': matched, 'min_id': min_id, 'max_id': max_id,
+                 'dry_run': args.dry_run}, args.json)
+        if args.dry_run or not matched:
+            if not matched:
+                print("⚠️ 削除対象のデータが見つかりませんでした。", file=sys.stderr)
+            return
+
+        if not args.yes:
+            answer = input(f"{matched:,} 件を削除します。よろしいですか？ [y/N]: ")
+            if answer.strip().lower() not in ('y', 'yes'):
+                print("中止しました。", file=sys.stderr)
+                return
+
+        started = time.perf_counter()
+        deleted = purge(where, params, max(1, args.chunk_size), args.sleep, args.max_rows_per_sec,
+                        matched, args.json)
+        _report({'type': 'done', 'deleted': deleted,
+                 'elapsed_sec': round(time.perf_counter() - started, 2)}, args.json)
+
+    except mysql.connector.Error as err:
+        print(f"❌ データベースエラー: {err}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
@@ -0,0 +1,416 @@
+import sys
+import io
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import queue
+from datetime import datetime
+
+import mysql.connector
+import db_access
+import player_store
+from app_paths import data_path
+
+# ============================================
+# 設定
+# ============================================
+
+# 不一致時にどちらを正とするか
+#   card   : カードの内容でDBを更新する
+#   db     : DBの内容を正とし、カードの書き直しが必要なものとして報告する
+#   newest : カードを読んだ時刻とDBの updated_at を比べて新しい方を正とする
+POLICIES = ('card', 'db', 'newest')
+DEFAULT_POLICY = os.getenv('NFC_RECONCILE_POLICY', 'card')
+# 不一致を実際に修復するか（既定は報告のみ）
+DEFAULT_REPAIR = os.getenv('NFC_RECONCILE_REPAIR', '0') == '1'
+# 1回の照合で処理するキューの件数（この件数を IN (...) でまとめて引く）
+DEFAULT_BATCH_SIZE = int(os.getenv('NFC_RECONCILE_BATCH', 200))
+# 常駐ワーカーが照合を行う間隔（秒）
+DEFAULT_INTERVAL = float(os.getenv('NFC_RECONCILE_INTERVAL', 30))
+
+# カードのステータス配列（ページ9-12を2バイトずつ読んだもの）の並び
+STATUS_ORDER = ['money', 'power', 'stamina', 'speed', 'technique', 'luck', 'class']
+
+# カードの名前領域（ページ4-8）のバイト数。nfc_writer はこれを超える分を切り捨てて書き込む
+NAME_BYTES = 20
+# monitor_nfc が名前をUTF-8として復号できなかった時に返す値
+UNDECODABLE_NAME = 'Unknown'
+
+QUEUE_PATH = data_path('reconcile_queue.sqlite3')
+REPORT_PATH = data_path('reconcile_report.jsonl')
+
+# ============================================
+# カード画像 → DBレコード変換
+# ============================================
+
+def card_record_from_payload(payload):
+    """
+    monitor_nfc.read_nfc_data() の結果を player_status のカラム名に合わせた辞書に変換する
+
+    Args:
+        payload: {"idm", "name", "status", "inventory"} を持つ辞書
+
+    Returns:
+        dict: nfc_card_id と CARD_COLUMNS を持つ辞書
+    """
+    status = list(payload.get('status') or [])
+    record = {'nfc_card_id': payload.get('idm'), 'user_name': payload.get('name')}
+    for i, key in enumerate(STATUS_ORDER):
+        record[key] = status[i] if i < len(status) else None
+    return record
+
+def card_name(name):
+    """
+    DBの名前をカードに書き込んで読み戻した時の名前を返す
+
+    nfc_writer と同じく20バイトで切り捨て、monitor_nfc と同じく復号する
+    （マルチバイト文字の途中で切れて復号できなければ 'Unknown'）。
+    """
+    raw = (name or '').encode('utf-8').ljust(NAME_BYTES, b'\x00')[:NAME_BYTES]
+    try:
+        return raw.decode('utf-8').rstrip('\x00')
+    except UnicodeDecodeError:
+        return UNDECODABLE_NAME
+
+def is_complete_name(name):
+    """カードから読んだ名前が切り捨て・復号失敗の無い完全な名前かどうか（DBの修復に使ってよいか）"""
+    return bool(name) and name != UNDECODABLE_NAME and len(name.encode('utf-8')) < NAME_BYTES
+
+def diff_record(card_record, db_row):
+    """
+    カードとDBでカラム単位の差分を取る
+
+    名前はカードに20バイトまでしか入らないため、DBの名前を同じように切り詰めてから比べる。
+
+    Returns:
+        dict: カラム名 → {"card": 値, "db": 値}（一致していれば空）
+    """
+    diff = {}
+    for column in player_store.CARD_COLUMNS:
+        card_value = card_record.get(column)
+        db_value = db_row.get(column)
+        expected = card_name(db_value) if column == 'user_name' and db_value is not None else db_value
+        if card_value != expected:
+            diff[column] = {'card': card_value, 'db': db_value}
+    return diff
+
+def _db_updated_ts(db_row):
+    """DBの updated_at をUNIX時刻に変換する（DBサーバーとこの端末のタイムゾーンが同じ前提）"""
+    updated_at = db_row.get('updated_at')
+    if isinstance(updated_at, datetime):
+        return updated_at.timestamp()
+    return 0.0
+
+def decide_winner(policy, seen_at, db_row):
+    """
+    ポリシーに従い、不一致時に正とする側 ('card' / 'db') を決める
+
+    newest の場合、カードを読み取った時刻がDBの最終更新より後ならカードを正とする。
+    （カードへの書き込み時刻はカード上に無いため、読み取り時刻で近似している）
+    """
+    if policy == 'card':
+        return 'card'
+    if policy == 'db':
+        return 'db'
+    return 'card' if seen_at >= _db_updated_ts(db_row) else 'db'
+
+# ============================================
+# ローカルキュー
+# ============================================
+
+class ReconcileQueue:
+    """
+    モニターが読み取ったカード画像を溜めておくローカルキュー（SQLite）
+
+    SQLite接続はスレッドを跨いで使えないため、使うスレッド内で生成すること
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.conn = sqlite3.connect(str(path), timeout=10)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS card_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uid TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                result TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_card_images_status ON card_images (status, id)")
+        self.conn.commit()
+
+    def enqueue_many(self, items):
+        """
+        カード画像をまとめて追加する
+
+        Args:
+            items: (payload, seen_at) のリスト
+        """
+        rows = [(p.get('idm'), json.dumps(p, ensure_ascii=False), seen_at)
+                for p, seen_at in items if p.get('idm')]
+        if rows:
+            self.conn.executemany(
+                "INSERT INTO card_images (uid, payload, seen_at) VALUES (?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+    def fetch_pending(self, limit):
+        """未処理のカード画像を古い順に最大 limit 件返す"""
+        cur = self.conn.execute(
+            "SELECT id, uid, payload, seen_at FROM card_images WHERE status = 'pending' ORDER BY id LIMIT ?",
+            (limit,)
+        )
+        return [(row[0], row[1], json.loads(row[2]), row[3]) for row in cur.fetchall()]
+
+    def mark(self, results):
+        """
+        処理結果を記録する
+
+        Args:
+            results: (id, status, result_dict) のリスト
+        """
+        self.conn.executemany(
+            "UPDATE card_images SET status = ?, result = ? WHERE id = ?",
+            [(status, json.dumps(result, ensure_ascii=False, default=str), row_id)
+             for row_id, status, result in results]
+        )
+        self.conn.commit()
+
+    def prune(self):
+        """
+        処理済み（done / superseded）の行を削除する
+
+        不一致の内容はレポートファイルに残しているため、キューには未処理分だけを持てばよい。
+
+        Returns:
+            int: 削除した行数
+        """
+        cur = self.conn.execute("DELETE FROM card_images WHERE status != 'pending'")
+        self.conn.commit()
+        return cur.rowcount
+
+    def pending_count(self):
+        """未処理件数を返す"""
+        return self.conn.execute("SELECT COUNT(*) FROM card_images WHERE status = 'pending'").fetchone()[0]
+
+# ============================================
+# 照合処理
+# ============================================
+
+def _repair_db(conn, card_record, db_row):
+    """
+    カードの内容でDBを更新する（カードに無い age は触らない）
+
+    照合に使った行のバージョンを期待値として渡すため、照合後に他のステーションが
+    更新していた場合は書き込まずに衝突として返す。
+    カードの名前が切り捨てられている可能性がある・復号できなかった場合は名前を更新しない。
+
+    Returns:
+        player_store.SaveResult（名前が使えず新規登録できない場合はNone）
+    """
+    player_data = {'nfc_card_id': card_record['nfc_card_id']}
+    if is_complete_name(card_record['user_name']):
+        player_data['name'] = card_record['user_name']
+    elif db_row is None:
+        # user_name は必須のため、不完全な名前では登録できない
+        return None
+    for key in STATUS_ORDER:
+        player_data[key] = card_record[key]
+    expected_version = db_row.get('version', 0) if db_row else None
+    return player_store.save_player(conn, player_data, expected_version=expected_version)
+
+def reconcile_pending(rqueue, policy=DEFAULT_POLICY, repair=DEFAULT_REPAIR, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    キューの未処理分を1バッチ分DBと照合する
+
+    同じUIDが複数回キューにある場合は最新の画像だけを照合し、古いものは superseded とする。
+
+    Args:
+        rqueue: ReconcileQueue
+        policy: 'card' / 'db' / 'newest'
+        repair: Trueならカードを正とした不一致をDBに反映する
+        batch_size: 1バッチの最大件数
+
+    Returns:
+        list: 照合結果（レポート）の辞書のリスト。キューが空なら空リスト
+
+    Raises:
+        mysql.connector.Error: DBに接続できない場合（キューは未処理のまま残る）
+    """
+    pending = rqueue.fetch_pending(batch_size)
+    if not pending:
+        return []
+
+    # UIDごとに最新の画像だけを残す
+    latest = {}
+    marks = []
+    for row_id, uid, payload, seen_at in pending:
+        if uid in latest:
+            marks.append((latest[uid][0], 'superseded', {'by': row_id}))
+        latest[uid] = (row_id, payload, seen_at)
+
+    def reconcile(conn):
+        db_rows = player_store.fetch_players_by_uids(conn, list(latest.keys()))
+        reports = []
+        for uid, (row_id, payload, seen_at) in latest.items():
+            card_record = card_record_from_payload(payload)
+            db_row = db_rows.get(uid)
+            report = {'type': 'reconcile', 'uid': uid, 'seen_at': seen_at, 'policy': policy}
+
+            if db_row is None:
+                report['status'] = 'missing_in_db'
+                winner = 'db' if policy == 'db' else 'card'
+                diff = {}
+            else:
+                diff = diff_record(card_record, db_row)
+                report['status'] = 'diverged' if diff else 'in_sync'
+                winner = decide_winner(policy, seen_at, db_row)
+
+            report['diff'] = diff
+            if report['status'] == 'in_sync':
+                report['action'] = 'none'
+            elif winner == 'db' and db_row is None:
+                report['action'] = 'report_only'
+            elif winner == 'db':
+                # カードの書き直しはカードがリーダー上にある時にしかできないため、報告に留める
+                report['action'] = 'rewrite_card'
+            elif repair:
+                result = _repair_db(conn, card_record, db_row)
+                if result is None or result.status == player_store.SAVE_UNCHANGED:
+                    # 修復できる差分が無い（名前の切り捨てだけなど）
+                    report['action'] = 'report_only'
+                elif result.ok:
+                    report['action'] = 'updated_db' if db_row else 'inserted_db'
+                else:
+                    # 照合中に更新された行は次にカードを読んだ時に改めて照合する
+                    report['action'] = 'conflict'
+            else:
+                report['action'] = 'report_only'
+            report['winner'] = winner
+            reports.append((row_id, report))
+        return reports
+
+    # 修復（保存と集計の加算）を伴う場合は、実行中に接続が切れても再試行しない
+    reports = db_access.run(reconcile, retry_on_lost=not repair)
+
+    marks.extend((row_id, 'done', report) for row_id, report in reports)
+    rqueue.mark(marks)
+
+    # 不一致があったものはレポートファイルに残す
+    diverged = [report for _, report in reports if report['status'] != 'in_sync']
+    if diverged:
+        with open(REPORT_PATH, 'a', encoding='utf-8') as f:
+            for report in diverged:
+                f.write(json.dumps(report, ensure_ascii=False, default=str) + "\n")
+    return [report for _, report in reports]
+
+# ============================================
+# 常駐ワーカー（monitor_nfc から利用）
+# ============================================
+
+class ReconcileWorker(threading.Thread):
+    """
+    モニターのタップ処理を遅らせないよう、キュー書き込みと照合を別スレッドで行うワーカー
+
+    submit() はメモリ上のキューに積むだけなので、カード読み取りのループをブロックしない
+    """
+
+    def __init__(self, policy=DEFAULT_POLICY, repair=DEFAULT_REPAIR,
+                 interval=DEFAULT_INTERVAL, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(name='reconcile-worker', daemon=True)
+        self.policy = policy
+        self.repair = repair
+        self.interval = interval
+        self.batch_size = batch_size
+        # 溢れた場合は取りこぼす（照合は次回のタップで追いつけるため、タップを止めない方を優先）
+        self.inbox = queue.Queue(maxsize=1000)
+
+    def submit(self, payload):
+        """読み取ったカード画像を照合対象として登録する（ブロックしない）"""
+        try:
+            self.inbox.put_nowait((payload, time.time()))
+        except queue.Full:
+            pass
+
+    def _drain(self, rqueue, timeout):
+        """メモリ上のキューをまとめてSQLiteに書き出す"""
+        items = []
+        try:
+            items.append(self.inbox.get(timeout=timeout))
+            while True:
+                items.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        rqueue.enqueue_many(items)
+
+    def run(self):
+        rqueue = ReconcileQueue()
+        next_run = time.time() + self.interval
+        while True:
+            try:
+                self._drain(rqueue, timeout=max(0.0, next_run - time.time()))
+                if time.time() < next_run:
+                    continue
+                next_run = time.time() + self.interval
+                reports = []
+                while True:
+                    batch = reconcile_pending(rqueue, self.policy, self.repair, self.batch_size)
+                    reports.extend(batch)
+                    # 重複UIDをまとめた後の件数ではバッチが埋まったか分からないため、残りの有無で判断する
+                    if not batch or rqueue.pending_count() == 0:
+                        break
+                rqueue.prune()
+                diverged = [r for r in reports if r['status'] != 'in_sync']
+                if diverged:
+                    print(f"照合: {len(reports)}件中 {len(diverged)}件の不一致を検出しました。", file=sys.stderr)
+            except mysql.connector.Error as err:
+                # DB停止中はキューに残しておき、次の周期で再試行する
+                print(f"照合をスキップしました（DBエラー）: {err}", file=sys.stderr)
+            except Exception as e:
+                print(f"照合中に予期せぬエラーが発生しました: {e}", file=sys.stderr)
+
+# ============================================
+# メイン処理（手動実行・定期実行用）
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='カードとDB(player_status)の照合ツール')
+    parser.add_argument('--policy', choices=POLICIES, default=DEFAULT_POLICY,
+                        help='不一致時にどちらを正とするか (既定: %(default)s)')
+    parser.add_argument('--repair', action='store_true', default=DEFAULT_REPAIR,
+                        help='カードを正とした不一致をDBに反映する')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='1回のDB照会で処理する件数')
+    parser.add_argument('--watch', type=float, default=0,
+                        help='指定秒ごとに繰り返し実行する（0なら未処理分を処理して終了）')
+    args = parser.parse_args()
+
+    rqueue = ReconcileQueue()
+    while True:
+        try:
+            while True:
+                reports = reconcile_pending(rqueue, args.policy, args.repair, args.batch_size)
+                if not reports:
+                    break
+                for report in reports:
+                    print(json.dumps(report, ensure_ascii=False, default=str))
+                sys.stdout.flush()
+            rqueue.prune()
+        except mysql.connector.Error as err:
+            print(f"データベースエラー: {err}", file=sys.stderr)
+            if not args.watch:
+                sys.exit(1)
+
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    # 文字化け対策
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    main()
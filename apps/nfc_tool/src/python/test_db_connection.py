@@ -1,42 +1,39 @@
-import os
 import mysql.connector
-from dotenv import load_dotenv
 import sys
-
-# .envファイルを読み込む
-load_dotenv()
+import db_access
 
 def test_connection():
     print("=== データベース接続テスト開始 ===")
     
     # 環境変数の取得と表示（パスワードは隠す）
-    host = os.getenv('DB_HOST', 'localhost')
-    user = os.getenv('DB_USER', 'root')
-    password = os.getenv('DB_PASSWORD', '')
-    dbname = os.getenv('DB_NAME', 'nfc_game_db')
-    port = os.getenv('DB_PORT', 3306)
+    config = db_access.get_db_config()
+    host = config['host']
+    user = config['user']
+    password = config['password']
+    dbname = config['database']
+    port = config['port']
     
     # パスワードのマスク表示
     masked_password = '*' * len(password) if password else '(空)'
     
     print(f"設定: HOST={host}, USER={user}, PASS={masked_password}, DB={dbname}, PORT={port}")
-    
-    config = {
-        'host': host,
-        'user': user,
-        'password': password,
-        'database': dbname,
-        'port': int(port)
-    }
+    print(f"タイムアウト: 接続={config['connection_timeout']}秒, クエリ={db_access.QUERY_TIMEOUT_MS}ms")
+
+    # サーキットブレーカーの状態（他のスクリプトがDB停止を検知しているか）
+    breaker = db_access.get_breaker()
+    print(f"サーキットブレーカー: {breaker.state} (連続失敗: {breaker.failures}回)")
 
     conn = None
     try:
         # 接続試行
+        # 診断目的のため、ブレーカーやリトライを通さず直接1回だけ接続する
         print("接続を試みています...")
         conn = mysql.connector.connect(**config)
         
         if conn.is_connected():
             print("✅ データベース接続成功！")
+            # 接続できたのでブレーカーを閉じ、他のスクリプトが即座にDBを使えるようにする
+            breaker.record_success()
             
             # サーバー情報の取得
             db_info = conn.get_server_info()
@@ -84,6 +81,7 @@ CREATE TABLE IF NOT EXISTS player_status (
     luck INT NOT NULL DEFAULT 0,
     class INT NOT NULL DEFAULT 1,
     money INT NOT NULL DEFAULT 0,
+    version INT NOT NULL DEFAULT 0,
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );""")